@@ -0,0 +1,128 @@
+import hashlib
+import os
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, BinaryIO, NamedTuple
+from weakref import WeakKeyDictionary
+from zipfile import ZIP_DEFLATED, ZIP_STORED, ZipFile, ZipInfo
+
+from beet import Pack, PackFile, TextFileBase
+from repro_zipfile import date_time, file_mode  # type: ignore ; no stub
+
+# Deterministic zips of packs, for release artifacts and the patch hash of the manifest.
+# Files are serialized on a thread pool, then written in beet's dump order through ZipFile.writestr.
+# The zips are byte for byte what ReproducibleZipFile writes when dumping the sorted pack files, so existing patch hashes stay valid
+
+# serialized bytes of pack files, reused by later zips of the same pack while the file is unchanged
+_entry_data: WeakKeyDictionary[PackFile, tuple[Any, bytes]] = WeakKeyDictionary()
+
+
+class ArchiveEntry(NamedTuple):
+    zinfo: ZipInfo
+    data: bytes # uncompressed, compressed by writestr as the zinfo asks
+
+
+def zip_pack(pack: Pack[Any], destination: Path, compression: int = ZIP_DEFLATED):
+    """Writes the pack to a deterministic zip, with its files serialized in parallel"""
+    destination.parent.mkdir(parents=True, exist_ok=True)
+    with open(destination, "wb") as f:
+        write_entries(f, pack, compression)
+
+
+def pack_digest(pack: Pack[Any]) -> str:
+    """sha1 of the uncompressed deterministic zip of the pack, as recorded by `manifest.update_patch`.
+        The zip is only streamed through the hash, never held in memory"""
+    hasher = HashWriter()
+    write_entries(hasher, pack, ZIP_STORED) # type: ignore
+    return hasher.hexdigest()
+
+
+def write_entries(f: BinaryIO, pack: Pack[Any], compression: int):
+    files = ordered_files(pack)
+    with ThreadPoolExecutor(thread_name_prefix="gm4_archive") as executor, ZipFile(f, mode="w", compression=compression) as zf:
+        for entry in executor.map(lambda e: archive_entry(*e, compression), files):
+            zf.writestr(entry.zinfo, entry.data)
+
+
+def ordered_files(pack: Pack[Any]) -> list[tuple[str, PackFile]]:
+    """Files of the pack sorted by path, then grouped by directory as beet's `_dump_files` writes them"""
+    directories: defaultdict[str, list[tuple[str, PackFile]]] = defaultdict(list)
+    for path, file in sorted(pack.list_files(), key=lambda e: e[0]):
+        directories[path.rpartition("/")[0]].append((path, file))
+    return [entry for entries in directories.values() for entry in entries]
+
+
+def archive_entry(path: str, file: PackFile, compression: int) -> ArchiveEntry:
+    if file._content is None: # copied from its source file by ReproducibleZipFile.write
+        source = file.ensure_source_path()
+        zinfo = ZipInfo(path, date_time())
+        zinfo.external_attr = file_mode() << 16
+        stat = os.stat(source)
+        content: Any = (os.fspath(source), stat.st_size, stat.st_mtime_ns)
+    else: # written through ZipFile.open
+        zinfo = ZipInfo(path)
+        zinfo.external_attr = 0o600 << 16
+        content = file.ensure_serialized() # the same object until the file is modified
+    zinfo.compress_type = compression
+
+    cached = _entry_data.get(file)
+    if cached and (cached[0] is content or cached[0] == content):
+        data = cached[1]
+    else:
+        data = serialized_bytes(file, content)
+        _entry_data[file] = (content, data)
+    return ArchiveEntry(zinfo, data)
+
+
+def serialized_bytes(file: PackFile, content: Any) -> bytes:
+    if file._content is None:
+        return Path(content[0]).read_bytes()
+    if isinstance(file, TextFileBase):
+        text: str = content
+        if file.newline is None:
+            text = text.replace("\n", os.linesep)
+        elif file.newline not in ("", "\n"):
+            text = text.replace("\n", file.newline)
+        return text.encode(file.encoding or "utf-8", file.errors or "strict") # as the TextIOWrapper of TextFileBase.dump_zip
+    return content
+
+
+class HashWriter:
+    """Seekable write-only file object feeding a sha1. ZipFile seeks back to complete the header of each entry once its data is written,
+        so the bytes of an entry are only hashed when it seeks to the end again. Only one entry is ever held in memory"""
+    def __init__(self):
+        self.hash = hashlib.sha1()
+        self.hashed = 0 # bytes fed to the hash
+        self.buffer = bytearray() # bytes after those, which can still be overwritten
+        self.position = 0
+
+    def write(self, data: bytes) -> int:
+        offset = self.position - self.hashed
+        self.buffer[offset:offset+len(data)] = data
+        self.position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self.position
+
+    def seek(self, position: int, whence: int = os.SEEK_SET) -> int:
+        end = self.hashed + len(self.buffer)
+        if whence != os.SEEK_SET or not self.hashed <= position <= end:
+            raise OSError(f"Cannot seek to {position}, only between {self.hashed} and {end}")
+        self.position = position
+        if position == end:
+            self.commit()
+        return position
+
+    def commit(self):
+        self.hash.update(self.buffer)
+        self.hashed += len(self.buffer)
+        self.buffer.clear()
+
+    def hexdigest(self) -> str:
+        self.commit()
+        return self.hash.hexdigest()
+
+    def flush(self):
+        pass
@@ -0,0 +1,280 @@
+import hashlib
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+from fnmatch import fnmatch
+from importlib.metadata import version
+from pathlib import Path
+from statistics import median
+from tempfile import TemporaryDirectory
+from typing import Any, Callable, Iterator, Optional
+
+import yaml
+from beet import JsonFile
+from PIL import Image
+
+from gm4.plugins.output import MODRINTH_AUTH_KEY, SMITHED_AUTH_KEY
+from gm4.plugins.resource_pack import ModelDataRegistry
+
+SYNTHETIC_PREFIX = "gm4_benchmark_"
+SYNTHETIC_ITEMS = ["stick", "paper", "rabbit_hide", "gunpowder", "clock", "compass", "flint", "feather"]
+WORKSPACE_IGNORE = shutil.ignore_patterns(".git", ".beet_cache", "out", "release", "__pycache__", "*.egg-info")
+PROFILE_REPORT = "out/profile.json"
+
+@dataclass
+class SyntheticModuleSpec:
+    """Size of each generated benchmark module"""
+    functions: int = 100
+    advancements: int = 10
+    model_data: int = 20
+    translations: int = 50
+    guidebook_sections: int = 5
+    skins: int = 4
+    seed: int = 0
+
+
+def generate_module(root: Path, module_id: str, spec: SyntheticModuleSpec, skin_cache: dict[str, Any], registry: ModelDataRegistry):
+    """Writes a gm4 module with the given numbers of resources into `root`. Its skins are registered in the skin cache and its
+        custom_model_data in the registry, so the build never uploads skins or issues new custom_model_data"""
+    rng = random.Random(f"{spec.seed}:{module_id}")
+    short_id = module_id.removeprefix("gm4_")
+    directory = root / module_id
+    data = directory / "data" / module_id
+    assets = directory / "assets" / module_id
+
+    model_data = [{"item": SYNTHETIC_ITEMS[i % len(SYNTHETIC_ITEMS)], "reference": f"item/{short_id}_{i}", "template": "generated"} for i in range(spec.model_data)]
+    write_yaml(directory / "beet.yaml", {
+        "id": module_id,
+        "name": f"Benchmark {short_id}",
+        "version": "1.0.X",
+        "data_pack": {"load": "."},
+        "resource_pack": {"load": "."},
+        "pipeline": ["gm4.plugins.extend.module"],
+        "meta": {"gm4": {
+            "versioning": {"schedule_loops": ["main"]},
+            "website": {"description": "Synthetic module generated for build benchmarks"},
+            "credits": {"Creator": ["Benchmark"]},
+            "model_data": model_data,
+        }},
+    })
+
+    write_text(data / "function" / "init.mcfunction", "\n".join([
+        f'execute unless score {short_id} gm4_modules matches 1 run data modify storage gm4:log queue append value {{type:"install",module:"Benchmark {short_id}"}}',
+        f"execute unless score {short_id} gm4_earliest_version < {short_id} gm4_modules run scoreboard players operation {short_id} gm4_earliest_version = {short_id} gm4_modules",
+        f"scoreboard players set {short_id} gm4_modules 1",
+        "",
+        f"schedule function {module_id}:main 1t",
+        "",
+        "#$moduleUpdateList",
+    ]))
+    write_text(data / "function" / "main.mcfunction", "\n".join(
+        [f"function {module_id}:generated/f{i}" for i in range(0, spec.functions, 10)] + [f"schedule function {module_id}:main 16t"]
+    ))
+
+    for i in range(spec.functions):
+        entry = model_data[rng.randrange(len(model_data))] if model_data else None
+        lines = [
+            f"# generated function {i}",
+            f"scoreboard players add $count gm4_{short_id}_data {rng.randint(1, 9)}",
+            f"execute as @e[type=armor_stand,tag=gm4_{short_id}_{i % 7},distance=..{rng.randint(2, 16)}] at @s run particle minecraft:end_rod ~ ~1 ~ 0.1 0.1 0.1 0 {rng.randint(1, 5)}",
+        ]
+        if entry:
+            lines.append(f'execute if score $count gm4_{short_id}_data matches {i}.. run summon item ~ ~ ~ {{Item:{{id:"minecraft:{entry["item"]}",count:1,components:{{"minecraft:custom_model_data":"{entry["reference"]}","minecraft:item_name":{{"translate":"item.gm4.{short_id}_{i % max(spec.translations, 1)}","fallback":"Item {i}"}}}}}}}}')
+        if spec.skins:
+            lines.append(f'summon item_display ~ ~ ~ {{item:{{id:"minecraft:player_head",count:1,components:{{"minecraft:profile":"${short_id}_skin_{i % spec.skins}"}}}},Tags:["gm4_{short_id}_display"]}}')
+        if i + 1 < spec.functions:
+            lines.append(f"execute if score $count gm4_{short_id}_data matches ..{rng.randint(10, 99)} run function {module_id}:generated/f{i+1}")
+        write_text(data / "function" / "generated" / f"f{i}.mcfunction", "\n".join(lines))
+
+    write_json(directory / "data" / "gm4" / "advancement" / f"{short_id}.json", {
+        "display": {
+            "icon": {"id": "minecraft:stick"},
+            "title": {"translate": f"advancement.gm4.{short_id}.title", "fallback": f"Benchmark {short_id}"},
+            "description": {"translate": f"advancement.gm4.{short_id}.description", "fallback": "Generated advancement", "color": "gray"},
+        },
+        "parent": "gm4:root",
+        "criteria": {"impossible": {"trigger": "minecraft:impossible"}},
+    })
+    for i in range(spec.advancements):
+        write_json(data / "advancement" / f"a{i}.json", {
+            "criteria": {"requirement": {"trigger": "minecraft:inventory_changed", "conditions": {"items": [{"items": f"minecraft:{SYNTHETIC_ITEMS[i % len(SYNTHETIC_ITEMS)]}"}]}}},
+            "rewards": {"function": f"{module_id}:generated/f{i % max(spec.functions, 1)}"} if spec.functions else {},
+        })
+
+    rows = [["key", "en_us"]] + [[f"item.gm4.{short_id}_{i}", f"Benchmark Item {i}"] for i in range(spec.translations)]
+    rows += [[f"text.gm4.guidebook.{short_id}.section_{i}", f"Generated guidebook section {i}"] for i in range(spec.guidebook_sections)]
+    write_text(directory / "assets" / "translations.csv", "\n".join(",".join(row) for row in rows))
+
+    write_json(data / "guidebook" / f"{short_id}.json", {
+        "id": short_id,
+        "name": f"Benchmark {short_id}",
+        "module_type": "module",
+        "icon": {"id": "minecraft:stick"},
+        "criteria": {f"obtain_{i}": {"trigger": "minecraft:inventory_changed", "conditions": {"items": [{"items": f"minecraft:{SYNTHETIC_ITEMS[i % len(SYNTHETIC_ITEMS)]}"}]}} for i in range(spec.guidebook_sections)},
+        "sections": [{
+            "name": f"section_{i}",
+            "enable": [],
+            "requirements": [[f"obtain_{i}"]],
+            "pages": [[
+                {"insert": "title"} if i == 0 else {"text": ""},
+                {"translate": f"text.gm4.guidebook.{short_id}.section_{i}", "fallback": f"Generated guidebook section {i} " + "lorem ipsum " * rng.randint(5, 30)},
+            ]],
+        } for i in range(spec.guidebook_sections)],
+    })
+
+    for entry in model_data:
+        write_png(assets / "textures" / f"{entry['reference']}.png", 16, rng)
+    allocation = next((r for pattern, r in registry.allocations.items() if fnmatch(module_id, pattern)), (1, 99)) # as assigned by GM4ResourcePack.find_new_index
+    for entry in model_data:
+        index = registry.lowest_free([entry["item"]], *allocation)
+        if index is None:
+            raise RuntimeError(f"No free custom_model_data on {entry['item']} for the synthetic modules, use fewer modules or --model-data")
+        registry.set(entry["item"], f"{module_id}:{entry['reference']}", index)
+    for i in range(spec.skins):
+        skin_name = f"{short_id}_skin_{i}"
+        image = write_png(data / "skins" / f"{skin_name}.png", 64, rng)
+        skin_cache["skins"][f"{module_id}:{skin_name}"] = {
+            "uuid": [rng.randint(-2**31, 2**31-1) for _ in range(4)],
+            "value": skin_cache["skins"][next(iter(skin_cache["skins"]))]["value"] if skin_cache["skins"] else "",
+            "hash": hashlib.sha1(image.tobytes()).hexdigest(), # as checked by player_heads
+            "parent_module": module_id,
+        }
+
+
+def write_text(path: Path, text: str):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(text + "\n")
+
+def write_json(path: Path, data: Any):
+    write_text(path, json.dumps(data, indent=2))
+
+def write_yaml(path: Path, data: Any):
+    write_text(path, yaml.safe_dump(data, sort_keys=False))
+
+def write_png(path: Path, size: int, rng: random.Random) -> Image.Image:
+    image = Image.new("RGBA", (size, size))
+    image.putdata([(rng.randrange(256), rng.randrange(256), rng.randrange(256), 255) for _ in range(size*size)])
+    path.parent.mkdir(parents=True, exist_ok=True)
+    image.save(path)
+    return image
+
+
+@contextmanager
+def workspace(project: Path, modules: int, spec: SyntheticModuleSpec, keep: bool = False) -> Iterator[Path]:
+    """Copy of the project with generated modules added, so benchmark builds never touch the project's own output or caches"""
+    with TemporaryDirectory(prefix="gm4_benchmark_") as tmpdir:
+        directory = Path(tmpdir) / project.name
+        shutil.copytree(project, directory, ignore=WORKSPACE_IGNORE)
+        if (vanilla := project / ".beet_cache" / "vanilla").is_dir(): # reuse the downloaded client jar
+            shutil.copytree(vanilla, directory / ".beet_cache" / "vanilla")
+
+        skin_cache = JsonFile(source_path=directory / "gm4" / "skin_cache.json").data
+        registry = ModelDataRegistry(JsonFile(source_path=directory / "gm4" / "modeldata_registry.json").data)
+        for i in range(modules):
+            generate_module(directory, f"{SYNTHETIC_PREFIX}{i}", spec, skin_cache, registry)
+        JsonFile(skin_cache).dump(origin=directory, path="gm4/skin_cache.json")
+        JsonFile(registry.data).dump(origin=directory, path="gm4/modeldata_registry.json")
+
+        yield directory
+        if keep:
+            shutil.copytree(directory, project / "out" / "benchmark_workspace", dirs_exist_ok=True)
+
+
+def run_build(directory: Path, build: str, module: str) -> dict[str, Any]:
+    """Runs a profiled build in a separate process, returning the profiler report"""
+    if build == "release":
+        config = yaml.safe_load((directory / "beet-release.yaml").read_text())
+        config["pipeline"].insert(0, "gm4.plugins.profiler")
+        config.setdefault("meta", {})["profiler"] = {"report": PROFILE_REPORT}
+        (directory / "benchmark-release.json").write_text(json.dumps(config))
+        cmd = [sys.executable, "-m", "beet", "-p", "benchmark-release.json", "build"]
+    else:
+        cmd = [sys.executable, "-m", "beet", "dev", "--no-cache", "--profile", module]
+
+    # never publish benchmark builds, nor run them as a github action, which fails on any cache the build has to update
+    env = {k: v for k, v in os.environ.items() if k not in (MODRINTH_AUTH_KEY, SMITHED_AUTH_KEY, "GITHUB_ACTIONS")}
+    (directory / PROFILE_REPORT).unlink(missing_ok=True)
+    res = subprocess.run(cmd, cwd=directory, env=env, capture_output=True, text=True)
+    if res.returncode != 0 or not (directory / PROFILE_REPORT).exists():
+        raise RuntimeError(f"Benchmark {build} build failed:\n{res.stdout}\n{res.stderr}")
+    return json.loads((directory / PROFILE_REPORT).read_text())
+
+
+def plugin_time(*plugins: str) -> Callable[[dict[str, Any]], float]:
+    """Wall time of all phases of the given plugins, summed over modules"""
+    return lambda report: sum(s["wall_ms"] for s in report["plugins"] if s["plugin"] in plugins)
+
+def mecha_time(*steps: str) -> Callable[[dict[str, Any]], float]:
+    return lambda report: sum(s["ms"] for s in report["mecha"] if s["step"] in steps)
+
+@dataclass
+class Scenario:
+    build: str # "release" or "dev", the profiled build the metric is read from
+    metric: Callable[[dict[str, Any]], float]
+    description: str
+
+SCENARIOS = {
+    "release": Scenario("release", lambda report: report["total_ms"], "full beet-release.yaml build"),
+    "dev": Scenario("dev", lambda report: report["total_ms"], "beet dev of one generated module"),
+    "resource_pack_merge": Scenario("release", plugin_time("gm4.plugins.worker.retrieve_and_merge", "gm4.plugins.resource_pack.pad_item_def_range_dispatch"), "merging module resource packs into the release resource pack"),
+    "mecha_transform": Scenario("release", mecha_time("transform"), "mecha transform pass, with the GM4ResourcePack and SkinNbtTransformer rules"),
+    "guidebook": Scenario("release", plugin_time("gm4_guidebook.generate_guidebooks.beet_default"), "guidebook generation"),
+}
+
+
+def run_benchmarks(project: Path, scenarios: list[str], modules: int, spec: SyntheticModuleSpec, repeat: int, keep: bool = False) -> dict[str, Any]:
+    """Builds each needed configuration `repeat` times in a generated workspace, and measures the scenarios from the profiler reports"""
+    builds = sorted({SCENARIOS[name].build for name in scenarios})
+    with workspace(project, modules, spec, keep) as directory:
+        reports = {build: [run_build(directory, build, f"{SYNTHETIC_PREFIX}0") for _ in range(repeat)] for build in builds}
+
+    results: dict[str, Any] = {
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "packages": {p: version(p) for p in ("beet", "mecha", "bolt")},
+        },
+        "synthetic": asdict(spec) | {"modules": modules},
+        "repeat": repeat,
+        "scenarios": {},
+    }
+    for name in scenarios:
+        runs = [SCENARIOS[name].metric(report) for report in reports[SCENARIOS[name].build]]
+        results["scenarios"][name] = {"median_ms": median(runs), "min_ms": min(runs), "runs_ms": runs}
+    return results
+
+
+@dataclass
+class Comparison:
+    scenario: str
+    baseline_ms: float
+    current_ms: float
+    regressed: bool
+
+    @property
+    def ratio(self) -> float:
+        return self.current_ms / self.baseline_ms if self.baseline_ms else float("inf")
+
+def compare(results: dict[str, Any], baseline: dict[str, Any], tolerance: float) -> list[Comparison]:
+    """Compares the median of each scenario present in both result files"""
+    comparisons: list[Comparison] = []
+    for name, current in results["scenarios"].items():
+        if (base := baseline["scenarios"].get(name)) is None:
+            continue
+        comparisons.append(Comparison(name, base["median_ms"], current["median_ms"], current["median_ms"] > base["median_ms"] * (1 + tolerance)))
+    return comparisons
+
+def format_comparison(comparisons: list[Comparison], baseline: Optional[dict[str, Any]] = None) -> str:
+    lines = [f"{'scenario':<22}{'baseline':>12}{'current':>12}{'change':>10}"]
+    for c in comparisons:
+        lines.append(f"{c.scenario:<22}{c.baseline_ms:>10.0f}ms{c.current_ms:>10.0f}ms{c.ratio-1:>+10.1%}{'  REGRESSION' if c.regressed else ''}")
+    if baseline and baseline.get("environment"):
+        lines.append(f"baseline environment: {baseline['environment'].get('platform')}, python {baseline['environment'].get('python')}")
+    return "\n".join(lines)
@@ -4,6 +4,7 @@ import os
 import shutil
 import re
 import glob
+import time
 from collections import defaultdict
 from pathlib import Path
 from tempfile import NamedTemporaryFile
@@ -13,7 +14,8 @@ import beet.toolchain.commands as commands
 import click
 import yaml
 from beet import Project
-from beet.toolchain.cli import beet
+from beet.contrib.link import LinkManager
+from beet.toolchain.cli import beet, error_handler, message_fence
 
 # NOTE pydantic.v1 does not allow reloading models with custom validators, which beet watch will do normally. 
 # Importing them here prevents their reload on each watch cycle. This may change in pydantic.v2 - revisit then
@@ -23,6 +25,9 @@ from gm4.plugins.resource_pack import ModelData  # type: ignore
 # import worker plugin to prevent 'worker reload' warnings
 import gm4.plugins.worker # type: ignore
 
+# import build_cache plugin to keep its file digests and watch state between `beet dev --watch` cycles
+from gm4.plugins import build_cache # type: ignore
+
 pass_project = click.make_pass_decorator(Project) # type: ignore
 
 @beet.command()
@@ -35,7 +40,10 @@ pass_project = click.make_pass_decorator(Project) # type: ignore
 @click.option("-c", "--clean", is_flag=True, help="Clean the output folder.")
 @click.option("--log", default="INFO", type=str, help="Set the logger level.")
 @click.option("-nl", "--no-lint", is_flag=True, help="Skips the mecha linting step.")
-def dev(ctx: click.Context, project: Project, modules: tuple[str, ...], watch: bool, reload: bool, link: str | None, clean: bool, log: int | str, no_lint: bool):
+@click.option("-nc", "--no-cache", is_flag=True, help="Rebuild all modules, even if their inputs are unchanged since the last build.")
+@click.option("-p", "--profile", is_flag=True, help="Time every plugin and write a report to out/profile.json.")
+@click.option("--flamegraph", is_flag=True, help="With --profile, also write a speedscope flamegraph to out/profile.speedscope.json.")
+def dev(ctx: click.Context, project: Project, modules: tuple[str, ...], watch: bool, reload: bool, link: str | None, clean: bool, log: int | str, no_lint: bool, no_cache: bool, profile: bool, flamegraph: bool):
 	"""Build or watch modules for development."""
 
 	module_folders = sorted(glob.glob("gm4_*"))
@@ -78,12 +86,17 @@ def dev(ctx: click.Context, project: Project, modules: tuple[str, ...], watch: b
 	config = yaml.safe_load(Path("beet-dev.yaml").read_text())
 
 	# command-determined config options
-	broadcast_config: dict[str, Any] = next((p for p in config["pipeline"] if isinstance(p, dict))) # type: ignore
+	broadcast_config: dict[str, Any] = next((p for p in config["pipeline"] if isinstance(p, dict)))["meta"]["build_cache"] # type: ignore
 	broadcast_config["broadcast"] = selected_modules
+	broadcast_config["enabled"] = not no_cache
+	config["meta"]["manifest"] = {"resolve": selected_modules} # other modules' manifest entries are not rechecked
 	if no_lint:
-		broadcast_config["require"].insert(0, "gm4.plugins.test.skip_mecha_lint")
+		broadcast_config["config"]["require"].insert(0, "gm4.plugins.test.skip_mecha_lint")
 	if reload:
-		broadcast_config["require"].insert(0, "beet.contrib.livereload")
+		broadcast_config["config"]["require"].insert(0, "beet.contrib.livereload")
+	if profile:
+		config["pipeline"].insert(0, "gm4.plugins.profiler")
+		config["meta"]["profiler"] = {"flamegraph": "out/profile.speedscope.json" if flamegraph else None}
 
 	build_dynamic_config(config, ctx, project, watch, link) # start the project build
 
@@ -145,6 +158,83 @@ def readme_gen(ctx: click.Context, project: Project, modules: tuple[str, ...], w
 	build_dynamic_config(config, ctx, project, watch, link=None)
 
 
+@beet.command()
+@pass_project
+@click.pass_context
+@click.argument("modules", nargs=-1)
+@click.option("--dry-run", is_flag=True, help="Send every request to a local stub server instead, and list them.")
+@click.option("--log", default="INFO", type=str, help="Set the logger level.")
+def publish(ctx: click.Context, project: Project, modules: tuple[str, ...], dry_run: bool, log: int | str):
+	"""Publishes the modules of the last release build to Modrinth and Smithed."""
+	logging.getLogger().setLevel(log)
+	click.echo(f"[GM4] Publishing {', '.join(modules) if modules else 'all released modules'}{' (dry run)' if dry_run else ''}...")
+	config = {
+		"pipeline": ["gm4.plugins.output.publish"],
+		"meta": {
+			"publish": {"dry_run": dry_run, "modules": list(modules)},
+			"autosave": {"link": False},
+		}
+	}
+	build_dynamic_config(config, ctx, project, watch=False, link=None)
+
+
+@beet.command()
+@pass_project
+@click.argument("scenarios", nargs=-1)
+@click.option("-o", "--output", default="out/benchmark.json", help="Write the results to this file.")
+@click.option("-b", "--baseline", type=click.Path(exists=True), help="Compare the results against an earlier results file.")
+@click.option("-t", "--tolerance", default=0.1, help="Slowdown from the baseline reported as a regression.")
+@click.option("-n", "--repeat", default=3, help="Number of builds measured for each scenario.")
+@click.option("-m", "--modules", default=5, help="Number of synthetic modules added to the build.")
+@click.option("--functions", default=100, help="Functions in each synthetic module.")
+@click.option("--advancements", default=10, help="Advancements in each synthetic module.")
+@click.option("--model-data", default=20, help="custom_model_data entries in each synthetic module.")
+@click.option("--translations", default=50, help="Translation keys in each synthetic module.")
+@click.option("--guidebook-sections", default=5, help="Guidebook sections in each synthetic module.")
+@click.option("--skins", default=4, help="Player head skins in each synthetic module.")
+@click.option("--seed", default=0, help="Seed for the synthetic module contents.")
+@click.option("--keep", is_flag=True, help="Keep the generated workspace in out/benchmark_workspace.")
+def benchmark(project: Project, scenarios: tuple[str, ...], output: str, baseline: str | None, tolerance: float, repeat: int, modules: int, functions: int, advancements: int, model_data: int, translations: int, guidebook_sections: int, skins: int, seed: int, keep: bool):
+	"""Measures build scenarios on a copy of the project with generated modules."""
+	from gm4.benchmark import SCENARIOS, SyntheticModuleSpec, compare, format_comparison, run_benchmarks
+
+	if unknown := [s for s in scenarios if s not in SCENARIOS]:
+		click.echo(f"[GM4] Unknown scenarios {', '.join(unknown)}, choose from {', '.join(SCENARIOS)}")
+		return
+
+	spec = SyntheticModuleSpec(functions=functions, advancements=advancements, model_data=model_data, translations=translations, guidebook_sections=guidebook_sections, skins=skins, seed=seed)
+	click.echo(f"[GM4] Benchmarking {', '.join(scenarios or SCENARIOS)} with {modules} synthetic modules, {repeat} runs each...")
+	results = run_benchmarks(project.directory, list(scenarios or SCENARIOS), modules, spec, repeat, keep)
+
+	Path(output).parent.mkdir(parents=True, exist_ok=True)
+	Path(output).write_text(json.dumps(results, indent=2))
+	for name, result in results["scenarios"].items():
+		click.echo(f"[GM4] {name:<22}{result['median_ms']:>10.0f}ms (min {result['min_ms']:.0f}ms)")
+	click.echo(f"[GM4] Wrote results to {output}")
+
+	if baseline:
+		baseline_results = json.loads(Path(baseline).read_text())
+		comparisons = compare(results, baseline_results, tolerance)
+		click.echo(format_comparison(comparisons, baseline_results))
+		if any(c.regressed for c in comparisons):
+			raise click.ClickException(f"Build time regressed by more than {tolerance:.0%}")
+
+
+@beet.command()
+@click.argument("results", type=click.Path(exists=True))
+@click.argument("baseline", type=click.Path(exists=True))
+@click.option("-t", "--tolerance", default=0.1, help="Slowdown from the baseline reported as a regression.")
+def benchmark_compare(results: str, baseline: str, tolerance: float):
+	"""Compares two benchmark results files, failing on regressions."""
+	from gm4.benchmark import compare, format_comparison
+
+	baseline_results = json.loads(Path(baseline).read_text())
+	comparisons = compare(json.loads(Path(results).read_text()), baseline_results, tolerance)
+	click.echo(format_comparison(comparisons, baseline_results))
+	if any(c.regressed for c in comparisons):
+		raise click.ClickException(f"Build time regressed by more than {tolerance:.0%}")
+
+
 def build_dynamic_config(config: dict[str,Any], ctx: click.Context, project: Project, watch: bool, link: str|None):
 	"""Creates a tempfile on disk to pass to beet. Enables runtime dynamic setup of the build process that is compatiable with `beet watch`"""
 
@@ -155,5 +245,25 @@ def build_dynamic_config(config: dict[str,Any], ctx: click.Context, project: Pro
 		json.dump(config, f, indent=1)
 
 	project.reset() # delete previously resolved config
-	ctx.invoke(commands.watch if watch else commands.build, link=link)
+	if watch:
+		watch_project(project, link)
+	else:
+		ctx.invoke(commands.build, link=link)
 	os.remove(f.name) # delete tempfile
+
+
+def watch_project(project: Project, link: str|None):
+	"""Watches the project as `beet watch` does, but passes the changed files to the build cache, so only modules affected by them are rechecked and relinked"""
+	with message_fence("Linking and watching project..." if link else "Watching project..."):
+		if link:
+			click.echo(project.link(world=link))
+
+		for changes in project.watch():
+			filename, action = next(iter(changes.items()))
+			text = f'{action.capitalize()} "{filename}"' if changes == {filename: action} else f"{len(changes)} changes detected"
+			click.echo(f"{click.style(time.strftime('%H:%M:%S'), fg='green', bold=True)} {text}")
+
+			build_cache.watch_state.changes = set(changes)
+			build_cache.preserve_links(LinkManager(project.cache))
+			with error_handler(format_padding=1):
+				project.build()
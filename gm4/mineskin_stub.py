@@ -0,0 +1,90 @@
+import argparse
+import base64
+import hashlib
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any
+
+# Local stand-in for the Mineskin upload api, for testing player_heads without uploading real skins.
+# Run with `python -m gm4.mineskin_stub` and build with MINESKIN_API=http://localhost:8765
+
+class MineskinStub(ThreadingHTTPServer):
+    """Answers /generate/upload with a fake texture, enforcing a delay between requests and a concurrency limit like the real api"""
+    def __init__(self, address: tuple[str, int], delay: float = 0.5, concurrency: int = 2):
+        super().__init__(address, MineskinStubHandler)
+        self.delay = delay
+        self.concurrency = concurrency
+        self.next_request = 0.0
+        self.in_flight = 0
+        self.uploads: list[str] = [] # filenames accepted, in order
+        self.rejected = 0
+        self.lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+
+class MineskinStubHandler(BaseHTTPRequestHandler):
+    server: MineskinStub
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.path != "/generate/upload":
+            return self.respond(404, {"error": "not found"})
+        if not self.headers.get("Authorization", "").startswith("Bearer "):
+            return self.respond(401, {"error": "missing api key"})
+
+        server = self.server
+        with server.lock:
+            now = time.time()
+            if now < server.next_request or server.in_flight >= server.concurrency:
+                server.rejected += 1
+                return self.respond(429, {"error": "Too many requests", "nextRequest": max(server.next_request, now + server.delay)})
+            server.in_flight += 1
+            server.next_request = now + server.delay
+
+        try:
+            time.sleep(server.delay / 2) # generation time
+            digest = hashlib.sha1(body).hexdigest()
+            texture = {"timestamp": int(time.time()*1000), "textures": {"SKIN": {"url": f"http://textures.minecraft.net/texture/{digest}"}}}
+            filename = body.split(b'filename="', 1)[-1].split(b'"', 1)[0].decode()
+            with server.lock:
+                server.uploads.append(filename)
+            self.respond(200, {
+                "uuid": digest[:32],
+                "data": {"texture": {"value": base64.b64encode(json.dumps(texture).encode()).decode(), "signature": ""}},
+                "nextRequest": server.next_request,
+            })
+        finally:
+            with server.lock:
+                server.in_flight -= 1
+
+    def respond(self, status: int, body: dict[str, Any]):
+        raw = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(raw)))
+        self.end_headers()
+        self.wfile.write(raw)
+
+    def log_message(self, format: str, *args: Any):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for the Mineskin upload api")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--delay", type=float, default=0.5, help="seconds between accepted requests")
+    parser.add_argument("--concurrency", type=int, default=2, help="requests handled at once before answering 429")
+    args = parser.parse_args()
+
+    server = MineskinStub(("localhost", args.port), args.delay, args.concurrency)
+    print(f"Mineskin stub listening on {server.url}")
+    server.serve_forever()
+
+if __name__ == "__main__":
+    main()
@@ -6,10 +6,11 @@ from functools import partial
 from pathlib import Path
 from typing import Any
 
-from beet import Context, ProjectCache
+from beet import Context
 
-from gm4.plugins.manifest import ManifestCacheModel, ManifestFileModel
+from gm4.plugins.manifest import BuildManifest
 
+SUMMARY_LOGGERS = ["gm4.output", "gm4.manifest.update_patch"] # loggers whose records are collected into the build summary
 
 def beet_default(ctx: Context):
     """Sets up a logging handlers to emit build log entries with the github action annotation format, 
@@ -17,6 +18,20 @@ def beet_default(ctx: Context):
     root_logger = logging.getLogger(None) # get root logger
 
     # annotation handler emits throughout build to stderr
+    root_logger.handlers.clear() # clear the handler set by beet CLI toolchain
+    root_logger.addHandler(annotation_handler())
+    
+    # summary handler holds onto certain records until the exit phase when it emits to a markdown summary
+    sum_handler = SummaryHandler(1000, ctx.inject(BuildManifest))
+    for name in SUMMARY_LOGGERS:
+        logging.getLogger(name).addHandler(sum_handler)
+
+    # after the whole build, flush the stored records and form the markdown summary
+    yield
+    sum_handler.flush()
+
+def annotation_handler() -> logging.Handler:
+    """Creates a stderr handler emitting records in the github action annotation format"""
     ann_handler = logging.StreamHandler()
     ann_handler.setFormatter(AnnotationFormatter())
 
@@ -25,18 +40,7 @@ def beet_default(ctx: Context):
             return False # disable annotations for time - is spammy in debug mode
         return True
     ann_handler.addFilter(filter)
-
-    root_logger.handlers.clear() # clear the handler set by beet CLI toolchain
-    root_logger.addHandler(ann_handler)
-    
-    # summary handler holds onto certain records until the exit phase when it emits to a markdown summary
-    sum_handler = SummaryHandler(1000, ctx.cache)
-    logging.getLogger("gm4.output").addHandler(sum_handler)
-    logging.getLogger("gm4.manifest.update_patch").addHandler(sum_handler)
-
-    # after the whole build, flush the stored records and form the markdown summary
-    yield
-    sum_handler.flush()
+    return ann_handler
 
 LEVEL_CONVERSION = {
     logging.DEBUG: "debug",
@@ -70,16 +74,16 @@ class AnnotationFormatter(logging.Formatter):
         return f"::{level} title={record.name}::{record.name} {expl}"
         
 class SummaryHandler(logging.handlers.BufferingHandler):
-    def __init__(self, capacity: int, beet_cache: ProjectCache):
+    def __init__(self, capacity: int, manifest: BuildManifest):
         super().__init__(capacity)
-        self.beet_cache = beet_cache
+        self.manifest = manifest
         self.summary_created = False
 
     def flush(self):
         summary_entries: dict[str, Any] = {}
 
-        this_manifest = ManifestCacheModel.parse_obj(self.beet_cache["gm4_manifest"].json)
-        last_manifest = ManifestFileModel.parse_obj(self.beet_cache["previous_manifest"].json)
+        this_manifest = self.manifest.model
+        last_manifest = self.manifest.previous
 
         this_versions = {id: entry.version for id, entry in (this_manifest.modules | this_manifest.libraries).items()}
         last_versions = {id: entry.version for id, entry in ({e.id: e for e in last_manifest.modules} | last_manifest.libraries).items()}
@@ -0,0 +1,430 @@
+import glob
+import hashlib
+import importlib
+import json
+import logging
+import os
+import pickle
+import shutil
+from dataclasses import dataclass, field
+from fnmatch import fnmatch
+from importlib.metadata import version
+from pathlib import Path, PurePath
+from typing import Any, Iterable, Optional
+from zipfile import ZIP_STORED
+
+import yaml
+from beet import Context, DataPack, NamespaceFile, Pack, PackOverwrite, Pipeline, PluginOptions, ResourcePack, configurable, subproject
+from beet.contrib.link import LinkManager
+from pydantic.v1 import Extra
+
+from gm4.archive import zip_pack
+from gm4.plugins.worker import UNPICKLABLE_CONTEXT_PARAMS, ProjectPacket, picklable_params, project_params
+
+parent_logger = logging.getLogger("gm4.build_cache")
+
+# files read by every module build, relative to the project root
+SHARED_INPUTS = ["*.yaml", "base/**/*", "gm4/**/*.py", "gm4/contributors.json", "gm4/skin_cache.json", "gm4_guidebook/*.py", "gm4_guidebook/*.json"]
+TOOLCHAIN_PACKAGES = ["beet", "mecha", "bolt"]
+INCLUDE_PLUGIN_PREFIX = "gm4.plugins.include."
+CACHE_FORMAT = 1 # increment when the layout of stored builds changes, to discard every stored build
+
+_file_digests: dict[Path, tuple[int, int, bytes]] = {} # kept between `beet dev --watch` cycles, keyed on file size and mtime
+_linked_packs: dict[Path, dict[str, bytes]] = {} # digest of each file written by `link_pack`, for each linked pack folder
+
+class BuildCacheOptions(PluginOptions, extra=Extra.ignore):
+    enabled: bool = True
+    broadcast: list[str] = []
+    config: dict[str, Any] = {}
+    restore: list[str] = [] # plugins run on restored packs, in place of the subproject's own exit phases
+
+@dataclass
+class CachedBuild:
+    """Finished packs of a module build, stored under the hash of its inputs"""
+    key: str
+    packets: list[ProjectPacket] = field(default_factory=list)
+    gui_font_start: int = 0 # first gui font character handed to the module
+    gui_font_count: int = 0
+    modeldata: dict[str, Optional[int]] = field(default_factory=dict) # custom_model_data looked up by the build, None if the reference was missing
+    pack_hash: Optional[str] = None
+
+@dataclass
+class WatchState:
+    """Files changed since the previous `beet dev --watch` cycle, and the input keys of each module in that cycle"""
+    changes: Optional[set[str]] = None # paths relative to the project root, None when building everything
+    keys: dict[str, str] = field(default_factory=dict) # module id -> input key
+
+watch_state = WatchState()
+
+
+class ModelDataReads:
+    """custom_model_data values the module build looked up in the registry, recorded by `GM4ResourcePack.retrieve_index`.
+        A stored build is only restored while the registry still holds the same values"""
+    def __init__(self, ctx: Context):
+        self.indices: dict[str, Optional[int]] = {} # reference -> value at its last lookup
+
+
+class BuildCache:
+    """Service storing finished module builds in .beet_cache, so modules with unchanged inputs can skip their build"""
+    def __init__(self, ctx: Context):
+        self.ctx = ctx
+        self.enabled = ctx.validate("build_cache", validator=BuildCacheOptions).enabled
+        self.directory = ctx.cache["build_cache"].directory
+        self.logger = parent_logger
+        self._shared_digest: Optional[str] = None
+
+    def input_key(self, directory: Path, config: dict[str, Any]) -> str:
+        """Hashes the files and config the build of the module in `directory` reads.
+            The custom_model_data and gui font characters it is handed are checked by `lookup` instead"""
+        h = hashlib.sha1(self.shared_digest().encode())
+        h.update(json.dumps(config, sort_keys=True, default=str).encode())
+        for path in self.module_inputs(directory):
+            h.update(self.file_digest(path))
+        return h.hexdigest()
+
+    def shared_digest(self) -> str:
+        """Hash of inputs common to all modules in this build"""
+        if self._shared_digest is None:
+            manifest = dict(self.ctx.cache["gm4_manifest"].json)
+            manifest.pop("last_commit", None) # every commit would otherwise invalidate the cache
+            for section in ("modules", "libraries"):
+                manifest[section] = {k: {f: v for f, v in e.items() if f not in ("hash", "publish_date")} for k, e in manifest[section].items()}
+
+            h = hashlib.sha1(json.dumps([
+                manifest,
+                self.ctx.cache["translations"].json.get("backfill", False),
+                os.getenv("VERSION", "1.21.5"),
+                [version(p) for p in TOOLCHAIN_PACKAGES],
+            ], sort_keys=True, default=str).encode())
+            for path in sorted({p for pattern in SHARED_INPUTS for p in self.ctx.directory.glob(pattern) if p.is_file()}):
+                h.update(self.file_digest(path))
+            self._shared_digest = h.hexdigest()
+        return self._shared_digest
+
+    def registry_index(self) -> dict[str, int]:
+        """custom_model_data of each reference in the registry, as `ModelDataRegistry.index` looks it up"""
+        index: dict[str, int] = {}
+        for reg in self.ctx.cache["modeldata_registry"].json.get("items", {}).values():
+            for reference, i in reg.items():
+                index.setdefault(reference, i)
+        return index
+
+    def module_inputs(self, directory: Path) -> list[Path]:
+        """Files of the module, the libraries it includes, the packs it loads, and plugins it uses from other project folders"""
+        folders, files = self.module_folders(directory)
+        module_files = {p for folder in folders for p in folder.rglob("*") if p.is_file() and "__pycache__" not in p.parts}
+        return sorted(module_files | files)
+
+    def module_folders(self, directory: Path) -> tuple[set[Path], set[Path]]:
+        """Folders of the module, the libraries it includes and the packs it loads, and single files it reads from other project folders"""
+        folders = {directory}
+        files: set[Path] = set()
+        pending = [directory]
+        while pending:
+            config_dir = pending.pop()
+            config_path = config_dir / "beet.yaml"
+            if not config_path.exists():
+                continue
+            config = yaml.safe_load(config_path.read_text()) or {}
+            for path in self.load_paths(config_dir, config):
+                if any(path.is_relative_to(folder) for folder in folders):
+                    continue # eg. `.`, already read as part of the module
+                if path.is_dir():
+                    folders.add(path) # eg. ../gm4_metallurgy, whose pipeline is not run by loading it
+                else:
+                    files.add(path)
+            for plugin in [p for p in config.get("pipeline", []) + config.get("require", []) if isinstance(p, str)]:
+                if plugin.startswith(INCLUDE_PLUGIN_PREFIX):
+                    folder = self.ctx.directory / plugin.removeprefix(INCLUDE_PLUGIN_PREFIX)
+                    if folder not in folders:
+                        folders.add(folder)
+                        pending.append(folder)
+                elif (plugin_file := self.ctx.directory / f"{plugin.replace('.', '/')}.py").is_file():
+                    files.add(plugin_file) # eg. gm4_metallurgy.shamir_model_template
+        return folders, files
+
+    def load_paths(self, config_dir: Path, config: dict[str, Any]) -> set[Path]:
+        """Existing files and folders matched by the `data_pack.load` and `resource_pack.load` entries of a beet.yaml"""
+        patterns: list[str] = []
+        for pack in ("data_pack", "resource_pack"):
+            load = (config.get(pack) or {}).get("load") or []
+            for entry in load if isinstance(load, list) else [load]:
+                if isinstance(entry, dict): # destination -> source paths
+                    patterns += [source for sources in entry.values() for source in (sources if isinstance(sources, list) else [sources])]
+                else:
+                    patterns.append(entry)
+        paths: set[Path] = set()
+        for pattern in patterns:
+            if not isinstance(pattern, str):
+                continue
+            for match in glob.glob(os.path.normpath(config_dir / pattern)):
+                if (path := Path(match)).is_relative_to(self.ctx.directory):
+                    paths.add(path)
+        return paths
+
+    def file_digest(self, path: Path) -> bytes:
+        stat = path.stat()
+        cached = _file_digests.get(path)
+        if cached and cached[:2] == (stat.st_size, stat.st_mtime_ns):
+            return cached[2]
+        h = hashlib.sha1(path.relative_to(self.ctx.directory).as_posix().encode())
+        h.update(path.read_bytes())
+        _file_digests[path] = (stat.st_size, stat.st_mtime_ns, h.digest())
+        return h.digest()
+
+    def lookup(self, module_id: str, key: str, gui_font_start: int) -> Optional[CachedBuild]:
+        """Returns the stored build of the module, if it was built from the same inputs, with the same custom_model_data
+            and, if it uses gui fonts, from the same first gui font character"""
+        directory = self.directory / module_id
+        if not self.enabled or not (directory / "build.json").exists():
+            return None
+        try:
+            stored = json.loads((directory / "build.json").read_text())
+            if stored.get("format") != CACHE_FORMAT or stored["key"] != key:
+                return None
+            if stored["gui_font_count"] and stored["gui_font_start"] != gui_font_start:
+                return None # its gui font characters moved, as an earlier module now uses more or fewer
+            registry_index = self.registry_index()
+            if any(registry_index.get(reference) != index for reference, index in stored["modeldata"].items()):
+                return None
+            return CachedBuild(
+                key=key,
+                packets=self.load_packets(directory, stored["packets"]),
+                gui_font_start=stored["gui_font_start"],
+                gui_font_count=stored["gui_font_count"],
+                modeldata=stored["modeldata"],
+                pack_hash=stored["pack_hash"],
+            )
+        except Exception as exc:
+            self.logger.debug(f"Discarding unreadable build cache entry for {module_id}: {exc}")
+            return None
+
+    def store(self, module_id: str, build: CachedBuild):
+        """Saves the packs as zips, next to a build.json with the key and the file types needed to load them back.
+            Only the context params of each pack are pickled"""
+        directory = self.directory / module_id
+        shutil.rmtree(directory, ignore_errors=True)
+        directory.mkdir(parents=True)
+        packets: list[dict[str, Any]] = []
+        for i, (rp, dp, params) in enumerate(build.packets):
+            packs: dict[str, Any] = {}
+            for name, pack in (("resource_pack", rp), ("data_pack", dp)):
+                zip_pack(pack, directory / f"{i}_{name}.zip", ZIP_STORED)
+                packs[name] = pack_layout(pack)
+            (directory / f"{i}_params.pickle").write_bytes(pickle.dumps(params))
+            packets.append(packs)
+        (directory / "build.json").write_text(json.dumps({
+            "format": CACHE_FORMAT,
+            "key": build.key,
+            "gui_font_start": build.gui_font_start,
+            "gui_font_count": build.gui_font_count,
+            "modeldata": build.modeldata,
+            "pack_hash": build.pack_hash,
+            "packets": packets,
+        }, indent=2))
+
+    def load_packets(self, directory: Path, packets: list[dict[str, Any]]) -> list[ProjectPacket]:
+        loaded: list[ProjectPacket] = []
+        for i, packs in enumerate(packets):
+            rp = load_pack(ResourcePack, directory / f"{i}_resource_pack.zip", packs["resource_pack"])
+            dp = load_pack(DataPack, directory / f"{i}_data_pack.zip", packs["data_pack"])
+            loaded.append((rp, dp, pickle.loads((directory / f"{i}_params.pickle").read_bytes())))
+        return loaded
+
+
+def pack_layout(pack: Pack[Any]) -> dict[str, Any]:
+    """Pack settings and file types needed to load the pack back from its zip, with every file it was saved with"""
+    namespace_types: set[type[NamespaceFile]] = set(pack.extend_namespace)
+    extra_types = {path: file_type for path, file_type in pack.extend_extra.items()}
+    namespace_extra_types = {path: file_type for path, file_type in pack.extend_namespace_extra.items()}
+    for p in [pack, *pack.overlays.values()]:
+        extra_types.update({path: type(file) for path, file in p.extra.items()})
+        for namespace in p.values():
+            namespace_types.update(type(file) for container in namespace.values() for file in container.values())
+            namespace_extra_types.update({path: type(file) for path, file in namespace.extra.items()})
+    return {
+        "name": pack.name,
+        "zipped": pack.zipped,
+        "compression": pack.compression,
+        "compression_level": pack.compression_level,
+        "extend_namespace": sorted(qualified_name(t) for t in namespace_types),
+        "extend_extra": {path: qualified_name(t) for path, t in sorted(extra_types.items())},
+        "extend_namespace_extra": {path: qualified_name(t) for path, t in sorted(namespace_extra_types.items())},
+        "files": sorted(path for path, _ in pack.list_files()),
+    }
+
+
+def load_pack(pack_type: type[Pack[Any]], path: Path, layout: dict[str, Any]) -> Pack[Any]:
+    """Loads a pack saved by `BuildCache.store`, failing if any file it was saved with is not loaded back"""
+    pack = pack_type(
+        extend_namespace=[import_qualified(t) for t in layout["extend_namespace"]],
+        extend_extra={p: import_qualified(t) for p, t in layout["extend_extra"].items()},
+        extend_namespace_extra={p: import_qualified(t) for p, t in layout["extend_namespace_extra"].items()},
+    )
+    pack.load(path)
+    pack.name = layout["name"]
+    pack.zipped = layout["zipped"]
+    pack.compression = layout["compression"]
+    pack.compression_level = layout["compression_level"]
+    if (files := sorted(p for p, _ in pack.list_files())) != layout["files"]:
+        raise ValueError(f"{path.name} loaded {len(files)} of its {len(layout['files'])} files")
+    return pack
+
+
+def qualified_name(obj: type) -> str:
+    return f"{obj.__module__}:{obj.__qualname__}"
+
+def import_qualified(name: str) -> Any:
+    module, _, qualname = name.partition(":")
+    obj: Any = importlib.import_module(module)
+    for attr in qualname.split("."):
+        obj = getattr(obj, attr)
+    return obj
+
+
+class DependencyMap:
+    """Top level project folders read by each broadcast module, to find the modules affected by changed files.
+        Built from the same folders and files as the module's input key, including packs loaded from other modules"""
+    def __init__(self, build_cache: BuildCache, directories: list[Path]):
+        self.modules = {directory.name for directory in directories}
+        self.dependents: dict[str, set[str]] = {} # folder name -> ids of modules reading it
+        for directory in directories:
+            folders, files = build_cache.module_folders(directory)
+            config_path = directory / "beet.yaml"
+            config = (yaml.safe_load(config_path.read_text()) or {}) if config_path.exists() else {}
+            required = config.get("meta", {}).get("gm4", {}).get("versioning", {}).get("required", {})
+            names = {p.relative_to(build_cache.ctx.directory).parts[0] for p in folders | files} | {r for r in required if r.startswith("lib_")}
+            for name in names:
+                self.dependents.setdefault(name, set()).add(directory.name)
+
+    def affected(self, changes: Iterable[str]) -> set[str]:
+        """Modules whose build reads any of the changed paths. Shared inputs such as `base/` affect every module"""
+        modules: set[str] = set()
+        for change in changes:
+            path = PurePath(change)
+            if is_shared_input(path):
+                return set(self.modules)
+            modules |= self.dependents.get(path.parts[0], set())
+        return modules
+
+
+def is_shared_input(path: PurePath) -> bool:
+    """Whether the path, relative to the project root, can match any of the SHARED_INPUTS patterns"""
+    for pattern in SHARED_INPUTS:
+        folder, _, rest = pattern.partition("/")
+        if rest and path.parts[0] == folder:
+            return True
+        if not rest and len(path.parts) == 1 and fnmatch(path.name, folder):
+            return True
+    return False
+
+
+@configurable("build_cache", validator=BuildCacheOptions)
+def broadcast(ctx: Context, opts: BuildCacheOptions):
+    """Builds each broadcast subproject in order, restoring modules with unchanged inputs from the build cache"""
+    logger = parent_logger.getChild("broadcast")
+    build_cache = ctx.inject(BuildCache)
+    font_counter = ctx.cache["gui_font_counter"].json
+
+    directories = [d for pattern in opts.broadcast for d in sorted(p for p in ctx.directory.glob(pattern) if p.is_dir())]
+
+    # during `beet dev --watch`, modules not reading any changed file keep their input key from the previous cycle
+    affected: Optional[set[str]] = None
+    if watch_state.changes is not None:
+        affected = DependencyMap(build_cache, directories).affected(watch_state.changes)
+        logger.debug(f"Changes affect {len(affected)} of {len(directories)} modules: {', '.join(sorted(affected))}")
+
+    for directory in directories:
+        font_start = font_counter["__next__"]
+        previous = watch_state.keys.get(directory.name)
+        if affected is not None and directory.name not in affected and previous:
+            key = previous
+        else:
+            key = build_cache.input_key(directory, opts.config)
+        watch_state.keys[directory.name] = key
+
+        if cached := build_cache.lookup(directory.name, key, font_start):
+            logger.info(f"{directory.name} is unchanged, restoring from the build cache")
+            restore(ctx, cached, opts.restore)
+            font_counter["__next__"] += cached.gui_font_count
+            continue
+
+        meta = opts.config.get("meta", {}) | {"build_cache_key": key}
+        autosave = meta.get("autosave", {})
+        meta["link_packs"] = autosave.get("link", True) # as set by beet's broadcast, but linked by `build_cache.link` instead of autosave
+        meta["autosave"] = autosave | {"link": False}
+        ctx.require(subproject(opts.config | {"directory": str(directory), "meta": meta}))
+
+
+def store(ctx: Context):
+    """Stores the finished packs in the build cache, under the key given by `build_cache.broadcast`.
+        Should be first in pipeline to capture the packs after all other plugins cleanup phases"""
+    key: Optional[str] = ctx.meta.get("build_cache_key")
+    font_start: int = ctx.cache["gui_font_counter"].json["__next__"]
+
+    yield # wait for exit phase, after other plugins cleanup
+    if key is None:
+        return
+
+    rp, dp = ctx.packs
+    ctx.inject(BuildCache).store(ctx.directory.name, CachedBuild(
+        key=key,
+        packets=[(rp, dp, picklable_params(project_params(ctx)))],
+        gui_font_start=font_start,
+        gui_font_count=ctx.cache["gui_font_counter"].json["__next__"] - font_start,
+        modeldata=dict(ctx.inject(ModelDataReads).indices),
+    ))
+
+
+def restore(ctx: Context, cached: CachedBuild, plugins: list[str]):
+    """Reconstructs a Context() around each restored pack, runs the given plugins, and merges the packs into the parent context"""
+    for rp, dp, params in cached.packets:
+        c = Context(**params, **{k: getattr(ctx, k) for k in UNPICKLABLE_CONTEXT_PARAMS}, assets=rp, data=dp)
+        c.activate()
+        c.require(*plugins)
+        c.inject(Pipeline).run() # manually run plugin's exit phases as this context is "headless"
+        ctx.assets.merge(rp)
+        ctx.data.merge(dp)
+
+
+def link(ctx: Context):
+    """Links built and restored packs to the world given to `beet dev --link`, in place of autosave.
+        Should be early in pipeline to link the packs after all other plugins cleanup phases"""
+    yield # wait for exit phase, after other plugins cleanup
+    if not ctx.meta.get("link_packs"):
+        return
+    lm = ctx.inject(LinkManager)
+    for directory, pack in zip([lm.resource_pack, lm.data_pack], ctx.packs):
+        if directory and pack:
+            link_pack(lm, pack, Path(directory))
+
+
+def link_pack(lm: LinkManager, pack: ResourcePack | DataPack, directory: Path):
+    """Saves the pack to a linked directory as `LinkManager.autosave_handler` does, but only writes the files that changed since the pack was last linked by this process"""
+    output = directory.resolve() / pack.name
+    previous = _linked_packs.get(output) if output.is_dir() else None
+    if pack.zipped or (previous is None and output.exists()):
+        try:
+            lm.dirty.append(str(pack.save(directory))) # refuses to overwrite packs not linked by this project
+        except PackOverwrite as exc:
+            parent_logger.warning(f"Remove the conflicting pack to set up the link. {exc}")
+        return
+
+    if str(output) not in lm.dirty:
+        lm.dirty.append(str(output)) # removed when the next build starts, unless kept by `preserve_links`
+
+    digests: dict[str, bytes] = {}
+    for path, file in pack.list_files():
+        raw = file.ensure_serialized()
+        digests[path] = digest = hashlib.sha1(raw.encode() if isinstance(raw, str) else raw).digest()
+        if previous is None or previous.get(path) != digest:
+            (output / path).parent.mkdir(parents=True, exist_ok=True)
+            file.dump(output, path)
+    for path in (previous or {}).keys() - digests.keys():
+        (output / path).unlink(missing_ok=True)
+    _linked_packs[output] = digests
+
+
+def preserve_links(lm: LinkManager):
+    """Keeps the packs written by `link_pack` when the next build cleans the previous links, so `beet dev --watch` can update them in place"""
+    lm.dirty[:] = [path for path in lm.dirty if Path(path) not in _linked_packs]
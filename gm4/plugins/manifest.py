@@ -4,24 +4,31 @@ import json
 import logging
 import os
 import sys
+from dataclasses import dataclass, field
 from gzip import GzipFile
 from io import BytesIO
 from pathlib import Path
 from typing import Any, Optional
+from weakref import WeakKeyDictionary
 
 import yaml
-from beet import Context, InvalidProjectConfig, PluginOptions, TextFile, load_config
-from beet.library.base import _dump_files  # type: ignore ; private method used to deterministicify pack dumping
+from beet import Context, InvalidProjectConfig, PluginOptions, TextFile, configurable, load_config
+from beet.core.cache import Cache
 from nbtlib.contrib.minecraft import StructureFileData, StructureFile  # type: ignore ; no stub
-from pydantic.v1 import BaseModel, Extra
-from repro_zipfile import ReproducibleZipFile  # type: ignore ; no stub
+from pydantic.v1 import BaseModel, Extra, ValidationError
 
+from gm4.archive import pack_digest
 from gm4.plugins.versioning import VersioningConfig
-from gm4.utils import Version, run
+from gm4.utils import Version, git_head
 
 parent_logger = logging.getLogger("gm4.manifest")
 
 SUPPORTED_GAME_VERSIONS = ["1.21.5", "1.21.6", "1.21.7"]
+MANIFEST_SECTIONS = [("gm4_*", "modules"), ("lib_*", "libraries"), ("resource_pack", "modules")]
+ENTRY_CACHE_FORMAT = 1 # increment when ManifestConfig or ManifestModuleModel change, to reparse all cached entries
+
+# validated manifest entries by beet.yaml path, kept between `beet dev --watch` cycles
+_parsed_entries: dict[str, tuple[int, int, str, Optional['ManifestModuleModel']]] = {}
 
 # config models for beet.yaml metas
 CreditsModel = dict[str, list[str]]
@@ -85,6 +92,9 @@ class ManifestCacheModel(BaseModel):
 	base: Any
 	contributors: Any
 
+class ManifestCreateOptions(PluginOptions, extra=Extra.ignore):
+	resolve: Optional[list[str]] # only these packs and their requirements are checked for changes, others reuse their cached entries
+
 class ManifestFileModel(BaseModel):
 	"""describes the structure of the meta.json saved to disk"""
 	last_commit: str
@@ -93,39 +103,119 @@ class ManifestFileModel(BaseModel):
 	contributors: Any
 
 
-def create(ctx: Context):
+@dataclass
+class ManifestState:
+	"""Validated manifest of one build, and the cached json it was validated from"""
+	source: dict[str, Any]
+	model: ManifestCacheModel
+	by_id: dict[str, ManifestModuleModel]
+	dirty: bool = False
+	previous: Optional[ManifestFileModel] = None
+	released: dict[str, ManifestModuleModel] = field(default_factory=dict)
+
+# shared by the contexts of every subproject using the same project cache
+_manifest_states: WeakKeyDictionary[Cache, ManifestState] = WeakKeyDictionary()
+
+class BuildManifest:
+	"""Service providing the cached manifest as validated models, indexed by project id and library alias.
+		The manifest is only validated again if the cached json is replaced. Edits to the models are marked with `mark_dirty()`,
+		and written back to the cache by `flush()` before plugins reading the raw json"""
+	def __init__(self, ctx: Context):
+		self.cache = ctx.cache
+
+	@property
+	def state(self) -> ManifestState:
+		cache = self.cache["gm4_manifest"]
+		state = _manifest_states.get(cache)
+		if state is None or (not state.dirty and state.source is not cache.json):
+			model = ManifestCacheModel.parse_obj(cache.json)
+			state = ManifestState(source=cache.json, model=model, by_id={e.id: e for e in (model.libraries|model.modules).values()})
+			_manifest_states[cache] = state
+		return state
+
+	@property
+	def model(self) -> ManifestCacheModel:
+		return self.state.model
+
+	@property
+	def modules(self) -> dict[str, ManifestModuleModel]:
+		return self.state.model.modules
+
+	@property
+	def libraries(self) -> dict[str, ManifestModuleModel]:
+		return self.state.model.libraries
+
+	def get(self, project_id: str) -> Optional[ManifestModuleModel]:
+		"""Entry of a module or library by its project id, eg. `gm4_custom_crafters`"""
+		return self.state.by_id.get(project_id)
+
+	def library(self, alias: str) -> Optional[ManifestModuleModel]:
+		"""Entry of a library by its folder name, eg. `lib_custom_crafters`"""
+		return self.state.model.libraries.get(alias)
+
+	@property
+	def previous(self) -> ManifestFileModel:
+		"""The meta.json of the last release"""
+		return self.load_previous(self.state)
+
+	def released(self, project_id: str) -> Optional[ManifestModuleModel]:
+		"""Entry of a module or library in the last release, by its project id"""
+		state = self.state
+		self.load_previous(state)
+		return state.released.get(project_id)
+
+	def load_previous(self, state: ManifestState) -> ManifestFileModel:
+		if state.previous is None:
+			state.previous = ManifestFileModel.parse_obj(self.cache["previous_manifest"].json)
+			state.released = {m.id:m for m in state.previous.modules if m.version}|{l.id:l for l in state.previous.libraries.values()}
+		return state.previous
+
+	def mark_dirty(self):
+		self.state.dirty = True
+
+	def flush(self):
+		"""Writes edited models back to the cached json"""
+		state = self.state
+		if state.dirty:
+			state.source = self.cache["gm4_manifest"].json = state.model.dict()
+			state.dirty = False
+
+	def invalidate(self):
+		"""Discards the validated models, after the cached json was edited in place"""
+		_manifest_states.pop(self.cache["gm4_manifest"], None)
+
+
+@configurable("manifest", validator=ManifestCreateOptions)
+def create(ctx: Context, opts: ManifestCreateOptions):
 	"""Collect a manifest for all modules from respective beet.yaml files."""
-	manifest = ManifestCacheModel(last_commit=run(["git", "rev-parse", "HEAD"]), modules={}, libraries={}, base={}, contributors=None)
+	manifest = ManifestCacheModel(last_commit=git_head().hash, modules={}, libraries={}, base={}, contributors=None)
 	logger = parent_logger.getChild("create")
-
-	for glob, manifest_section in [("gm4_*", manifest.modules), ("lib_*", manifest.libraries), ("resource_pack", manifest.modules)]:
-		for pack_id in [p.name for p in sorted(ctx.directory.glob(glob))]:
-			try:
-				config = load_config(Path(pack_id) / "beet.yaml")
-				gm4_meta = ctx.validate("gm4", validator=ManifestConfig, options=config.meta["gm4"]) # manually parse config into models  
-
-				manifest_section[pack_id] = ManifestModuleModel(
-					id = config.id,
-					name = config.name,
-					version = config.version,
-					hash = "",
-					video_link = gm4_meta.video or "",
-					wiki_link = gm4_meta.wiki or "",
-					credits = gm4_meta.credits,
-					requires = [e for e in gm4_meta.versioning.required.keys() if not e.startswith("lib")] if gm4_meta.versioning else [],
-					description = gm4_meta.website.description if gm4_meta.website else "",
-					recommends = gm4_meta.website.recommended if gm4_meta.website else [],
-					important_note = gm4_meta.website.notes[0] if gm4_meta.website and len(gm4_meta.website.notes) > 0 else None,
-					minecraft = gm4_meta.minecraft,
-					hidden = len(gm4_meta.minecraft) == 0 or gm4_meta.website is None,
-					publish_date = None,
-					search_keywords = gm4_meta.website.search_keywords if gm4_meta.website else [],
-					modrinth_id = gm4_meta.modrinth.project_id if gm4_meta.modrinth else None,
-					smithed_link = gm4_meta.smithed.pack_id if gm4_meta.smithed else None,
-					pmc_link = gm4_meta.pmc.uid if gm4_meta.pmc else None,
-				)
-			except InvalidProjectConfig as exc:
-				logger.debug(exc.explanation)
+	entry_cache: dict[str, Any] = ctx.cache["manifest_entries"].json
+	if entry_cache.get("format") != ENTRY_CACHE_FORMAT:
+		entry_cache.clear()
+		entry_cache.update({"format": ENTRY_CACHE_FORMAT, "entries": {}})
+
+	pack_ids = {glob: [p.name for p in sorted(ctx.directory.glob(glob))] for glob, _ in MANIFEST_SECTIONS}
+	entries: dict[str, Optional[ManifestModuleModel]] = {}
+
+	pending = [pack_id for ids in pack_ids.values() for pack_id in ids]
+	if opts.resolve is not None: # only the built modules and their requirements, libraries and the resource pack need to be up to date
+		pending = [pack_id for pack_id in pending if not pack_id.startswith("gm4_") or pack_id in opts.resolve]
+	while pending:
+		entries |= {pack_id: load_entry(ctx, pack_id, entry_cache["entries"]) for pack_id in pending}
+		pending = sorted({r for e in entries.values() if e for r in e.requires if r not in entries and (ctx.directory / r).is_dir()})
+
+	for pack_id in [p for ids in pack_ids.values() for p in ids if p not in entries]:
+		try: # possibly outdated, but not used by this build
+			entries[pack_id] = cached_entry(entry_cache["entries"][pack_id])
+		except (KeyError, ValidationError): # not cached yet, or written by an older build
+			entries[pack_id] = load_entry(ctx, pack_id, entry_cache["entries"])
+
+	for glob, section in MANIFEST_SECTIONS:
+		manifest_section: dict[str, ManifestModuleModel] = getattr(manifest, section)
+		for pack_id in pack_ids[glob]:
+			if (entry := entries[pack_id]) is not None:
+				manifest_section[pack_id] = entry
 
 	# Read the contributors metadata
 	contributors_file = Path("gm4/contributors.json")
@@ -143,6 +233,7 @@ def create(ctx: Context):
 
 	# Cache the new manifest, so sub-pipelines can access it
 	ctx.cache["gm4_manifest"].json = manifest.dict()
+	ctx.inject(BuildManifest).invalidate()
 
 	# Read in the previous manifest, if found
 	version = os.getenv("VERSION", "1.21.5")
@@ -162,59 +253,116 @@ def create(ctx: Context):
 
 	
 
+def load_entry(ctx: Context, pack_id: str, entry_cache: dict[str, Any]) -> Optional[ManifestModuleModel]:
+	"""Returns the manifest entry of a pack, reusing the previously validated entry if its beet.yaml is unchanged"""
+	path = ctx.directory / pack_id / "beet.yaml"
+	stat = path.stat()
+	memo = _parsed_entries.get(str(path))
+	if memo and memo[:2] == (stat.st_size, stat.st_mtime_ns):
+		entry_cache.setdefault(pack_id, {"sha1": memo[2], "entry": memo[3].dict() if memo[3] else None})
+		return memo[3].copy(deep=True) if memo[3] else None # the manifest mutates its entries, the memo must stay as parsed
+
+	digest = hashlib.sha1(path.read_bytes()).hexdigest()
+	entry: Optional[ManifestModuleModel] = None
+	cached = entry_cache.get(pack_id)
+	stale = not cached or cached["sha1"] != digest
+	if cached and not stale:
+		try:
+			entry = cached_entry(cached)
+		except ValidationError: # written by an older build
+			stale = True
+	if stale:
+		entry = parse_entry(ctx, pack_id)
+		entry_cache[pack_id] = {"sha1": digest, "entry": entry.dict() if entry else None}
+	_parsed_entries[str(path)] = (stat.st_size, stat.st_mtime_ns, digest, entry.copy(deep=True) if entry else None)
+	return entry
+
+
+def cached_entry(cached: dict[str, Any]) -> Optional[ManifestModuleModel]:
+	"""Validates an entry stored in the manifest_entries cache, which may have been written by an older build"""
+	return ManifestModuleModel.parse_obj(cached["entry"]) if cached["entry"] else None
+
+
+def parse_entry(ctx: Context, pack_id: str) -> Optional[ManifestModuleModel]:
+	"""Reads the manifest entry from the beet.yaml of a pack"""
+	try:
+		config = load_config(ctx.directory / pack_id / "beet.yaml")
+		gm4_meta = ctx.validate("gm4", validator=ManifestConfig, options=config.meta["gm4"]) # manually parse config into models  
+	except InvalidProjectConfig as exc:
+		parent_logger.getChild("create").debug(exc.explanation)
+		return None
+
+	return ManifestModuleModel(
+		id = config.id,
+		name = config.name,
+		version = config.version,
+		hash = "",
+		video_link = gm4_meta.video or "",
+		wiki_link = gm4_meta.wiki or "",
+		credits = gm4_meta.credits,
+		requires = [e for e in gm4_meta.versioning.required.keys() if not e.startswith("lib")] if gm4_meta.versioning else [],
+		description = gm4_meta.website.description if gm4_meta.website else "",
+		recommends = gm4_meta.website.recommended if gm4_meta.website else [],
+		important_note = gm4_meta.website.notes[0] if gm4_meta.website and len(gm4_meta.website.notes) > 0 else None,
+		minecraft = gm4_meta.minecraft,
+		hidden = len(gm4_meta.minecraft) == 0 or gm4_meta.website is None,
+		publish_date = None,
+		search_keywords = gm4_meta.website.search_keywords if gm4_meta.website else [],
+		modrinth_id = gm4_meta.modrinth.project_id if gm4_meta.modrinth else None,
+		smithed_link = gm4_meta.smithed.pack_id if gm4_meta.smithed else None,
+		pmc_link = gm4_meta.pmc.uid if gm4_meta.pmc else None,
+	)
+
+
 def update_patch(ctx: Context):
     """Checks the datapack files for changes from last build, and increments patch number"""
     yield
-    logger = parent_logger.getChild("update_patch")
 
-    # load current manifest from cache
-    this_manifest = ManifestCacheModel.parse_obj(ctx.cache["gm4_manifest"].json)
-    pack = ({e.id:e for e in (this_manifest.libraries|this_manifest.modules).values()})[ctx.project_id]
+    # watch for output file changes
+    scanned_pack = ctx.packs[0 if ctx.meta.get("pack_scan")=="resource_pack" else 1]
+    new_hash = pack_digest(scanned_pack) # serialized files are reused by the release zip while unchanged
+    record_patch(ctx.inject(BuildManifest), ctx.project_id, ctx.project_version, new_hash)
 
-    # attempt to load prior meta.json manifest
-    last_manifest = ManifestFileModel.parse_obj(ctx.cache["previous_manifest"].json)
-    released_modules: dict[str, ManifestModuleModel] = {m.id:m for m in last_manifest.modules if m.version}|{l.id:l for l in last_manifest.libraries.values()}
+
+def record_patch(manifest: BuildManifest, project_id: str, project_version: str, new_hash: str):
+    """Stores the pack hash in the manifest, and increments the patch number if the pack changed since the last release.
+        Also used by the build cache to version modules restored from an earlier build"""
+    logger = parent_logger.getChild("update_patch")
+
+    pack = manifest.get(project_id)
+    if pack is None:
+        raise KeyError(f"{project_id} has no manifest entry")
 
     # determine this modules status
-    released = released_modules.get(ctx.project_id, None)
+    released = manifest.released(project_id)
     last_ver = Version(released.version) if released else Version("0.0.0")
-    this_ver = Version(ctx.project_version)
+    this_ver = Version(project_version)
     publish_date = released.publish_date if released else None
     pack.publish_date = publish_date or datetime.datetime.now().date().isoformat()
     old_hash = released.hash if released else ""
-
-    # watch for output file changes
-    fileobj = BytesIO()
-    scanned_pack = ctx.packs[0 if ctx.meta.get("pack_scan")=="resource_pack" else 1]
-    with ReproducibleZipFile(fileobj, mode='w') as zf:
-        _dump_files(zf, sorted(scanned_pack.list_files())) # write datapack to temporary memory
-            # beet's default dump depends on file load order, which is nondeterministic
-            # here we recreate the ctx.data.dump(zf) behavior but by sorting the files first
-
-    new_hash = hashlib.sha1(fileobj.getvalue()).hexdigest()
     pack.hash = new_hash
 
     # first release of a module
     if not released:
         pack.version = pack.version.replace("X", "0")
-        logger.debug(f"First release of {ctx.project_id}", extra={"project_id": ctx.project_id})
+        logger.debug(f"First release of {project_id}", extra={"project_id": project_id})
 
     # otherwise check for changes
     else:
         if (this_ver != last_ver.replace(patch=None)) or (new_hash != old_hash): # changes were made, bump the patch
             if this_ver.minor > last_ver.minor or this_ver.major > last_ver.major: # type: ignore
                 this_ver.patch = 0
-                logger.info(f"Feature update for {ctx.project_id}, setting version to {this_ver}", extra={"gh_annotate_skip": True, "project_id": ctx.project_id})
+                logger.info(f"Feature update for {project_id}, setting version to {this_ver}", extra={"gh_annotate_skip": True, "project_id": project_id})
             else:
                 this_ver.patch = last_ver.patch + 1 # type: ignore
-                logger.info(f"Patch update for {ctx.project_id}, incrementing to {this_ver}", extra={"gh_annotate_skip": True, "project_id": ctx.project_id})
+                logger.info(f"Patch update for {project_id}, incrementing to {this_ver}", extra={"gh_annotate_skip": True, "project_id": project_id})
 
             pack.version = str(this_ver)
 
         else: # no changes, keep the patch
              pack.version = released.version
 
-    ctx.cache["gm4_manifest"].json = this_manifest.dict()
+    manifest.mark_dirty()
 
 
 def write_meta(ctx: Context):
@@ -224,6 +372,7 @@ def write_meta(ctx: Context):
 	os.makedirs(release_dir, exist_ok=True)
 
 	manifest_file = release_dir / "meta.json"
+	ctx.inject(BuildManifest).flush()
 	manifest = ctx.cache["gm4_manifest"].json.copy()
 	manifest["modules"] = list(manifest["modules"].values()) # convert modules dict down to list for backwards compatability
 	manifest.pop("base")
@@ -232,8 +381,8 @@ def write_meta(ctx: Context):
 
 def write_credits(ctx: Context):
 	"""Writes the credits metadata to CREDITS.md. and collects for README.md"""
-	manifest = ManifestCacheModel.parse_obj(ctx.cache["gm4_manifest"].json)
-	contributors = manifest.contributors
+	manifest = ctx.inject(BuildManifest)
+	contributors = manifest.model.contributors
 	module = manifest.modules.get(ctx.project_id)
 	credits = module.credits if module else {}
 	if len(credits) == 0:
@@ -272,8 +421,7 @@ def write_updates(ctx: Context):
 	if init is None:
 		return
 
-	manifest = ManifestCacheModel.parse_obj(ctx.cache["gm4_manifest"].json)
-	modules = manifest.modules
+	modules = ctx.inject(BuildManifest).modules
 
 	score = f"{ctx.project_id.removeprefix('gm4_')} gm4_modules"
 	version = Version(modules[ctx.project_id].version)
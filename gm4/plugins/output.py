@@ -1,21 +1,32 @@
-from beet import Context
+from beet import Context, PluginOptions, configurable
+from concurrent.futures import Future, ThreadPoolExecutor
 from pathlib import Path
+from pydantic.v1 import BaseModel
+from requests.adapters import HTTPAdapter
+from typing import Any, Optional
 import os
 import json
 import re
 import requests
 import shutil
 import logging
-from gm4.utils import run, Version, NoneAttribute
-from gm4.plugins.manifest import ManifestConfig, ManifestCacheModel
+import threading
+import time
+from gm4.archive import zip_pack
+from gm4.utils import git_head, Version
+from gm4.plugins.manifest import BuildManifest, ManifestConfig
 
 parent_logger = logging.getLogger("gm4.output")
 
-MODRINTH_API = "https://api.modrinth.com/v2"
+MODRINTH_API = os.getenv("MODRINTH_API", "https://api.modrinth.com/v2") # point at `python -m gm4.publish_stub` to test publishing locally
 MODRINTH_AUTH_KEY = "BEET_MODRINTH_TOKEN"
-SMITHED_API = "https://api.smithed.dev/v2"
+SMITHED_API = os.getenv("SMITHED_API", "https://api.smithed.dev/v2")
 SMITHED_AUTH_KEY = "BEET_SMITHED_TOKEN"
 USER_AGENT = "Gamemode4Dev/GM4_Datapacks/release-pipeline (gamemode4official@gmail.com)"
+PUBLISH_RATE_LIMITS = {"modrinth": (4, 0.2), "smithed": (4, 0.1)} # requests in flight at once, seconds between requests
+PUBLISH_RETRIES = 4 # for rate limited and failed requests
+PUBLISH_BACKOFF = 1.0 # seconds before the first retry, doubling each attempt
+PUBLISH_TIMEOUT = 60
 
 
 def beet_default(ctx: Context):
@@ -48,11 +59,7 @@ def release_resource_pack(ctx: Context):
 
 	yield
 
-	ctx.assets.save(
-		path=release_dir / f"gm4_resource_pack_{version.replace('.', '_')}.zip",
-		overwrite=True,
-		zipped=True
-	)
+	zip_pack(ctx.assets, release_dir / f"gm4_resource_pack_{version.replace('.', '_')}.zip")
 
 
 def test(ctx: Context):
@@ -74,13 +81,9 @@ def release(ctx: Context):
 	Saves the zipped datapack and metadata to the ./release/{version} folder.
 		Should be first in pipeline to properly wrap all other plugins cleanup phases
 	
-	If the module has the `version` and `meta.modrinth.project_id` fields, and
-	`BEET_MODRINTH_TOKEN` environment variable is set, will try to publish a
-	new version to Modrinth if it doesn't already exist.
-
-	Similarly, if the module has the `version` and `meta.smithed.pack_id` fields, and
-	`BEET_SMITHED_TOKEN` environment variable is set, will try to publish a
-	new version to Smithed if it doesn't already exist.
+	If the module has the `meta.modrinth.project_id` or `meta.smithed.pack_id` fields,
+	it is queued for the `publish` stage, which publishes a new version to Modrinth
+	and Smithed if it doesn't already exist.
 	"""
 	version_dir = os.getenv("VERSION", "1.21.5")
 	release_dir = Path("release") / version_dir
@@ -91,11 +94,7 @@ def release(ctx: Context):
 
 	yield # wait for exit phase, after other plugins cleanup
 	
-	ctx.data.save(
-		path=release_dir / file_name,
-		overwrite=True,
-		zipped=True,
-	)
+	zip_pack(ctx.data, release_dir / file_name)
 
 	generated_dir = release_dir / "generated"
 
@@ -111,43 +110,171 @@ def release(ctx: Context):
 
 	config = ctx.validate("gm4", ManifestConfig)
 
-	# publish to download platforms
-	publish_modrinth(ctx, config, release_dir, file_name)
-	publish_smithed(ctx, config, file_name)
-
+	# queue for the publish stage, which runs once every module is released
+	if config.modrinth or config.smithed:
+		# update_patch has already run in this exit phase, so the manifest holds the final version of this release
+		manifest = ctx.inject(BuildManifest)
+		entry = manifest.modules.get(corrected_project_id) or manifest.library(corrected_project_id)
+		ctx.cache["publish_queue"].json.setdefault("jobs", {})[corrected_project_id] = PublishJob(
+			project_id=ctx.project_id,
+			pack_id=corrected_project_id,
+			project_name=ctx.project_name,
+			versioned=bool(ctx.project_version),
+			version=entry.version if entry else None,
+			file_name=file_name,
+			minecraft=config.minecraft,
+			modrinth=config.modrinth.project_id if config.modrinth else None,
+			smithed=config.smithed.pack_id if config.smithed else None,
+			modrinth_readme=ctx.meta["modrinth_readme"].text if "modrinth_readme" in ctx.meta else None,
+		).dict()
+
+
+class PublishJob(BaseModel):
+	"""A released module waiting to be published, as queued by `release`"""
+	project_id: str
+	pack_id: str # project id with the lib_ prefix for libraries, as used in the release folder
+	project_name: str
+	versioned: bool
+	version: Optional[str] # full version released by this build
+	file_name: str
+	minecraft: list[str]
+	modrinth: Optional[str] # modrinth project id
+	smithed: Optional[str] # smithed pack id
+	modrinth_readme: Optional[str]
+
+
+class PublishOptions(PluginOptions):
+	dry_run: bool = False # publish to a local `gm4.publish_stub` server instead
+	modules: list[str] = [] # only publish these modules, all queued modules if empty
+
+
+class PublishService:
+	"""Pooled session to a download platform's api. Spaces requests by the platform's rate limit and retries failed requests with exponential backoff"""
+	def __init__(self, api: str, token: str, concurrency: int, interval: float):
+		self.api = api
+		self.token = token
+		self.concurrency = concurrency
+		self.interval = interval
+		self.next_request = 0.0 # time before which no new request is sent
+		self.lock = threading.Lock()
+		self.session = requests.Session()
+		self.session.headers.update({"User-Agent": USER_AGENT})
+		self.session.mount(api, HTTPAdapter(pool_connections=1, pool_maxsize=concurrency))
+
+	def request(self, method: str, path: str, **kwargs: Any) -> requests.Response:
+		for attempt in range(PUBLISH_RETRIES + 1):
+			self.wait()
+			try:
+				res = self.session.request(method, self.api + path, timeout=PUBLISH_TIMEOUT, **kwargs)
+			except (requests.ConnectionError, requests.Timeout):
+				if method == "POST" or attempt == PUBLISH_RETRIES:
+					raise # a post may have been received, retrying could publish the version twice
+				time.sleep(PUBLISH_BACKOFF * 2**attempt)
+				continue
+			if attempt == PUBLISH_RETRIES or not (res.status_code == 429 or (res.status_code >= 500 and method != "POST")):
+				return res
+			retry_after = res.headers.get("Retry-After", "")
+			delay = float(retry_after) if retry_after.isdecimal() else PUBLISH_BACKOFF * 2**attempt
+			with self.lock:
+				self.next_request = max(self.next_request, time.time() + delay)
+		raise AssertionError("unreachable")
+
+	def wait(self):
+		with self.lock:
+			now = time.time()
+			send_time = max(now, self.next_request)
+			self.next_request = send_time + self.interval
+		time.sleep(send_time - now)
+
+	def close(self):
+		self.session.close()
+
+
+@configurable("publish", validator=PublishOptions)
+def publish(ctx: Context, opts: PublishOptions):
+	"""
+	Publishes the modules queued by `release` to Modrinth and Smithed, once the whole release is built.
+		Each platform's api calls for every module are issued concurrently through one pooled session.
 
-def publish_modrinth(ctx: Context, config: ManifestConfig, release_dir: Path, file_name: str):
+	Publishing to Modrinth requires the `BEET_MODRINTH_TOKEN` environment variable, and to Smithed
+	the `BEET_SMITHED_TOKEN` environment variable. With `dry_run`, every call is instead sent to a
+	local `gm4.publish_stub` server and logged.
+	"""
+	logger = logging.getLogger("gm4.publish") # outside gm4.output, whose loggers are summarized per module
+	version_dir = os.getenv("VERSION", "1.21.5")
+	release_dir = Path("release") / version_dir
+	jobs = [PublishJob.parse_obj(job) for job in ctx.cache["publish_queue"].json.get("jobs", {}).values()]
+	if opts.modules:
+		jobs = [job for job in jobs if job.project_id in opts.modules or job.pack_id in opts.modules]
+
+	stub = None
+	if opts.dry_run:
+		from gm4.publish_stub import PublishStub
+		stub = PublishStub(("localhost", 0))
+		threading.Thread(target=stub.serve_forever, daemon=True).start()
+		apis = {"modrinth": (f"{stub.url}/modrinth", "dry-run"), "smithed": (f"{stub.url}/smithed", "dry-run")}
+	else:
+		apis = {"modrinth": (MODRINTH_API, os.getenv(MODRINTH_AUTH_KEY)), "smithed": (SMITHED_API, os.getenv(SMITHED_AUTH_KEY))}
+
+	services = {name: PublishService(api, token, *PUBLISH_RATE_LIMITS[name]) for name, (api, token) in apis.items() if token}
+	if not services or not jobs:
+		return
+	logger.debug(f"Publishing {len(jobs)} modules to {', '.join(services)}")
+
+	executors = {name: ThreadPoolExecutor(service.concurrency) for name, service in services.items()}
+	futures: list[Future[None]] = []
+	if modrinth := services.get("modrinth"):
+		changelog = re.sub(r"\(#(\d+)\)", "([#\\1](https://github.com/Gamemode4Dev/GM4_Datapacks/pull/\\1))", git_head().subject)
+		futures += [executors["modrinth"].submit(publish_modrinth, modrinth, job, job.version, release_dir, changelog) for job in jobs if job.modrinth]
+	if smithed := services.get("smithed"):
+		commit_hash = git_head("release").hash
+		futures += [executors["smithed"].submit(publish_smithed, smithed, job, job.version or "", version_dir, commit_hash) for job in jobs if job.smithed]
+
+	try:
+		for future in futures:
+			future.result()
+	finally:
+		for executor in executors.values():
+			executor.shutdown()
+		for service in services.values():
+			service.close()
+		if stub:
+			stub.shutdown()
+			for method, path in stub.requests:
+				logger.info(f"Dry run: {method} {path}")
+
+
+def publish_modrinth(modrinth: PublishService, job: PublishJob, version: Optional[str], release_dir: Path, changelog: str):
 	'''Attempts to publish pack to modrinth'''
-	auth_token = os.getenv(MODRINTH_AUTH_KEY, None)
-	logger = parent_logger.getChild(f"modrinth.{ctx.project_id}")
-	if config.modrinth and auth_token:
+	logger = parent_logger.getChild(f"modrinth.{job.project_id}")
+	headers = {'Authorization': modrinth.token}
+	try:
 		# update page description
-		res = requests.get(f"{MODRINTH_API}/project/{config.modrinth.project_id}", headers={'Authorization': auth_token, 'User-Agent': USER_AGENT})
+		res = modrinth.request("GET", f"/project/{job.modrinth}", headers=headers)
 		if not (200 <= res.status_code < 300):
 			if res.status_code == 404:
-				logger.warning(f"Cannot edit description of modrinth project {config.modrinth.project_id} as it doesn't exist.")
+				logger.warning(f"Cannot edit description of modrinth project {job.modrinth} as it doesn't exist.")
 			else:
 				logger.warning(f"Failed to get project: {res.status_code} {res.text}")
 			return
 		existing_readme = res.json()["body"]
-		if existing_readme != (d:=ctx.meta['modrinth_readme'].text):
+		if job.modrinth_readme is not None and existing_readme != job.modrinth_readme:
 			logger.debug("Readme and modrinth-page content differ. Updating webpage body")
-			res = requests.patch(f"{MODRINTH_API}/project/{config.modrinth.project_id}", headers={'Authorization': auth_token, 'User-Agent': USER_AGENT}, json={"body": d})
+			res = modrinth.request("PATCH", f"/project/{job.modrinth}", headers=headers, json={"body": job.modrinth_readme})
 			if not (200 <= res.status_code < 300):
 				logger.warning(f"Failed to update description: {res.status_code} {res.text}")
-			logger.info(f"Successfully updated description of {ctx.project_name}", extra={"gh_annotate_skip": True})
+			logger.info(f"Successfully updated description of {job.project_name}", extra={"gh_annotate_skip": True})
 
 		# upload datapack zip
-		if ctx.project_version:
-			version = ctx.cache["gm4_manifest"].json["modules"].get(ctx.project_id, {}).get("version", None)
+		if job.versioned:
 			if version is None:
 				logger.warning("Full version number not available in ctx.meta. Skipping publishing")
 				return
 
-			res = requests.get(f"{MODRINTH_API}/project/{config.modrinth.project_id}/version", headers={'Authorization': auth_token, 'User-Agent': USER_AGENT})
+			res = modrinth.request("GET", f"/project/{job.modrinth}/version", headers=headers)
 			if not (200 <= res.status_code < 300):
 				if res.status_code == 404:
-					logger.warning(f"Cannot publish to modrinth project {config.modrinth.project_id} as it doesn't exist.")
+					logger.warning(f"Cannot publish to modrinth project {job.modrinth} as it doesn't exist.")
 				else:
 					logger.warning(f"Failed to get project versions: {res.status_code} {res.text}")
 				return
@@ -156,65 +283,57 @@ def publish_modrinth(ctx: Context, config: ManifestConfig, release_dir: Path, fi
 			matching_version = next((v for v in project_data if v["version_number"] == str(version)), None)
 			if matching_version is not None: # patch version already exists
 				# update mc versions if necessary
-				if len(config.minecraft) > 0 and not set(matching_version["game_versions"]) == set(config.minecraft):
+				if len(job.minecraft) > 0 and not set(matching_version["game_versions"]) == set(job.minecraft):
 					# supported versions has changed and is not empty
 					logger.debug("Additional MC version support has been added to an existing patch version. Updating existing modrinth version data")
-					res = requests.patch(f"{MODRINTH_API}/version/{matching_version['id']}", headers={'Authorization': auth_token, 'User-Agent': USER_AGENT}, json={
-						"game_versions": config.minecraft
+					res = modrinth.request("PATCH", f"/version/{matching_version['id']}", headers=headers, json={
+						"game_versions": job.minecraft
 					})
 					if not (200 <= res.status_code < 300):
 						logger.warning(f"Failed to patch project versions: {res.status_code} {res.text}")
 				return
 
-			if len(config.minecraft) > 0:
+			if len(job.minecraft) > 0:
 				# supported versions is not empty, post new version
-				with open(release_dir / file_name, "rb") as f:
-					file_bytes = f.read()
-
-				changelog = run(["git", "log", "-1", "--format=%s"])
-				changelog = re.sub(r"\(#(\d+)\)", "([#\\1](https://github.com/Gamemode4Dev/GM4_Datapacks/pull/\\1))", changelog)
-
-				res = requests.post(f"{MODRINTH_API}/version", headers={'Authorization': auth_token, 'User-Agent': USER_AGENT}, files={
+				file_bytes = (release_dir / job.file_name).read_bytes()
+				res = modrinth.request("POST", "/version", headers=headers, files={
 					"data": json.dumps({
-						"name": f"{ctx.project_name} v{version}",
+						"name": f"{job.project_name} v{version}",
 						"version_number": version,
 						"changelog": changelog,
 						"dependencies": [],
-						"game_versions": config.minecraft,
+						"game_versions": job.minecraft,
 						"version_type": "release",
 						"loaders": ["datapack"],
 						"featured": False,
-						"project_id": config.modrinth.project_id,
-						"file_parts": [file_name],
+						"project_id": job.modrinth,
+						"file_parts": [job.file_name],
 					}),
-					file_name: file_bytes,
+					job.file_name: file_bytes,
 				})
 				if not (200 <= res.status_code < 300):
 					logger.warning(f"Failed to publish new version version: {res.status_code} {res.text}")
 					return
 				logger.info(f"Successfully published {res.json()['name']}", extra={"gh_annotate_skip": True})
+	except requests.RequestException as e:
+		logger.warning(f"Failed to reach modrinth: {e}")
 
 
-def publish_smithed(ctx: Context, config: ManifestConfig, file_name: str):
+def publish_smithed(smithed: PublishService, job: PublishJob, version: str, mc_version_dir: str, commit_hash: str):
 	"""Attempts to publish pack to smithed"""
-	auth_token = os.getenv(SMITHED_AUTH_KEY, None)
-	logger = parent_logger.getChild(f"smithed.{ctx.project_id}")
-	mc_version_dir = os.getenv("VERSION", "1.21.5")
-	manifest = ManifestCacheModel.parse_obj(ctx.cache["gm4_manifest"].json)
-	project_id = stem if (stem:=ctx.directory.stem).startswith("lib") else ctx.project_id
-
-	if config.smithed and auth_token:
-		version = (manifest.modules|manifest.libraries).get(project_id, NoneAttribute()).version or ""
-
+	logger = parent_logger.getChild(f"smithed.{job.project_id}")
+	project_id = job.pack_id
+	params = {'token': smithed.token}
+	try:
 		# get project data and existing versions
-		res = requests.get(f"{SMITHED_API}/packs/{config.smithed.pack_id}")
+		res = smithed.request("GET", f"/packs/{job.smithed}")
 		if not (200 <= res.status_code < 300):
 			if res.status_code == 404:
-				logger.warning(f"Cannot publish to smithed project {config.smithed.pack_id} as it doesn't exist.")
+				logger.warning(f"Cannot publish to smithed project {job.smithed} as it doesn't exist.")
 			else:
 				logger.warning(f"Failed to get project: {res.status_code} {res.text}")
 			return
-		
+
 		project_data = res.json()
 
 		# update description and pack image
@@ -228,7 +347,7 @@ def publish_smithed(ctx: Context, config: ManifestConfig, file_name: str):
 
 			if project_display["icon"] != current_icon or project_display["webPage"] != current_readme:
 				logger.debug("Pack Icon or Readme hyperlink is incorrect. Updating project")
-				res = requests.patch(f"{SMITHED_API}/packs/{config.smithed.pack_id}", params={'token': auth_token},
+				res = smithed.request("PATCH", f"/packs/{job.smithed}", params=params,
 					json={"data": {
 							"display": {
 								"icon": current_icon,
@@ -237,17 +356,17 @@ def publish_smithed(ctx: Context, config: ManifestConfig, file_name: str):
 					}})
 				if not (200 <= res.status_code < 300):
 					logger.warning(f"Failed to update descripion: {res.status_code} {res.text}")
-				logger.info(f"{ctx.project_name} {res.text}", extra={"gh_annotate_skip": True})
+				logger.info(f"{job.project_name} {res.text}", extra={"gh_annotate_skip": True})
 
 		matching_version = next((v for v in project_versions if v["name"] == str(version)), None)
 		if matching_version is not None: # patch version already exists
 			# update MC version if necessary
-			if len(config.minecraft) > 0 and not set(matching_version["supports"]) == set(config.minecraft):
+			if len(job.minecraft) > 0 and not set(matching_version["supports"]) == set(job.minecraft):
 				# supported versions has changed and is not empty
 				logger.debug("Additional MC version support has been added to an existing patch version. Updating existing smithed version data")
-				res = requests.patch(f"{SMITHED_API}/packs/{config.smithed.pack_id}/versions/{matching_version['name']}", params={'token': auth_token}, json={
+				res = smithed.request("PATCH", f"/packs/{job.smithed}/versions/{matching_version['name']}", params=params, json={
 					"data": {
-						"supports": config.minecraft
+						"supports": job.minecraft
 					}
 				})
 				if not (200 <= res.status_code < 300):
@@ -255,15 +374,14 @@ def publish_smithed(ctx: Context, config: ManifestConfig, file_name: str):
 			return
 
 		# permalink previous version (in that MC version) to the git history
-		commit_hash = run("cd release && git log -1 --format=%H")
-		matching_mc_versions = sorted((Version(v["name"]) for v in project_versions if set(v['supports']) & set(config.minecraft)))
+		matching_mc_versions = sorted((Version(v["name"]) for v in project_versions if set(v['supports']) & set(job.minecraft)))
 		prior_version_in_mc_version = matching_mc_versions[-1] if len(matching_mc_versions) > 0 else None # newest version number, with any MC overlap
 		prior_url: str = next((v["downloads"]["datapack"] for v in project_versions if Version(v["name"]) == prior_version_in_mc_version), "")
 		if "https://github.com/Gamemode4Dev/GM4_Datapacks/blob/" not in prior_url and prior_version_in_mc_version:
-			res = requests.patch(f"{SMITHED_API}/packs/{config.smithed.pack_id}/versions/{prior_version_in_mc_version}", params={'token': auth_token}, json={
+			res = smithed.request("PATCH", f"/packs/{job.smithed}/versions/{prior_version_in_mc_version}", params=params, json={
 				"data":{
 					"downloads": {
-					"datapack": f"https://github.com/Gamemode4Dev/GM4_Datapacks/blob/{commit_hash}/{mc_version_dir}/{file_name}?raw=true",
+					"datapack": f"https://github.com/Gamemode4Dev/GM4_Datapacks/blob/{commit_hash}/{mc_version_dir}/{job.file_name}?raw=true",
 					"resourcepack": ""
 					}
 				}
@@ -273,24 +391,26 @@ def publish_smithed(ctx: Context, config: ManifestConfig, file_name: str):
 			else:
 				logger.info(f"Permalinked {project_id} {prior_version_in_mc_version} to git history: {res.text}", extra={"gh_annotate_skip": True})
 
-		if len(config.minecraft) > 0:
+		if len(job.minecraft) > 0:
 			# supported versions is not empty, post new version
-			res = requests.post(f"{SMITHED_API}/packs/{config.smithed.pack_id}/versions",
-					params={'token': auth_token, 'version': version},
+			res = smithed.request("POST", f"/packs/{job.smithed}/versions",
+					params=params | {'version': version},
 				json={"data":{
 					"downloads":{
-						"datapack": f"https://raw.githubusercontent.com/Gamemode4Dev/GM4_Datapacks/release/{mc_version_dir}/{file_name}",
+						"datapack": f"https://raw.githubusercontent.com/Gamemode4Dev/GM4_Datapacks/release/{mc_version_dir}/{job.file_name}",
 						"resourcepack": ""
 					},
 					"name": version,
-					"supports": config.minecraft,
+					"supports": job.minecraft,
 					"dependencies": []
 				}}
 			)
 			if not (200 <= res.status_code < 300):
-				logger.warning(f"Failed to publish new version of {ctx.project_name}: {res.status_code} {res.text}")
+				logger.warning(f"Failed to publish new version of {job.project_name}: {res.status_code} {res.text}")
 				return
-			logger.info(f"{ctx.project_name} {res.text}", extra={"gh_annotate_skip": True})
+			logger.info(f"{job.project_name} {res.text}", extra={"gh_annotate_skip": True})
+	except requests.RequestException as e:
+		logger.warning(f"Failed to reach smithed: {e}")
 
 
 def clear_release(ctx: Context):
@@ -303,6 +423,7 @@ def clear_release(ctx: Context):
 	release_dir = Path("release") / version
 	shutil.rmtree(release_dir, ignore_errors=True)
 	os.makedirs(release_dir, exist_ok=True)
+	ctx.cache["publish_queue"].json = {"jobs": {}}
 
 
 def readmes(ctx: Context):
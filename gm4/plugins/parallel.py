@@ -0,0 +1,336 @@
+import logging
+import os
+import pickle
+import shutil
+import sys
+from concurrent.futures import Future, ProcessPoolExecutor
+from dataclasses import dataclass, field
+from multiprocessing import get_context
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from typing import Any, Optional
+
+from beet import Cache, Context, JsonFile, PluginOptions, ProjectCache, ProjectConfig, configurable
+from beet.toolchain.project import Project, ProjectBuilder
+from pydantic.v1 import Extra
+
+from gm4.plugins.annotations import SUMMARY_LOGGERS, annotation_handler
+from gm4.plugins.build_cache import BuildCache, CachedBuild, ModelDataReads
+from gm4.plugins import profiler
+from gm4.plugins.manifest import BuildManifest, record_patch
+from gm4.plugins.vanilla_index import VanillaIndex
+from gm4.plugins.worker import RETRIEVE_ALL_PROJECTS, UNPICKLABLE_CONTEXT_PARAMS, ProjectPacket, bridge, picklable_params
+
+parent_logger = logging.getLogger("gm4.parallel")
+
+# cache entries read or written by the broadcast pipeline, which are copied into and back out of each worker process
+SHARED_CACHE_KEYS = ["gm4_manifest", "previous_manifest", "modeldata_registry", "translations", "gui_font_counter", "mineskin", "skin_digests", "texture_colors"]
+READ_ONLY_CACHES = ["vanilla", "vanilla_index"] # caches prepared by the parent build, which workers read in place
+# unicode characters reserved for each module's gui fonts, so workers never hand out the same character. Modules therefore get
+# different characters than from a sequential broadcast, which hands them out back to back. Their fonts and translations stay consistent
+GUI_FONT_BLOCK_SIZE = 64
+
+class ParallelBroadcastConfig(PluginOptions, extra=Extra.ignore):
+    broadcast: list[str]
+    config: dict[str, Any] = {}
+    workers: Optional[int] # defaults to the number of available cores
+
+@dataclass
+class SubprojectJob:
+    """Everything a worker process needs to build one broadcast subproject"""
+    directory: str
+    root_directory: str
+    config: dict[str, Any]
+    shared_cache: dict[str, Any]
+    read_only_caches: dict[str, str]
+    log_level: int
+    profile: bool = False # time the worker's plugins for `gm4.plugins.profiler`
+
+@dataclass
+class SubprojectSnapshot:
+    """Picklable result of a worker process build, sent back to the parent build"""
+    directory: str
+    packets: list[ProjectPacket] = field(default_factory=list)
+    cache: dict[str, Any] = field(default_factory=dict)
+    records: list[logging.LogRecord] = field(default_factory=list)
+    modeldata: dict[str, Optional[int]] = field(default_factory=dict) # custom_model_data looked up by the build, as stored in the build cache
+    profile: Optional[profiler.ProcessProfile] = None
+
+
+@configurable("parallel_broadcast", validator=ParallelBroadcastConfig)
+def broadcast(ctx: Context, opts: ParallelBroadcastConfig):
+    """Builds each broadcast subproject in a separate process, and stores the finished packs with the worker bridge.
+        The stored packs are then available to `worker.retrieve_and_run` and `worker.retrieve_and_merge` as if built by a normal broadcast.
+        Workers start from the same modeldata registry, so modules issuing custom_model_data already issued by an earlier module
+        are rebuilt against the merged registry, in rounds until no module conflicts"""
+    logger = parent_logger.getChild("broadcast")
+    directories = sorted({p for pattern in opts.broadcast for p in ctx.directory.glob(pattern) if p.is_dir()})
+    workers = opts.workers or available_cores()
+
+    # index the vanilla jar once, so workers only ever read from the shared vanilla caches
+    ctx.inject(VanillaIndex).get()
+    for name in READ_ONLY_CACHES:
+        ctx.cache[name].flush()
+
+    manifest = ctx.inject(BuildManifest)
+    manifest.flush() # versions recorded by earlier subprojects, such as the libraries
+    shared_cache = {key: ctx.cache[key].json for key in SHARED_CACHE_KEYS}
+    font_base: int = shared_cache["gui_font_counter"]["__next__"]
+    skin_cache = JsonFile(source_path="gm4/skin_cache.json").data
+
+    # modules with unchanged inputs are restored from the build cache, instead of being sent to a worker
+    build_cache = ctx.inject(BuildCache)
+    keys: dict[str, str] = {}
+    restored: dict[str, CachedBuild] = {}
+
+    jobs: list[SubprojectJob] = []
+    for i, directory in enumerate(directories):
+        font_start = font_base + i*GUI_FONT_BLOCK_SIZE
+        keys[str(directory)] = key = build_cache.input_key(directory, opts.config)
+        if cached := build_cache.lookup(directory.name, key, font_start):
+            restored[str(directory)] = cached
+            continue
+
+        job_cache = pickle.loads(pickle.dumps(shared_cache)) # independant copy for each job
+        job_cache["gui_font_counter"]["__next__"] = font_start
+        jobs.append(SubprojectJob(
+            directory=str(directory),
+            root_directory=str(ctx.directory),
+            config=opts.config,
+            shared_cache=job_cache,
+            read_only_caches={name: str(ctx.cache[name].directory) for name in READ_ONLY_CACHES},
+            log_level=logging.getLogger().level,
+            profile=profiler.active is not None
+        ))
+
+    logger.info(f"Building {len(jobs)} subprojects with {workers} worker processes, {len(restored)} restored from the build cache")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=get_context("spawn")) as executor:
+        snapshots = list(executor.map(build_subproject, jobs)) # results are kept in broadcast order
+
+        # merge in broadcast order, rebuilding the conflicting modules together against the merged registry until none conflict.
+        # The first conflicting module of each round always merges cleanly, as it sees everything merged before it
+        registry = ctx.cache["modeldata_registry"].json
+        pending = list(range(len(jobs)))
+        rebuilding = False
+        while pending:
+            conflicting: list[int] = []
+            for i in pending:
+                if conflicts := merge_registry(registry, jobs[i].shared_cache["modeldata_registry"], snapshots[i].cache["modeldata_registry"]):
+                    logger.info(f"{Path(jobs[i].directory).name} issued custom_model_data already issued by another module ({', '.join(conflicts)}), rebuilding it with the merged registry")
+                    conflicting.append(i)
+            if rebuilding and len(conflicting) == len(pending):
+                raise RuntimeError(f"Rebuilt modules keep issuing conflicting custom_model_data: {', '.join(Path(jobs[i].directory).name for i in conflicting)}")
+
+            futures: list[Future[SubprojectSnapshot]] = []
+            for i in conflicting:
+                jobs[i].shared_cache["modeldata_registry"] = pickle.loads(pickle.dumps(registry))
+                futures.append(executor.submit(build_subproject, jobs[i]))
+            for i, future in zip(conflicting, futures):
+                snapshots[i] = future.result()
+            pending = conflicting
+            rebuilding = True
+
+    for job, snapshot in zip(jobs, snapshots):
+        if (font_count := snapshot.cache["gui_font_counter"]["__next__"] - job.shared_cache["gui_font_counter"]["__next__"]) > GUI_FONT_BLOCK_SIZE:
+            raise RuntimeError(f"{Path(job.directory).name} uses {font_count} gui font characters, more than the {GUI_FONT_BLOCK_SIZE} reserved for each module. Increase GUI_FONT_BLOCK_SIZE")
+
+    merge_cache(ctx, shared_cache, skin_cache, snapshots)
+    manifest.invalidate()
+    ctx.cache["gui_font_counter"].json["__next__"] = font_base + len(directories)*GUI_FONT_BLOCK_SIZE
+
+    for job, snapshot in zip(jobs, snapshots):
+        module_id = Path(snapshot.directory).name
+        build_cache.store(module_id, CachedBuild(
+            key=keys[snapshot.directory],
+            packets=snapshot.packets,
+            gui_font_start=job.shared_cache["gui_font_counter"]["__next__"],
+            gui_font_count=snapshot.cache["gui_font_counter"]["__next__"] - job.shared_cache["gui_font_counter"]["__next__"],
+            modeldata=snapshot.modeldata,
+            pack_hash=snapshot.cache["gm4_manifest"]["modules"].get(module_id, {}).get("hash")
+        ))
+    for cached in restored.values():
+        if cached.pack_hash is not None and cached.packets: # version the restored module as update_patch would have
+            _, _, params = cached.packets[0]
+            record_patch(manifest, params["project_id"], params["project_version"], cached.pack_hash)
+
+    # hand the finished packs to the bridge in broadcast order, with this process's unpicklable context params
+    built = {snapshot.directory: snapshot.packets for snapshot in snapshots}
+    with ctx.worker(bridge) as channel:
+        for directory in directories:
+            packets = restored[str(directory)].packets if str(directory) in restored else built[str(directory)]
+            for rp, dp, params in packets:
+                channel.send((rp, dp, params | {k: getattr(ctx, k) for k in UNPICKLABLE_CONTEXT_PARAMS}))
+
+    # replay summary records from the workers to this process's handlers
+    for snapshot in snapshots:
+        for record in snapshot.records:
+            replay_record(record)
+        if snapshot.profile and profiler.active:
+            profiler.active.merge(snapshot.profile)
+
+
+def build_subproject(job: SubprojectJob) -> SubprojectSnapshot:
+    """Worker process entrypoint. Builds the subproject with an isolated cache and collects the stored packs"""
+    os.chdir(job.root_directory)
+    if job.root_directory not in sys.path:
+        sys.path.insert(0, job.root_directory) # module plugins such as gm4_guidebook are imported from the project root
+    root_logger = logging.getLogger()
+    root_logger.handlers.clear()
+    root_logger.addHandler(annotation_handler())
+    root_logger.setLevel(job.log_level)
+
+    snapshot = SubprojectSnapshot(directory=job.directory)
+    capture = RecordCapture()
+    for name in SUMMARY_LOGGERS:
+        logging.getLogger(name).addHandler(capture)
+    if job.profile:
+        profiler.Profiler(Path(job.directory).name).install()
+
+    try: # pool processes are reused by later jobs, which must not inherit this job's capture or profiler
+        with TemporaryDirectory() as tmpdir:
+            cache = ProjectCache(directory=Path(tmpdir) / ".beet_cache", generated_directory=Path(job.root_directory) / "generated")
+            for name, directory in job.read_only_caches.items():
+                cache[name] = ReadOnlyCache(directory, cache.transaction)
+            for key, value in job.shared_cache.items():
+                cache[key].json = value
+
+            meta = dict(job.config.get("meta", {}))
+            meta["autosave"] = {"link": False}
+            meta["parallel_worker"] = True
+            config = ProjectConfig.parse_obj(job.config | {"directory": job.directory, "meta": meta}).resolve(job.root_directory)
+
+            with ProjectBuilder(Project(resolved_config=config, resolved_cache=cache)).build() as ctx:
+                with ctx.worker(bridge) as channel:
+                    channel.send(RETRIEVE_ALL_PROJECTS)
+                for stored_project in channel:
+                    for rp, dp, params in stored_project:
+                        snapshot.packets.append((rp, dp, picklable_params(params)))
+                ctx.inject(BuildManifest).flush()
+                snapshot.modeldata = dict(ctx.inject(ModelDataReads).indices)
+
+            snapshot.cache = {key: cache[key].json for key in SHARED_CACHE_KEYS} | {"skin_cache": cache["skin_cache"].json}
+            load_private_files(snapshot.packets, Path(tmpdir))
+    finally:
+        for name in SUMMARY_LOGGERS:
+            logging.getLogger(name).removeHandler(capture)
+        if profiler.active:
+            snapshot.profile = profiler.active.uninstall()
+
+    snapshot.records = capture.buffer
+    return snapshot
+
+
+def available_cores() -> int:
+    """Number of cores this process may run on, respecting CI runner affinity limits"""
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+class ReadOnlyCache(Cache):
+    """A cache of the parent build, read in place by a worker. Its index is never written, so concurrent workers never write the same file"""
+    def flush(self):
+        pass
+
+
+def load_private_files(packets: list[ProjectPacket], directory: Path):
+    """Reads the pack files still backed by the worker's private cache into memory, as that cache is removed before the packs are sent back"""
+    for rp, dp, _ in packets:
+        for pack in (rp, dp):
+            for _, file in pack.list_files():
+                if file.source_path and Path(file.source_path).is_relative_to(directory):
+                    file.ensure_serialized()
+
+
+def merge_cache(ctx: Context, initial: dict[str, Any], skin_cache: dict[str, Any], snapshots: list[SubprojectSnapshot]):
+    """Merges the cache changes made by each worker back into the parent build. The registry is merged by `merge_registry` beforehand"""
+    # manifest entries are only modified for the module being built, so any changed entry can be taken as is
+    manifest = ctx.cache["gm4_manifest"].json
+    for snapshot in snapshots:
+        worker_manifest = snapshot.cache["gm4_manifest"]
+        for section in ("modules", "libraries"):
+            for pack_id, entry in worker_manifest[section].items():
+                if entry != initial["gm4_manifest"][section].get(pack_id):
+                    manifest[section][pack_id] = entry
+
+    # pixel hashes of the skin files each worker decoded
+    skin_digests = ctx.cache["skin_digests"].json.setdefault("entries", {})
+    for snapshot in snapshots:
+        skin_digests.update(snapshot.cache["skin_digests"].get("entries", {}))
+
+    # dominant colors of the textures each worker quantized for guidebooks
+    texture_colors = ctx.cache["texture_colors"].json.setdefault("colors", {})
+    for snapshot in snapshots:
+        texture_colors.update(snapshot.cache["texture_colors"].get("colors", {}))
+
+    # skin cache entries and nonnative references belonging to each worker's module
+    updated_skins = False
+    for snapshot in snapshots:
+        worker_skins = snapshot.cache["skin_cache"]
+        if not worker_skins:
+            continue # the module does not use player heads
+        for skin_name, entry in worker_skins["skins"].items():
+            if skin_cache["skins"].get(skin_name) != entry:
+                skin_cache["skins"][skin_name] = entry
+                updated_skins = True
+        module_id = Path(snapshot.directory).name
+        references = worker_skins["nonnative_references"].get(module_id)
+        if references != skin_cache["nonnative_references"].get(module_id):
+            if references:
+                skin_cache["nonnative_references"][module_id] = references
+            else:
+                del skin_cache["nonnative_references"][module_id]
+            updated_skins = True
+    if updated_skins:
+        JsonFile(skin_cache).dump(origin="", path="gm4/skin_cache.json")
+
+
+def merge_registry(registry: dict[str, Any], initial: dict[str, Any], worker: dict[str, Any]) -> list[str]:
+    """Applies the custom_model_data a worker issued and removed, compared to the registry it started from.
+        Returns the values conflicting with those merged from other workers, in which case nothing is applied"""
+    items: dict[str, dict[str, int]] = registry.setdefault("items", {})
+    initial_items: dict[str, dict[str, int]] = initial.get("items", {})
+    worker_items: dict[str, dict[str, int]] = worker.get("items", {})
+    removed = {(item_id, reference) for item_id, reg in initial_items.items() for reference in reg if reference not in worker_items.get(item_id, {})}
+    issued = [(item_id, reference, index) for item_id, reg in worker_items.items() for reference, index in reg.items() if initial_items.get(item_id, {}).get(reference) != index]
+
+    conflicts: list[str] = []
+    for item_id, reference, index in issued:
+        reg = items.get(item_id, {})
+        before = initial_items.get(item_id, {}).get(reference)
+        if reg.get(reference, before) not in (before, index):
+            conflicts.append(f"'{reference}' on {item_id}") # issued a different value by another worker
+        elif any(i == index and r != reference and (item_id, r) not in removed for r, i in reg.items()):
+            conflicts.append(f"{index} on {item_id}")
+    if conflicts:
+        return conflicts
+
+    for item_id, reference in removed:
+        if items.get(item_id, {}).get(reference) == initial_items[item_id][reference]:
+            del items[item_id][reference]
+    for item_id, reference, index in issued:
+        items.setdefault(item_id, {})[reference] = index
+    return []
+
+
+def replay_record(record: logging.LogRecord):
+    """Passes a record captured in a worker process to the handlers of its logger and parents, except the root handler"""
+    logger: Optional[logging.Logger] = logging.getLogger(record.name)
+    while logger and logger is not logging.getLogger():
+        for handler in logger.handlers:
+            if record.levelno >= handler.level:
+                handler.handle(record)
+        logger = logger.parent if logger.propagate else None # type: ignore ; PlaceHolder parents are skipped by getLogger
+
+
+class RecordCapture(logging.Handler):
+    """Collects log records in a picklable form, so they can be sent back from a worker process"""
+    def __init__(self):
+        super().__init__()
+        self.buffer: list[logging.LogRecord] = []
+
+    def emit(self, record: logging.LogRecord):
+        record.msg = record.getMessage()
+        record.args = None
+        record.exc_info = None
+        self.buffer.append(record)
@@ -1,3 +1,4 @@
+import asyncio
 import base64
 import hashlib
 import json
@@ -5,13 +6,13 @@ import logging
 import os
 import sys
 import time
-from dataclasses import replace
+from dataclasses import dataclass, replace
 from io import BytesIO
-from typing import Any, Callable, ClassVar
+from typing import Any, Callable, ClassVar, Optional
 
 import requests
 from beet import Context, FileDeserialize, JsonFile, PngFile, NamespaceFileScope
-from mecha import Diagnostic, Mecha, MutatingReducer, rule
+from mecha import AstRoot, Diagnostic, DiagnosticCollection, Mecha, MutatingReducer, rule
 from mecha.ast import (
     AstJsonObject,
     AstJsonObjectEntry,
@@ -23,18 +24,24 @@ from mecha.ast import (
 )
 from nbtlib import String # type: ignore
 from PIL.Image import Image
+from requests.adapters import HTTPAdapter
 
 from gm4.utils import InvokeOnJsonNbt
 
 parent_logger = logging.getLogger("gm4.player_heads")
 
 USER_AGENT = "Gamemode4Dev/GM4_Datapacks/player_head_management (gamemode4official@gmail.com)"
+MINESKIN_API = os.getenv("MINESKIN_API", "https://api.mineskin.org") # point at `python -m gm4.mineskin_stub` to test uploads locally
+MINESKIN_CONCURRENCY = 4 # uploads in flight at once
+MINESKIN_ATTEMPTS = 5 # requests per skin while mineskin answers with 429 ratelimits
 MISSING_TEXTURE_SKIN = "eyJ0ZXh0dXJlcyIgOiB7ICJTS0lOIiA6IHsgInVybCIgOiAiaHR0cDovL3RleHR1cmVzLm1pbmVjcmFmdC5uZXQvdGV4dHVyZS9kYWUyOTA0YTI4NmI5NTNmYWI4ZWNlNTFkNjJiZmNjYjMyY2IwMjc0OGY0NjdjMDBiYzMxODg1NTk4MDUwNThiIn19fQ=="
 
 def beet_default(ctx: Context):
     ctx.data.extend_namespace.append(Skin) # register new filetype to datapack
     tf = ctx.inject(SkinNbtTransformer)
-    ctx.inject(Mecha).transform.extend(tf) # register new ruleset to mecha
+    mc = ctx.inject(Mecha)
+    mc.transform.extend(tf) # register new ruleset to mecha
+    mc.steps.insert(mc.steps.index(mc.transform)+1, ctx.inject(SkinUploadStep)) # upload changed skins once all files are transformed
     ctx.require("mecha.contrib.json_files")
 
     yield
@@ -56,6 +63,8 @@ class SkinNbtTransformer(MutatingReducer, InvokeOnJsonNbt):
         self.ctx: Context = ctx
         self.skin_cache = JsonFile(source_path="gm4/skin_cache.json").data
         self.used_textures: list[str] = []
+        self.uploads: dict[str, SkinUpload] = {} # changed skins, uploaded together by SkinUploadStep
+        self.deferred_files: set[Any] = set() # files referencing skins that are waiting for their upload
         super().__init__()
 
     @rule(AstJsonObjectEntry, key=AstJsonObjectKey(value='minecraft:profile'))
@@ -65,6 +74,8 @@ class SkinNbtTransformer(MutatingReducer, InvokeOnJsonNbt):
             skin_val, uuid, d = self.retrieve_texture(reference, **kwargs)
             if d:
                 yield d
+            if skin_val is None:
+                return node # substituted by SkinUploadStep, once the skin is uploaded
             node = replace(node, value=AstJsonObject.from_value({
                 "id": uuid,
                 "properties": [
@@ -82,6 +93,8 @@ class SkinNbtTransformer(MutatingReducer, InvokeOnJsonNbt):
             skin_val, uuid, d = self.retrieve_texture(node.value.value, **kwargs)
             if d:
                 yield d
+            if skin_val is None:
+                return node # substituted by SkinUploadStep, once the skin is uploaded
             node = replace(node, value=AstNbtCompound.from_value({
                 "id": uuid,
                 "properties": [
@@ -94,7 +107,7 @@ class SkinNbtTransformer(MutatingReducer, InvokeOnJsonNbt):
         return node
 
 
-    def retrieve_texture(self, skin_name: str, **kwargs: Any) -> tuple[str, list[int], Diagnostic|None]:
+    def retrieve_texture(self, skin_name: str, **kwargs: Any) -> tuple[str|None, list[int], Diagnostic|None]:
         skin_name = skin_name.lstrip("$")
         if ":" not in skin_name:
             skin_name = f"{self.ctx.project_id}:{skin_name}"
@@ -111,62 +124,39 @@ class SkinNbtTransformer(MutatingReducer, InvokeOnJsonNbt):
                                 )
                 return MISSING_TEXTURE_SKIN, [0,0,0,0], d
             else:
-                skin_hash = hashlib.sha1(skin_file.image.tobytes()).hexdigest() #type: ignore
+                skin_hash = self.ctx.inject(SkinDigestIndex).digest(skin_file)
 
                 if skin_hash != cached_data["hash"]:
-                    # the image file contents have changed - upload the new image
-                    value, uuid = self.mineskin_upload(skin_file, f"{skin_name.split(':')[-1]}.png")
-                    if value is None or uuid is None:
+                    # the image file contents have changed - upload the new image after the transform pass
+                    upload = self.uploads.setdefault(skin_name, SkinUpload(skin_name, skin_file, skin_hash))
+                    if upload.failed:
                         return MISSING_TEXTURE_SKIN, [0,0,0,0], None # skin upload failed, don't cache the result and return missing texture
-                    self.skin_cache["skins"][skin_name] = {
-                        "uuid": uuid,
-                        "value": value,
-                        "hash": skin_hash,
-                        "parent_module": self.ctx.project_id
-                    }
-                    return value, uuid, None
+                    self.deferred_files.add(self.ctx.inject(Mecha).database.current)
+                    self.nbt_transform_deferred = True
+                    return None, [0,0,0,0], None
         return cached_data["value"], cached_data["uuid"], None
 
-    def mineskin_upload(self, skin: Skin, filename: str) -> tuple[str|None, list[int]|None]:
+    def upload_pending(self):
+        """Uploads all skins changed since the last call together, storing the results in the skin cache"""
+        pending = [u for u in self.uploads.values() if not u.done]
+        if not pending:
+            return
         logger = parent_logger.getChild(f"mineskin_upload.{self.ctx.project_id}")
         if os.getenv("GITHUB_ACTIONS"):
-            logger.error(f"Failed to upload {filename}. Github Actions cannot upload skins via the mineskin api")
+            logger.error(f"Failed to upload {', '.join(u.filename for u in pending)}. Github Actions cannot upload skins via the mineskin api")
             sys.exit(1) # quit the build and mark the github action as failed
 
-        token = self.ctx.inject(MineskinAuthManager).token
-
-        buf = BytesIO()
-        skin.image.save(buf, format="PNG") # type: ignore
-        res = requests.post(   
-            url='https://api.mineskin.org/generate/upload',
-            data={"name":"GM4_Skin", "visibility":0},
-            files={"file":(filename, buf.getvalue(), 'text/x-spam')},
-            headers={"User-Agent": USER_AGENT, "Authorization": "Bearer "+token}
-        )
-        if res.status_code == 429:
-            logger.info(f"Mineskin request ratelimited! Waiting and trying again")
-            next_request_time = res.json()["nextRequest"]
-            wait_time = max(next_request_time - time.time(), 0)
-            time.sleep(wait_time)
-            return self.mineskin_upload(skin, filename)
-        elif res.status_code != 200:
-            logger.error(f"Mineskin upload failed: {res.status_code} {res.text}")
-            return None, None
-        logger.info(f"New skin texture \'{filename}\' successfully uploaded via Mineskin")
-        
-        # strip out unnecessary fields encoded within texture value
-        value = res.json()["data"]["texture"]["value"]
-        decoded_value = json.loads(base64.b64decode(value).decode('utf-8'))
-        trimmed_decoded_value = {"textures": {"SKIN": {"url": decoded_value["textures"]["SKIN"]["url"]}}}
-        trimmed_value = str(base64.b64encode(str(trimmed_decoded_value).encode('utf-8')), 'utf-8')
-
-        # split hex uuid into 4 ints
-        uuid = res.json()["uuid"]
-        i = range(0,33,8)
-        segmented_uuid = [uuid[a:b] for a,b in zip(i, i[1:])]
-        signed_int: Callable[[str], int] = lambda s: int.from_bytes(bytes.fromhex(s), byteorder="big", signed=True)
-        uuid_arr = list(map(signed_int, segmented_uuid))
-        return trimmed_value, uuid_arr
+        MineskinScheduler(self.ctx.inject(MineskinAuthManager).token, logger).upload_all(pending)
+        for upload in pending:
+            if upload.result is None:
+                continue
+            value, uuid = upload.result
+            self.skin_cache["skins"][upload.skin_name] = {
+                "uuid": uuid,
+                "value": value,
+                "hash": upload.skin_hash,
+                "parent_module": self.ctx.project_id
+            }
     
     def log_unused_textures(self):
         logger = parent_logger.getChild(self.ctx.project_id)
@@ -182,8 +172,134 @@ class SkinNbtTransformer(MutatingReducer, InvokeOnJsonNbt):
             self.skin_cache["nonnative_references"].pop(self.ctx.project_id, None)
 
     def output_skin_cache(self):
+        if self.ctx.meta.get("parallel_worker"):
+            # concurrent builds would overwrite each other's changes; pass the cache back to the parent process instead
+            self.ctx.cache["skin_cache"].json = self.skin_cache
+            return
         JsonFile(self.skin_cache).dump(origin="", path="gm4/skin_cache.json")
 
+class SkinDigestIndex:
+    """Pixel hashes of skin files, as stored in skin_cache.json. Kept in the beet cache under the file's path, size and mtime, so unchanged skins are never decoded"""
+    def __init__(self, ctx: Context):
+        self.entries: dict[str, list[Any]] = ctx.cache["skin_digests"].json.setdefault("entries", {}) # path -> [size, mtime_ns, hash]
+
+    def digest(self, skin: Skin) -> str:
+        if not skin.source_path or skin.source_start is not None:
+            return hashlib.sha1(skin.image.tobytes()).hexdigest() # type: ignore ; generated or modified in memory
+        path = os.fspath(skin.source_path)
+        stat = os.stat(path)
+        if (entry := self.entries.get(path)) and entry[:2] == [stat.st_size, stat.st_mtime_ns]:
+            return entry[2]
+        skin_hash = hashlib.sha1(skin.image.tobytes()).hexdigest() # type: ignore
+        self.entries[path] = [stat.st_size, stat.st_mtime_ns, skin_hash]
+        return skin_hash
+
+
+class SkinUploadStep(MutatingReducer):
+    """Mecha compilation step after transform. Uploads the skins collected by SkinNbtTransformer in one batch, then substitutes them into the files that reference them.
+        Mecha runs each step on all queued files before the next, so the first call happens once every file is transformed"""
+    def __init__(self, ctx: Context):
+        self.ctx = ctx
+        self.tf = ctx.inject(SkinNbtTransformer)
+        super().__init__()
+
+    def __call__(self, node: AstRoot, **kwargs: Any) -> AstRoot:
+        self.tf.upload_pending() # also uploads skins of files generated after the first batch
+        current = self.ctx.inject(Mecha).database.current
+        if current not in self.tf.deferred_files:
+            return node
+        self.tf.deferred_files.discard(current)
+        # run the rules again, now resolving from the updated skin cache. The transform pass already reported
+        # this file's diagnostics and used textures, so only the substitutions of this second run are kept
+        used_textures = len(self.tf.used_textures)
+        with self.tf.use_diagnostics(DiagnosticCollection()):
+            node = self.tf(node, **kwargs)
+        del self.tf.used_textures[used_textures:]
+        return node
+
+
+@dataclass
+class SkinUpload:
+    skin_name: str
+    skin: Skin
+    skin_hash: str
+    result: Optional[tuple[str, list[int]]] = None # texture value and uuid
+    done: bool = False
+
+    @property
+    def failed(self) -> bool:
+        return self.done and self.result is None
+
+    @property
+    def filename(self) -> str:
+        return f"{self.skin_name.split(':')[-1]}.png"
+
+
+class MineskinScheduler:
+    """Uploads skins to Mineskin concurrently over one pooled session, waiting for the api's `nextRequest` time between requests"""
+    def __init__(self, token: str, logger: logging.Logger, concurrency: int = MINESKIN_CONCURRENCY, api: str = MINESKIN_API):
+        self.token = token
+        self.logger = logger
+        self.concurrency = concurrency
+        self.api = api
+        self.next_request = 0.0 # unix time before which mineskin will reject requests
+
+    def upload_all(self, uploads: list[SkinUpload]):
+        asyncio.run(self.run(uploads))
+
+    async def run(self, uploads: list[SkinUpload]):
+        semaphore = asyncio.Semaphore(self.concurrency)
+        with requests.Session() as session:
+            session.headers.update({"User-Agent": USER_AGENT, "Authorization": "Bearer "+self.token})
+            session.mount(self.api, HTTPAdapter(pool_connections=1, pool_maxsize=self.concurrency))
+            await asyncio.gather(*(self.upload(session, semaphore, u) for u in uploads))
+
+    async def upload(self, session: requests.Session, semaphore: asyncio.Semaphore, upload: SkinUpload):
+        buf = BytesIO()
+        upload.skin.image.save(buf, format="PNG") # type: ignore
+        attempts = 0
+        while True:
+            attempts += 1
+            async with semaphore:
+                while (wait_time := self.next_request - time.time()) > 0:
+                    await asyncio.sleep(wait_time)
+                res = await asyncio.to_thread(session.post,
+                    url=f"{self.api}/generate/upload",
+                    data={"name":"GM4_Skin", "visibility":0},
+                    files={"file":(upload.filename, buf.getvalue(), 'text/x-spam')}
+                )
+                body: dict[str, Any] = res.json() if res.headers.get("Content-Type", "").startswith("application/json") else {}
+                if res.status_code == 429 and "nextRequest" not in body:
+                    body["nextRequest"] = time.time() + 1
+                self.next_request = max(self.next_request, body.get("nextRequest", 0))
+
+            if res.status_code != 429 or attempts == MINESKIN_ATTEMPTS:
+                break
+            self.logger.info(f"Mineskin request ratelimited! Waiting and trying again")
+        upload.done = True
+        if res.status_code != 200:
+            self.logger.error(f"Mineskin upload failed: {res.status_code} {res.text}")
+            return
+        self.logger.info(f"New skin texture \'{upload.filename}\' successfully uploaded via Mineskin")
+        upload.result = parse_mineskin_response(body)
+
+
+def parse_mineskin_response(body: dict[str, Any]) -> tuple[str, list[int]]:
+    # strip out unnecessary fields encoded within texture value
+    value = body["data"]["texture"]["value"]
+    decoded_value = json.loads(base64.b64decode(value).decode('utf-8'))
+    trimmed_decoded_value = {"textures": {"SKIN": {"url": decoded_value["textures"]["SKIN"]["url"]}}}
+    trimmed_value = str(base64.b64encode(str(trimmed_decoded_value).encode('utf-8')), 'utf-8')
+
+    # split hex uuid into 4 ints
+    uuid = body["uuid"]
+    i = range(0,33,8)
+    segmented_uuid = [uuid[a:b] for a,b in zip(i, i[1:])]
+    signed_int: Callable[[str], int] = lambda s: int.from_bytes(bytes.fromhex(s), byteorder="big", signed=True)
+    uuid_arr = list(map(signed_int, segmented_uuid))
+    return trimmed_value, uuid_arr
+
+
 class MineskinAuthManager():
     """A process for managing mineskin access credentials, prompting the user if needed"""
     def __init__(self, ctx: Context):
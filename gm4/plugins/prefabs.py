@@ -1,11 +1,16 @@
-from beet import Context, PluginOptions, configurable
+from beet import Context, PluginOptions, Structure, configurable
 from beet.contrib.find_replace import find_replace
 from beet.contrib.rename_files import rename_files
+from gzip import GzipFile
+from io import BytesIO
 from pydantic.v1 import Extra
-import nbtlib # type: ignore ; no stub file
+from nbtlib import String # type: ignore ; no stub file
 import re
+from typing import Any
 from gm4.plugins.manifest import repro_structure_to_bytes
 
+STREAM_CHUNK_SIZE = 1 << 16
+
 
 class PrefabConfig(PluginOptions, extra=Extra.ignore):
     prefabs: list[str]
@@ -38,9 +43,42 @@ def structure_deep_rename(ctx: Context, find_namespace: str, repl_namespace: str
         "replace": f"{repl_namespace}:\\1"
     }))
 
-    # rename structure-file references
-    for s in ctx.data.structures:
-        blocks = ctx.data.structures[s].data["blocks"].snbt() # type: ignore ; nbtlib typing missing
-        updated_blocks_data = re.sub(f"{find_namespace}:([a-z0-9_/]+)", f"{repl_namespace}:\\1", blocks) # type: ignore ; nbtlib typing missing
-        ctx.data.structures[s].serializer = repro_structure_to_bytes
-        ctx.data.structures[s].data["blocks"] = nbtlib.parse_nbt(updated_blocks_data) # type: ignore ; nbtlib typing missing
+    # rename structure-file references, only parsing the structures that mention the namespace
+    pattern = re.compile(f"{find_namespace}:([a-z0-9_/]+)")
+    needle = f"{find_namespace}:".encode()
+    for structure in ctx.data.structures.values():
+        if not structure_mentions(structure, needle):
+            continue # left untouched, keeping its original bytes
+        rename_nbt_strings(structure.data["blocks"], pattern, f"{repl_namespace}:\\1")
+        structure.serializer = repro_structure_to_bytes
+
+def structure_mentions(structure: Structure, needle: bytes) -> bool:
+    """Whether the uncompressed nbt of the structure contains the bytes, checked by streaming the gzip without parsing it"""
+    if not isinstance(content := structure.get_content(), bytes):
+        return True # already parsed
+    try:
+        with GzipFile(fileobj=BytesIO(content)) as fileobj:
+            tail = b""
+            while chunk := fileobj.read(STREAM_CHUNK_SIZE):
+                if needle in tail + chunk[:len(needle)-1] or needle in chunk:
+                    return True
+                tail = chunk[-(len(needle)-1):]
+    except (OSError, EOFError):
+        return True # not a gzipped structure, left for the nbt parser to handle
+    return False
+
+def rename_nbt_strings(root: Any, pattern: re.Pattern[str], repl: str):
+    """Substitutes the pattern in every string tag and compound key of the nbt tree, in place"""
+    stack = [root]
+    while stack:
+        tag = stack.pop()
+        if isinstance(tag, dict) and any(pattern.search(key) for key in tag):
+            entries = [(pattern.sub(repl, key), value) for key, value in tag.items()] # keeps the key order
+            tag.clear()
+            tag.update(entries)
+        for key, value in (tag.items() if isinstance(tag, dict) else enumerate(tag)):
+            if isinstance(value, str):
+                if (renamed := pattern.sub(repl, value)) != value:
+                    tag[key] = String(renamed)
+            elif isinstance(value, (dict, list)):
+                stack.append(value)
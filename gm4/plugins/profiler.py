@@ -0,0 +1,218 @@
+import json
+import logging
+import sys
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from time import perf_counter_ns
+from typing import Any, Iterator, Optional
+
+from beet import Context, PluginOptions, configurable
+from beet.toolchain.pipeline import Task
+from mecha import Mecha
+from pydantic.v1 import Extra
+
+try:
+    import resource
+except ImportError: # unix only, memory is not sampled on windows
+    resource = None
+
+parent_logger = logging.getLogger("gm4.profiler")
+
+SPEEDSCOPE_SCHEMA = "https://www.speedscope.app/file-format-schema.json"
+RSS_UNIT = 1 if sys.platform == "darwin" else 1024 # ru_maxrss is in bytes on macOS, kilobytes elsewhere
+
+class ProfilerOptions(PluginOptions, extra=Extra.ignore):
+    report: str = "out/profile.json"
+    flamegraph: Optional[str] # speedscope file, opened with https://www.speedscope.app
+
+@dataclass
+class PluginSample:
+    """Accumulated timings of one phase of a plugin, in one module"""
+    module: str
+    plugin: str
+    phase: str # "setup", or "exit" for the code after a generator plugin's yield
+    calls: int = 0
+    wall_ms: float = 0 # including nested plugins, such as the subprojects run by a broadcast
+    self_ms: float = 0
+    process_peak_rss: int = 0 # bytes, the peak of the whole process so far when the phase ended, not the memory used by the phase itself
+
+@dataclass
+class ProcessProfile:
+    """Picklable samples and flamegraph events of one process, so worker processes can send back their profiles"""
+    name: str
+    samples: dict[tuple[str, str, str], PluginSample] = field(default_factory=dict)
+    mecha: dict[tuple[str, str], list[float]] = field(default_factory=dict) # (module, step) -> [files, ms]
+    events: list[tuple[str, str, float]] = field(default_factory=list) # ("O" or "C", frame name, ms since start)
+    duration_ms: float = 0
+
+
+active: Optional['Profiler'] = None # the profiler timing the plugins of this process
+
+class Profiler:
+    """Times every plugin task of every context in this process, by wrapping beet's Task.advance"""
+    def __init__(self, name: str):
+        self.profile = ProcessProfile(name)
+        self.start = perf_counter_ns()
+        self.stack: list[tuple[str, list[float]]] = [] # module and ms spent in nested plugins of each open frame
+        self.mecha_reports: list[tuple[str, Mecha]] = []
+        self.workers: list[ProcessProfile] = []
+
+    def install(self):
+        global active
+        active = self
+        Task.advance = profiled_advance # type: ignore
+        Mecha.compile = profiled_compile # type: ignore
+
+    def uninstall(self) -> ProcessProfile:
+        global active
+        active = None
+        Task.advance = original_advance # type: ignore
+        Mecha.compile = original_compile # type: ignore
+        self.profile.duration_ms = self.elapsed()
+        for module, mc in self.mecha_reports:
+            self.collect_mecha(module, mc)
+        self.mecha_reports.clear()
+        return self.profile
+
+    def elapsed(self) -> float:
+        return (perf_counter_ns() - self.start) / 1e6
+
+    @contextmanager
+    def measure(self, ctx: Any, plugin: Any, phase: str) -> Iterator[None]:
+        module = getattr(ctx, "project_id", "") or "<root>"
+        name = f"{getattr(plugin, '__module__', '')}.{getattr(plugin, '__qualname__', type(plugin).__qualname__)}".lstrip(".")
+        frame = f"{module} {name}" if phase == "setup" else f"{module} {name} ({phase})"
+
+        start = self.elapsed()
+        self.profile.events.append(("O", frame, start))
+        self.stack.append((module, [0]))
+        try:
+            yield
+        finally:
+            end = self.elapsed()
+            self.profile.events.append(("C", frame, end))
+            nested = self.stack.pop()[1][0]
+            if self.stack:
+                self.stack[-1][1][0] += end - start
+
+            sample = self.profile.samples.setdefault((module, name, phase), PluginSample(module, name, phase))
+            sample.calls += 1
+            sample.wall_ms += end - start
+            sample.self_ms += end - start - nested
+            sample.process_peak_rss = max(sample.process_peak_rss, process_peak_rss())
+
+    def track_mecha(self, mc: Mecha):
+        """Enables mecha's per-file step timings, which are collected when profiling ends"""
+        if mc.perf_report is None:
+            mc.perf_report = []
+            self.mecha_reports.append((self.stack[-1][0] if self.stack else "<root>", mc))
+
+    def collect_mecha(self, module: str, mc: Mecha):
+        names = ["parse"] + [step_name(mc, step) for step in mc.steps] + ["serialize"]
+        for _, _, _, perf in mc.perf_report or []:
+            for name, ms in zip(names, perf):
+                if ms == ms: # nan for steps the file did not reach
+                    totals = self.profile.mecha.setdefault((module, name), [0, 0])
+                    totals[0] += 1
+                    totals[1] += ms
+
+    def merge(self, profile: ProcessProfile):
+        """Adds the samples of a worker process"""
+        for key, sample in profile.samples.items():
+            if (existing := self.profile.samples.get(key)) is None:
+                self.profile.samples[key] = sample
+                continue
+            existing.calls += sample.calls
+            existing.wall_ms += sample.wall_ms
+            existing.self_ms += sample.self_ms
+            existing.process_peak_rss = max(existing.process_peak_rss, sample.process_peak_rss)
+        for key, (files, ms) in profile.mecha.items():
+            totals = self.profile.mecha.setdefault(key, [0, 0])
+            totals[0] += files
+            totals[1] += ms
+        self.workers.append(profile)
+
+
+def process_peak_rss() -> int:
+    """Peak resident memory of this process in bytes, or 0 where it cannot be sampled"""
+    if resource is None:
+        return 0
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * RSS_UNIT
+
+
+original_advance = Task.advance
+
+def profiled_advance(self: Task[Any], ctx: Any, exception: Optional[Exception] = None) -> Optional[Task[Any]]:
+    if active is None:
+        return original_advance(self, ctx, exception)
+    with active.measure(ctx, self.plugin, "setup" if self.iterator is None else "exit"):
+        return original_advance(self, ctx, exception)
+
+
+original_compile = Mecha.compile
+
+def profiled_compile(self: Mecha, *args: Any, **kwargs: Any) -> Any:
+    if active is not None:
+        active.track_mecha(self)
+    return original_compile(self, *args, **kwargs)
+
+
+def step_name(mc: Mecha, step: Any) -> str:
+    for name in ("lint", "transform", "optimize", "check"):
+        if step is getattr(mc, name):
+            return name
+    return getattr(step, "__qualname__", type(step).__name__) # eg. bolt's runtime evaluation
+
+
+@configurable("profiler", validator=ProfilerOptions)
+def beet_default(ctx: Context, opts: ProfilerOptions):
+    """Profiles the setup and exit phases of every plugin in the build, including subprojects and worker processes.
+        Should be first in pipeline, so its exit phase runs after all others"""
+    logger = parent_logger
+    profiler = Profiler("main")
+    profiler.install()
+    try:
+        yield
+    finally:
+        profile = profiler.uninstall()
+
+    samples = sorted(profile.samples.values(), key=lambda s: s.self_ms, reverse=True)
+    report = {
+        "total_ms": profile.duration_ms,
+        "process_peak_rss": max([s.process_peak_rss for s in samples], default=0), # highest peak of any single process, main or worker
+        "plugins": [asdict(s) for s in samples],
+        "mecha": [{"module": module, "step": step, "files": files, "ms": ms} for (module, step), (files, ms) in sorted(profile.mecha.items(), key=lambda e: e[1][1], reverse=True)],
+        "workers": [{"name": p.name, "total_ms": p.duration_ms} for p in profiler.workers],
+    }
+    report_path = ctx.directory / opts.report
+    report_path.parent.mkdir(parents=True, exist_ok=True)
+    report_path.write_text(json.dumps(report, indent=2))
+    logger.info(f"Wrote profile of {len(samples)} plugin phases to {opts.report}")
+    for sample in samples[:10]:
+        logger.info(f"{sample.self_ms:9.1f} ms  {sample.module} {sample.plugin} ({sample.phase})")
+
+    if opts.flamegraph:
+        flamegraph_path = ctx.directory / opts.flamegraph
+        flamegraph_path.parent.mkdir(parents=True, exist_ok=True)
+        flamegraph_path.write_text(json.dumps(speedscope([profile, *profiler.workers])))
+        logger.info(f"Wrote flamegraph to {opts.flamegraph}")
+
+
+def speedscope(profiles: list[ProcessProfile]) -> dict[str, Any]:
+    """Converts the open and close events of each process into a speedscope evented profile"""
+    frames: dict[str, int] = {}
+    evented = [{
+        "type": "evented",
+        "name": p.name,
+        "unit": "milliseconds",
+        "startValue": 0,
+        "endValue": p.duration_ms,
+        "events": [{"type": kind, "frame": frames.setdefault(name, len(frames)), "at": at} for kind, name, at in p.events],
+    } for p in profiles]
+    return {
+        "$schema": SPEEDSCOPE_SCHEMA,
+        "name": "gm4 build",
+        "exporter": "gm4.plugins.profiler",
+        "profiles": evented,
+        "shared": {"frames": [{"name": name} for name in frames]},
+    }
@@ -1,14 +1,18 @@
 import csv
 import glob
+import hashlib
+import heapq
 import logging
 import os
 import sys
+from collections import OrderedDict
+from contextlib import contextmanager
 from copy import deepcopy
 from dataclasses import replace
-from functools import cache
 from fnmatch import fnmatch
-from itertools import cycle
-from typing import Any, ClassVar, Literal, Optional, Union
+from itertools import cycle, pairwise
+from pathlib import Path
+from typing import Any, ClassVar, Iterator, Literal, Optional, Union
 
 import numpy as np
 from beet import (
@@ -27,7 +31,6 @@ from beet import (
     ResourcePack
 )
 from beet.contrib.link import LinkManager
-from beet.contrib.vanilla import Vanilla, ClientJar
 from beet.core.utils import format_validation_error
 from mecha import (
     AstChildren,
@@ -64,6 +67,8 @@ from gm4.utils import (
     add_namespace,
     propagate_location,
 )
+from gm4.plugins.build_cache import ModelDataReads, link_pack
+from gm4.plugins.vanilla_index import VanillaIndex
 
 JsonType = dict[str,Any]
 
@@ -71,6 +76,18 @@ CUSTOM_MODEL_PREFIX = 3420000
 
 parent_logger = logging.getLogger("gm4.resource_pack")
 
+BASE_LANG = "base/assets/gm4/lang/en_us.json"
+GUIDEBOOK_TRANSLATIONS = "gm4_guidebook/assets/translations.csv"
+LEGACY_TRANSLATION_KEYS = {"%1$s%3427655$s", "%1$s%3427656$s"} # manual old keys
+
+# translation keys shared by all modules, by the inputs they were read from. Kept for every subproject built in this process
+_translation_indexes: dict[tuple[Any, ...], frozenset[str]] = {}
+
+# json parsed from nbt strings by their text, None if not json. Text components repeat across modules, so this is shared by every subproject,
+# keeping the most recently used strings only
+NBT_JSON_CACHE_SIZE = 4096
+_nbt_json_asts: OrderedDict[str, Optional[AstJson]] = OrderedDict()
+
 #== Pydantic Plugin Config Models ==#
 class ModelData(BaseModel):
     """A complete config for a single model"""
@@ -328,10 +345,8 @@ def beet_default(ctx: Context):
     logging.getLogger("beet.contrib.babelbox").addFilter(block_incomplete_translation)
     logging.getLogger("mecha").addFilter(limit_mecha_diagnostics)
 
-    # attach context to template classes
-    VanillaTemplate.vanilla = Vanilla(ctx)
-    VanillaTemplate.vanilla.minecraft_version = '1.21.5'
-    VanillaTemplate.vanilla_jar = VanillaTemplate.vanilla.mount("assets/minecraft/items")
+    # attach vanilla lookups to template classes
+    VanillaTemplate.vanilla_item_models = ctx.inject(VanillaIndex).get().item_models
 
     yield
     tl.warn_unused_translations()
@@ -370,7 +385,8 @@ def setup(ctx: Context):
             if reader.fieldnames and reader.fieldnames[0] != "key":
                 raise KeyError(f"{path} must contain a column named 'key'")
             keys.extend([row['key'] for row in reader]) # type: ignore ; csv only contains strings
-    ctx.cache["translations"].json = {"keys": list(set(keys)), "backfill": babelbox_backfill}
+    keys = sorted(set(keys))
+    ctx.cache["translations"].json = {"keys": keys, "digest": hashlib.sha1("\n".join(keys).encode()).hexdigest(), "backfill": babelbox_backfill}
 
 def mount_registry(ctx: Context):
     ctx.cache["modeldata_registry"].json = JsonFile(source_path="gm4/modeldata_registry.json").data
@@ -389,13 +405,15 @@ def pad_item_def_range_dispatch(ctx: Context):
     for item_def in ctx.assets["minecraft"].item_models.values():
         vanilla_item_def = item_def.data["model"]["fallback"]
         entries: list[Any] = item_def.data["model"]["entries"]
-        prior_cmd = 1e8
-        for i, entry in reversed(list(enumerate(entries))):
-            if prior_cmd-(prior_cmd:=entry["threshold"]) > 1: # theres a gap to fill
-                entries.insert(i+1, {
-                    "threshold": prior_cmd+1,
+        padded: list[Any] = []
+        for entry, next_cmd in zip(entries, [e["threshold"] for e in entries[1:]] + [1e8]):
+            padded.append(entry)
+            if next_cmd-entry["threshold"] > 1: # theres a gap to fill
+                padded.append({
+                    "threshold": entry["threshold"]+1,
                     "model": vanilla_item_def
                 })
+        entries[:] = padded
 
 def merge_policy(ctx: Context):
     ctx.assets.merge_policy.extend_namespace(ItemModel, item_definition_merging)
@@ -405,13 +423,61 @@ def link_resource_pack(ctx: Context):
     ctx.assets.name = "DEV gm4_resource_pack"
     lm = ctx.inject(LinkManager)
 
-    # clear DP link, we only want to send a RP to minecraft
-    dp_dir = lm.data_pack
-    lm.data_pack = None
+    # only the RP is sent to minecraft, rewriting just the files changed since the last `beet dev --watch` cycle
+    if lm.resource_pack:
+        link_pack(lm, ctx.assets, Path(lm.resource_pack))
+
+class ModelDataRegistry:
+    """The custom_model_data registry json, with a reverse lookup of references and a bitset of used values for each item.
+        All edits go through this class so the lookups stay in sync with the json, which keeps the modeldata_registry.json format"""
+
+    def __init__(self, data: JsonType):
+        self.data = data
+        self.items: dict[str, dict[str, int]] = data.setdefault("items", {})
+        self.allocations: dict[str, tuple[int, int]] = data.get("allocations", {})
+        self.references: dict[str, dict[str, int]] = {} # reference -> {item_id: index}
+        self.used: dict[str, int] = {} # item_id -> bitset of assigned indices
+        for item_id, reg in self.items.items():
+            for reference, index in reg.items():
+                self.references.setdefault(reference, {})[item_id] = index
+                self.used[item_id] = self.used.get(item_id, 0) | 1 << index
+
+    def index(self, reference: str) -> Optional[int]:
+        if (assigned := self.references.get(reference)):
+            return next(iter(assigned.values()))
+        return None
 
-    lm.autosave_handler(ctx) # send RP to minecraft
+    def set(self, item_id: str, reference: str, index: int):
+        reg = self.items.setdefault(item_id, {})
+        previous = reg.get(reference)
+        reg[reference] = index
+        self.references.setdefault(reference, {})[item_id] = index
+        self.used[item_id] = self.used.get(item_id, 0) | 1 << index
+        if previous is not None and previous != index:
+            self._release(item_id, previous)
+
+    def remove(self, item_id: str, reference: str):
+        index = self.items[item_id].pop(reference)
+        assigned = self.references[reference]
+        del assigned[item_id]
+        if not assigned:
+            del self.references[reference]
+        self._release(item_id, index)
+
+    def _release(self, item_id: str, index: int):
+        if index not in self.items[item_id].values(): # the value may still be shared by another reference
+            self.used[item_id] &= ~(1 << index)
+
+    def lowest_free(self, item_ids: list[str], lower: int, upper: int) -> Optional[int]:
+        """lowest index within [lower, upper] that is unused on all the given items"""
+        used = 0
+        for item_id in item_ids:
+            used |= self.used.get(item_id, 0)
+        free = ~used & ((1 << (upper+1)) - (1 << lower))
+        if not free:
+            return None
+        return (free & -free).bit_length() - 1
 
-    lm.data_pack = dp_dir # restore the DP link
 
 class GM4ResourcePack(MutatingReducer, InvokeOnJsonNbt):
     """Service Object handling custom_model_data and generated item models"""
@@ -419,7 +485,8 @@ class GM4ResourcePack(MutatingReducer, InvokeOnJsonNbt):
     def __init__(self, ctx: Context):
         self.ctx = ctx
         self.cmd_prefix = CUSTOM_MODEL_PREFIX # enables value to be changed by other projects, like the public server
-        self.registry = ctx.cache["modeldata_registry"].json
+        self.registry = ModelDataRegistry(ctx.cache["modeldata_registry"].json)
+        self.reads = ctx.inject(ModelDataReads)
         self.logger = parent_logger.getChild(ctx.project_id)
         self._opts = FlatResourcePackOptions(model_data=[], gui_fonts=[]) # unloaded config
         super().__init__()
@@ -439,7 +506,7 @@ class GM4ResourcePack(MutatingReducer, InvokeOnJsonNbt):
     #== Custom Model Data registration and management ==#
     def update_modeldata_registry(self):
         """Updates shared modeldata_registry.json with entries from the beet.yaml"""
-        item_registry: dict[str, dict[str, int]] = self.registry.setdefault("items", {})
+        item_registry = self.registry.items
 
         # add new references and assign values
         for m in self.opts.model_data:
@@ -466,31 +533,24 @@ class GM4ResourcePack(MutatingReducer, InvokeOnJsonNbt):
             for ref in list(reg.keys()):
                 if ref.startswith(self.ctx.project_id) and ref not in all_refs and self.ctx.project_id != 'gm4':
                     self.logger.info(f"Removing undefined custom_model_data from {item_id} registry: '{ref}'")
-                    del reg[ref]
+                    self.registry.remove(item_id, ref)
 
     def generate_item_definitions(self):
         """Generates item-model-definition files in the 'minecraft' namespace, adding range_dispatch entries for each custom_model_data value"""
-        vanilla = self.ctx.inject(Vanilla)
-        vanilla.minecraft_version = '1.21.5'
-        vanilla_item_defs_jar = vanilla.mount("assets/minecraft/items")
-        # group models by item id
-        for item_id in {i for m in self.opts.model_data for i in m.item.entries()}:
-            models = filter(lambda m: item_id in m.item.entries(), self.opts.model_data) # with this item_id
-            models = sorted(models, key=lambda m: self.retrieve_index(m.reference)[0])
+        vanilla_item_models = self.ctx.inject(VanillaIndex).get().item_models
+        # group models by item id in one pass, with their CMD values resolved once
+        grouped: dict[str, list[tuple[int, ModelData]]] = {}
+        for model in self.opts.model_data:
+            cmd = self.retrieve_index(model.reference)[0]
+            for item_id in model.item.entries():
+                grouped.setdefault(item_id, []).append((cmd, model))
 
-            vanilla_itemdef = vanilla_item_defs_jar.assets.item_models[f"minecraft:{item_id}"].data["model"]
+        for item_id, models in grouped.items():
+            models.sort(key=lambda e: e[0]) # stable, so models sharing a value keep their config order
+            vanilla_itemdef = deepcopy(vanilla_item_models[f"minecraft:{item_id}"]["model"])
 
-            new_itemdef: dict[str, Any] = {
-                "model": {
-                    "type": "minecraft:range_dispatch",
-                    "property": "minecraft:custom_model_data",
-                    "entries": [],
-                    "fallback": vanilla_itemdef
-                }
-            }
-            itemdef_entries: list[Any] = new_itemdef["model"]["entries"]
-
-            for model in models:
+            itemdef_entries: list[Any] = []
+            for cmd, model in models:
                 if isinstance(model.template, str):
                     continue # TODO is this correct?
 
@@ -503,40 +563,41 @@ class GM4ResourcePack(MutatingReducer, InvokeOnJsonNbt):
                     }
                 else:
                     model_json = m
-            
+
                 itemdef_entries.append({
-                    "threshold": self.cmd_prefix+self.retrieve_index(model.reference)[0],
+                    "threshold": self.cmd_prefix+cmd,
                     "model": model_json
-                })
-            
-            itemdef_entries.sort(key=lambda entry: entry["threshold"]) # sort entries ascending
-            self.ctx.assets.item_models[f"minecraft:{item_id}"] = ItemModel(new_itemdef)
+                }) # already ascending, as models are sorted by value
+
+            self.ctx.assets.item_models[f"minecraft:{item_id}"] = ItemModel({
+                "model": {
+                    "type": "minecraft:range_dispatch",
+                    "property": "minecraft:custom_model_data",
+                    "entries": itemdef_entries,
+                    "fallback": vanilla_itemdef
+                }
+            })
 
     def retrieve_index(self, reference: str) -> tuple[int, KeyError|None]:
         """retrieves the CMD value for the given reference"""
-        for reg in self.registry["items"].values():
-            if reference in reg:
-                return reg[reference], None
+        index = self.reads.indices[reference] = self.registry.index(reference)
+        if index is not None:
+            return index, None
         return -self.cmd_prefix, KeyError(f"{reference} has no asscioated index")
     
     def find_new_index(self, item_ids: list[str], reference: str):
         """finds the next available CMD value for the given items and applies it to the registry"""
         try:
-            allocation_id = next(filter(lambda k: fnmatch(self.ctx.project_id, k), self.registry["allocations"].keys())) #type: ignore ; type checker thinks 'k' is _T@next, not str
+            allocation_id = next(filter(lambda k: fnmatch(self.ctx.project_id, k), self.registry.allocations.keys())) #type: ignore ; type checker thinks 'k' is _T@next, not str
         except StopIteration:
             allocation_id = None
-        l, u = self.registry["allocations"].get(allocation_id, (1,99))
-        available_indices = set(range(l, u+1))
-
-        for item_id in item_ids:
-            used_values = set(self.registry["items"].get(item_id, {}).values())
-            available_indices -= used_values
+        l, u = self.registry.allocations.get(allocation_id, (1,99)) # type: ignore ; None is never an allocation key
 
-        if not available_indices:
+        i = self.registry.lowest_free(item_ids, l, u)
+        if i is None:
             self.logger.warning("No Valid CMD is open for assignment! Your module may require a specially assigned value allocation if registering many CMD values.")
             raise RuntimeError("Ran out of CMD values to assign!")
         
-        i = min(available_indices)
         self.logger.info(f"Issuing new custom_model_data for '{reference}': {i}")
         for item_id in item_ids:
             self.set_index(item_id, i, reference)
@@ -547,7 +608,7 @@ class GM4ResourcePack(MutatingReducer, InvokeOnJsonNbt):
             self.logger.error(f"Model-Data cache is outdated. Github Actions cannot issue custom_model_data. Run the build locally and commit changes to modeldata_registry.json")
             sys.exit(1) # stop the build and mark the github action as failed
 
-        self.registry.setdefault("items", {}).setdefault(item_id, {})[reference] = index
+        self.registry.set(item_id, reference, index)
         self.logger.info(f"Issuing custom_model_data {index} for {item_id}")
 
 
@@ -640,38 +701,90 @@ class GM4ResourcePack(MutatingReducer, InvokeOnJsonNbt):
                 "providers": providers
             }))
 
+_pending_item_definitions: dict[int, dict[int, tuple[ItemModel, list[list[Any]]]]] = {} # id(pack) -> id(item model) -> model and its entry runs
+
 def item_definition_merging(pack: ResourcePack, path: str, current: ItemModel, conflict: ItemModel) -> bool:
     """ItemModel beet merge rule for combining range_dispatch properly"""
     if current.data["model"].get("type") != "minecraft:range_dispatch" or conflict.data["model"].get("type") != "minecraft:range_dispatch":
         parent_logger.warning(f"item model {path} was sent to merging but only one file uses 'range_dispatch'")
         return False
-    
-    merged_entries: list[Any] = current.data["model"]["entries"]
-    merged_entries.extend(conflict.data["model"]["entries"])
-    merged_entries.sort(key=lambda entry: entry["threshold"])
-
-    # remove duplicate entries - relying on each CMD to be unique already
-    seen_values: set[int] = set()
-    for entry in merged_entries.copy():
-        if (v:=entry["threshold"]) not in seen_values:
-            seen_values.add(v)
-        else: # otherwise its a duplicate
-            merged_entries.remove(entry)
 
+    entries: list[Any] = current.data["model"]["entries"]
+    if (pending := _pending_item_definitions.get(id(pack))) is not None: # merged once all packs are collected
+        pending.setdefault(id(current), (current, [entries]))[1].append(conflict.data["model"]["entries"])
+    else:
+        entries[:] = merge_range_dispatch_entries([entries, conflict.data["model"]["entries"]])
     return True
 
+@contextmanager
+def collect_item_definitions(pack: ResourcePack) -> Iterator[None]:
+    """Defers range_dispatch merges into the pack, then merges the entries of each item model from all merged packs at once"""
+    pending = _pending_item_definitions[id(pack)] = {}
+    try:
+        yield
+    finally:
+        del _pending_item_definitions[id(pack)]
+        for current, runs in pending.values():
+            current.data["model"]["entries"][:] = merge_range_dispatch_entries(runs)
+
+def merge_range_dispatch_entries(runs: list[list[Any]]) -> list[Any]:
+    """k-way merge of range_dispatch entry lists, keeping the first entry of each threshold - relying on each CMD to be unique already"""
+    sorted_runs = [run if all(a["threshold"] <= b["threshold"] for a, b in pairwise(run)) else sorted(run, key=lambda entry: entry["threshold"]) for run in runs]
+    merged: list[Any] = []
+    for entry in heapq.merge(*sorted_runs, key=lambda entry: entry["threshold"]): # stable, so earlier runs win ties
+        if not merged or merged[-1]["threshold"] != entry["threshold"]:
+            merged.append(entry)
+    return merged
+
+
+class TranslationKeyIndex:
+    """Service providing the translation keys every module may use: vanilla, base, guidebook and all modules' translations.csv.
+        Built once per process, and only rebuilt when one of those inputs changes"""
+    def __init__(self, ctx: Context):
+        self.ctx = ctx
+
+    def get(self) -> frozenset[str]:
+        translations = self.ctx.cache["translations"].json
+        key = (
+            translations.get("digest") or hashlib.sha1("\n".join(sorted(translations["keys"])).encode()).hexdigest(),
+            *(file_stamp(Path(p)) for p in (BASE_LANG, GUIDEBOOK_TRANSLATIONS)),
+        )
+        if (keys := _translation_indexes.get(key)) is None:
+            _translation_indexes.clear() # only the latest inputs are ever looked up again
+            keys = _translation_indexes[key] = self.build(translations["keys"])
+        return keys
+
+    def build(self, module_keys: list[str]) -> frozenset[str]:
+        with open(GUIDEBOOK_TRANSLATIONS, 'r') as csvfile:
+            guidebook_keys = {row["key"] for row in csv.DictReader(csvfile)}
+        return frozenset().union(
+            self.ctx.inject(VanillaIndex).get().lang.keys(),
+            Language(source_path=BASE_LANG).data.keys(),
+            guidebook_keys,
+            module_keys,
+            LEGACY_TRANSLATION_KEYS,
+        )
+
+
+def file_stamp(path: Path) -> tuple[int, int]:
+    stat = path.stat()
+    return stat.st_size, stat.st_mtime_ns
+
+
+def may_contain_translation(value: str) -> bool:
+    """Cheap check rejecting strings that cannot be a json text component with a translate key, the only json the linter checks"""
+    return value.lstrip()[:1] in ("{", "[") and "translate" in value
+
 
 class TranslationLinter(Reducer):
     """Mecha linter ensuring all translation keys are registered in translations.csv"""
     def __init__(self, ctx: Context):
         self.ctx = ctx
         self.mecha_database = ctx.inject(Mecha).database
-        vanilla = ctx.inject(Vanilla)
-        vanilla.minecraft_version = '1.21.5'
-        vanilla_lang = vanilla.mount("assets/minecraft/lang/en_us.json")
-        self.vanilla_keys = set(vanilla_lang.assets.languages["minecraft:en_us"].data.keys())
-        self.total_keys: set[str] = set()
+        self.shared_keys = ctx.inject(TranslationKeyIndex).get()
         self.local_keys: set[str] = set()
+        self.babelbox_lang: dict[str, str] = {}
+        self.lookups_ready = False
         self.used_keys: set[str] = set()
         self.logger = parent_logger.getChild(ctx.project_id)
         self.backfill_enable: bool = ctx.cache["translations"].json["backfill"]
@@ -681,16 +794,25 @@ class TranslationLinter(Reducer):
 
     @rule(AstNbtValue)
     def check_nbt_json(self, node: AstNbtValue):
-        mc = self.ctx.inject(Mecha)
-        if isinstance(node.value, (String, str)):
-            try:
-                json_ast = mc.parse(node.value, type=AstJson)
+        if isinstance(node.value, (String, str)) and may_contain_translation(node.value):
+            if (json_ast := self.parse_nbt_json(node.value)) is not None:
                 with self.use_diagnostics(collec:=DiagnosticCollection()):
                     self.invoke(json_ast) # process new node with reducer rules
                 for exc in collec.exceptions:
                     yield propagate_location(exc, node)
-            except DiagnosticError:
-                pass # string is not json
+
+    def parse_nbt_json(self, value: str) -> Optional[AstJson]:
+        if value in _nbt_json_asts:
+            _nbt_json_asts.move_to_end(value)
+            return _nbt_json_asts[value]
+        try:
+            json_ast = self.ctx.inject(Mecha).parse(value, type=AstJson)
+        except DiagnosticError:
+            json_ast = None # string is not json
+        _nbt_json_asts[value] = json_ast
+        if len(_nbt_json_asts) > NBT_JSON_CACHE_SIZE:
+            _nbt_json_asts.popitem(last=False)
+        return json_ast
 
     @rule(AstNbtCompound)
     @rule(AstJsonObject)
@@ -717,7 +839,7 @@ class TranslationLinter(Reducer):
             if self.babelbox_lang.get(transl_key) != fallback:
                 if transl_key in self.babelbox_lang and not self.backfill_enable:
                     yield set_location(Diagnostic("info", f"Fallback for {transl_key} does not match that provided in 'translations.csv'"), node)
-                elif self.backfill_enable and transl_key not in self.backfill_values and transl_key not in self.foreign_keys:
+                elif self.backfill_enable and transl_key not in self.backfill_values and not self.is_foreign(transl_key):
                     self.logger.info(f"Backfilling the fallback for {transl_key} into 'translations.csv'")
                     self.backfill_values[transl_key] = fallback
             yield self.check_key(transl_key, node)
@@ -728,35 +850,26 @@ class TranslationLinter(Reducer):
 
     def check_key(self, transl_key: str, node: Any):
         self.used_keys.add(transl_key)
-        if transl_key not in self.total_keys and not self.backfill_enable:
+        if not self.backfill_enable and not self.is_defined(transl_key):
             return set_location(Diagnostic("warn", f"Translation key not defined in en_us: {transl_key}"), node)
         return
 
+    def is_defined(self, transl_key: str) -> bool:
+        return transl_key in self.local_keys or transl_key in self.shared_keys or transl_key in self.ignored_keys
+
+    def is_foreign(self, transl_key: str) -> bool:
+        """Whether the key is defined outside this module"""
+        return transl_key not in self.local_keys and (transl_key in self.shared_keys or transl_key in self.ignored_keys)
+
     def setup_translation_lookups(self):
-        # setup lookup list if first invocation
-        if not self.total_keys:
+        # this module's keys, layered over the build-wide index on first invocation
+        if not self.lookups_ready:
+            self.lookups_ready = True
             self.babelbox_lang = self.ctx.assets.languages.get("gm4_translations:en_us", Language()).data
             self.local_keys = (
                 set(self.babelbox_lang.keys()) |
                 set(self.ctx.assets.languages.get("gm4:en_us", Language()).data.keys())
             )
-            self.total_keys = (
-                self.vanilla_keys |
-                self.local_keys | 
-                self.ignored_keys | 
-                set(Language(source_path="base/assets/gm4/lang/en_us.json").data.keys()) |
-                self.get_guidebook_translations() |
-                set(self.ctx.cache["translations"].json["keys"]) |
-                {"%1$s%3427655$s", "%1$s%3427656$s"} # manual old keys
-            )
-            self.foreign_keys = self.total_keys - self.local_keys
-
-    @cache
-    def get_guidebook_translations(self) -> set[str]:
-        # internally loads keys in guidebook translations.csv, cached for each subproject build
-        with open("gm4_guidebook/assets/translations.csv", 'r') as csvfile:
-            reader = csv.DictReader(csvfile)
-            return {row["key"] for row in reader}
 
     def warn_unused_translations(self):
         for key in self.ctx.assets.languages.get("gm4_translations:en_us", Language()).data:
@@ -882,8 +995,7 @@ class HandheldTemplate(TemplateOptions):
 
 class VanillaTemplate(TemplateOptions):
     name = "vanilla"
-    vanilla: ClassVar[Vanilla] # mounted to by beet plugin since it requires context access
-    vanilla_jar: ClassVar[ClientJar]
+    vanilla_item_models: ClassVar[dict[str, JsonType]] # attached by beet plugin since it requires context access
     _item_def_map: dict[str, JsonType] = {}
 
     def create_models(self, config: ModelData, models_container: NamespaceProxy[Model]):
@@ -895,7 +1007,7 @@ class VanillaTemplate(TemplateOptions):
 
         ret_list: list[Model] = []
         for item, model_name in zip(config.item.entries(), model_names):
-            model_compound = self.vanilla_jar.assets.item_models[add_namespace(item, "minecraft")].data.get("model", {})
+            model_compound = deepcopy(self.vanilla_item_models[add_namespace(item, "minecraft")].get("model", {}))
             if model_compound["type"] == "minecraft:select": # template off the fallback model, (e.g. non-festive chest)
                 model_compound = model_compound["fallback"]
 
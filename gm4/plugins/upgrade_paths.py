@@ -1,6 +1,6 @@
 from beet import Context, Function, configurable, PluginOptions
 from pydantic.v1 import Extra
-from gm4.plugins.manifest import ManifestCacheModel
+from gm4.plugins.manifest import BuildManifest
 from gm4.utils import Version, NoneAttribute
 
 class UpgradePathsConfig(PluginOptions, extra=Extra.ignore):
@@ -36,8 +36,7 @@ def beet_default(ctx: Context, opts: UpgradePathsConfig):
 def lib(ctx: Context):
     """Runs additional processing to assign libraries a psudo gm4_modules score for comparison"""
     score_holder = ctx.project_id.removeprefix('gm4_')
-    manifest = ManifestCacheModel.parse_obj(ctx.cache["gm4_manifest"].json)
-    ver_str = manifest.libraries.get(ctx.project_id.replace("gm4_", "lib_"), NoneAttribute()).version or "0.0.0"
+    ver_str = (ctx.inject(BuildManifest).library(ctx.project_id.replace("gm4_", "lib_")) or NoneAttribute()).version or "0.0.0"
     ver = Version(ver_str)
     if ver.patch is None:
         ver.patch = 0 #  when beet-dev is run, pipeline has no patch number record, but dev builds should still allow int conversion
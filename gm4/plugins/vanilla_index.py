@@ -0,0 +1,193 @@
+import json
+import logging
+import mmap
+import os
+import pickle
+from collections.abc import Mapping
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Iterator, Optional
+from zipfile import ZipFile
+
+from beet import Context, PngFile
+from beet.contrib.vanilla import Vanilla
+
+parent_logger = logging.getLogger("gm4.vanilla_index")
+
+INDEX_FORMAT = 4 # increment when the indexed contents change, to rebuild existing index files
+
+_loaded_indexes: dict[Path, 'VanillaData'] = {} # shared by all subprojects built in this process
+
+@dataclass
+class TagClosure:
+    """Fully flattened vanilla tags of one registry, with the reverse lookup of the tags containing each id"""
+    members: dict[str, tuple[str, ...]] = field(default_factory=dict) # tag -> ids, in depth-first order of the tag files
+    tags: dict[str, tuple[str, ...]] = field(default_factory=dict) # id -> tags containing it, directly or through other tags
+
+    @classmethod
+    def build(cls, tags: dict[str, dict[str, Any]]) -> 'TagClosure':
+        closure = cls()
+
+        def expand(tag: str, visiting: set[str]) -> tuple[str, ...]:
+            if (members := closure.members.get(tag)) is not None:
+                return members
+            visiting.add(tag)
+            ids: list[str] = []
+            for value in tags[tag]["values"]:
+                entry: str = value["id"] if isinstance(value, dict) else value
+                if not entry.startswith("#"):
+                    ids.append(entry)
+                elif (subtag := entry[1:]) in tags and subtag not in visiting: # skips tag cycles, which the game rejects anyway
+                    ids.extend(expand(subtag, visiting))
+            visiting.discard(tag)
+            members = closure.members[tag] = tuple(dict.fromkeys(ids))
+            return members
+
+        reverse: dict[str, list[str]] = {}
+        for tag in tags:
+            for id in expand(tag, set()):
+                reverse.setdefault(id, []).append(tag)
+        closure.tags = {id: tuple(t) for id, t in reverse.items()}
+        return closure
+
+    def resolve(self, tag: str) -> tuple[str, ...]:
+        """Every id in the tag and its subtags, with or without a leading `#`. Raises a KeyError for tags that are not in vanilla"""
+        return self.members[tag.removeprefix("#")]
+
+
+class TextureStore(Mapping[str, bytes]):
+    """Vanilla textures stored back to back in a file next to the index, so they stay out of the pickle.
+        Each texture is read from the memory mapped file when it is looked up"""
+    def __init__(self, path: Path = Path(), offsets: Optional[dict[str, tuple[int, int]]] = None):
+        self.path = path
+        self.offsets = offsets or {} # texture -> start and length in the file
+        self._mm: Optional[mmap.mmap] = None
+
+    def __getstate__(self) -> dict[str, Any]:
+        return {"path": self.path, "offsets": self.offsets}
+
+    def __setstate__(self, state: dict[str, Any]):
+        self.__init__(**state)
+
+    def __getitem__(self, key: str) -> bytes:
+        start, length = self.offsets[key]
+        if self._mm is None:
+            with self.path.open("rb") as f:
+                self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._mm[start:start+length]
+
+    def __contains__(self, key: object) -> bool:
+        return key in self.offsets
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.offsets)
+
+    def __len__(self) -> int:
+        return len(self.offsets)
+
+    @classmethod
+    def write(cls, path: Path, textures: dict[str, bytes]) -> 'TextureStore':
+        offsets: dict[str, tuple[int, int]] = {}
+        position = 0
+        with path.open("wb") as f:
+            for key, raw in textures.items():
+                f.write(raw)
+                offsets[key] = (position, len(raw))
+                position += len(raw)
+        return cls(path, offsets)
+
+
+@dataclass
+class VanillaData:
+    """Vanilla files of one minecraft version used by gm4 plugins, keyed by resource location (eg. `minecraft:stone`).
+        Values are shared by every subproject of the build, so copy them before making modifications"""
+    recipes: dict[str, dict[str, Any]] = field(default_factory=dict)
+    item_tags: dict[str, dict[str, Any]] = field(default_factory=dict)
+    block_tags: dict[str, dict[str, Any]] = field(default_factory=dict)
+    item_models: dict[str, dict[str, Any]] = field(default_factory=dict)
+    textures: TextureStore = field(default_factory=TextureStore) # item and block textures, eg. `minecraft:item/apple`
+    lang: dict[str, str] = field(default_factory=dict) # en_us
+    item_textures: dict[str, Optional[str]] = field(default_factory=dict) # texture representing each item, eg. `minecraft:oak_door` -> `minecraft:item/oak_door`
+    item_tag_closure: TagClosure = field(default_factory=TagClosure)
+    block_tag_closure: TagClosure = field(default_factory=TagClosure)
+
+    def texture(self, path: str) -> Optional[PngFile]:
+        if (raw := self.textures.get(path)) is None:
+            return None
+        return PngFile(raw)
+
+    def item_texture(self, item_id: str) -> Optional[str]:
+        """Path of a single texture representing the item, from the prebuilt index for vanilla items"""
+        if item_id in self.item_textures:
+            return self.item_textures[item_id]
+        return self.find_item_texture(item_id)
+
+    def find_item_texture(self, item_id: str) -> Optional[str]:
+        name = item_id.removeprefix("minecraft:")
+        # try invective mapping
+        for path in (f"minecraft:item/{name}", f"minecraft:block/{name}"):
+            if path in self.textures:
+                return path
+        # exhaustively look for a fuzzy-esque name match
+        return next((path for path in self.textures if f"block/{name}" in path or f"item/{name}" in path), None)
+
+
+# jar path prefixes and the VanillaData field they are indexed into
+INDEXED_PATHS = {
+    "data/minecraft/recipe/": "recipes",
+    "data/minecraft/tags/item/": "item_tags",
+    "data/minecraft/tags/block/": "block_tags",
+    "assets/minecraft/items/": "item_models",
+}
+INDEXED_TEXTURES = ("assets/minecraft/textures/item/", "assets/minecraft/textures/block/")
+LANG_PATH = "assets/minecraft/lang/en_us.json"
+
+
+class VanillaIndex:
+    """Service providing build-wide lookups into the vanilla client jar, built once per minecraft version and stored in the beet cache"""
+    def __init__(self, ctx: Context):
+        self.ctx = ctx
+        self.cache = ctx.cache["vanilla_index"]
+        self.logger = parent_logger
+
+    def get(self, minecraft_version: Optional[str] = None) -> VanillaData:
+        """Index of the given minecraft version, by default the one this build targets"""
+        minecraft_version = minecraft_version or os.getenv("VERSION", "1.21.5")
+        path = self.cache.directory / f"{minecraft_version}_v{INDEX_FORMAT}.pickle"
+        if (data := _loaded_indexes.get(path)) is not None:
+            return data
+
+        texture_path = path.with_suffix(".textures")
+        if path.exists() and texture_path.exists():
+            data = pickle.loads(path.read_bytes())
+        else:
+            data = self.build(minecraft_version, texture_path.with_suffix(".textures.tmp"))
+            tmp_path = path.with_suffix(".tmp")
+            tmp_path.write_bytes(pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL))
+            data.textures.path.replace(texture_path) # never leave partially written files for other processes to read
+            tmp_path.replace(path)
+        data.textures.path = texture_path
+        _loaded_indexes[path] = data
+        return data
+
+    def build(self, minecraft_version: str, texture_path: Path) -> VanillaData:
+        """Reads the indexed files directly from the client jar, in a single pass"""
+        vanilla = self.ctx.inject(Vanilla)
+        client_jar = vanilla.releases[minecraft_version].client_jar
+        self.logger.debug(f"Indexing vanilla {minecraft_version} from {client_jar.path}")
+
+        data = VanillaData()
+        textures: dict[str, dict[str, bytes]] = {prefix: {} for prefix in INDEXED_TEXTURES}
+        with ZipFile(client_jar.path) as zf:
+            for name in zf.namelist():
+                if name.endswith(".json") and (prefix := next((p for p in INDEXED_PATHS if name.startswith(p)), None)):
+                    getattr(data, INDEXED_PATHS[prefix])[f"minecraft:{name.removeprefix(prefix).removesuffix('.json')}"] = json.loads(zf.read(name))
+                elif name.endswith(".png") and (prefix := next((p for p in INDEXED_TEXTURES if name.startswith(p)), None)):
+                    textures[prefix][f"minecraft:{name.removeprefix('assets/minecraft/textures/').removesuffix('.png')}"] = zf.read(name)
+                elif name == LANG_PATH:
+                    data.lang = json.loads(zf.read(name))
+        data.textures = TextureStore.write(texture_path, {k: v for prefix in INDEXED_TEXTURES for k, v in textures[prefix].items()}) # item textures take priority in name searches
+        data.item_textures = {item_id: data.find_item_texture(item_id) for item_id in data.item_models}
+        data.item_tag_closure = TagClosure.build(data.item_tags)
+        data.block_tag_closure = TagClosure.build(data.block_tags)
+        return data
@@ -4,7 +4,7 @@ from beet.contrib.find_replace import find_replace
 from pydantic.v1 import Field, Extra
 import warnings
 from gm4.utils import Version, NoneAttribute
-import gm4.plugins.manifest # for ManifestCacheModel; a runtime circular dependency
+import gm4.plugins.manifest # for BuildManifest; a runtime circular dependency
 
 class VersionInjectionConfig(PluginOptions):
     functions: list[str] = []
@@ -23,7 +23,7 @@ def modules(ctx: Context, opts: VersioningConfig):
         - load:load.json"""
     ctx.cache["currently_building"].json = {"name": ctx.project_name, "id": ctx.project_id, "added_libs": []} # cache module's project id for access within library pipelines
     dependencies = opts.required
-    manifest = gm4.plugins.manifest.ManifestCacheModel.parse_obj(ctx.cache["gm4_manifest"].json)
+    manifest = ctx.inject(gm4.plugins.manifest.BuildManifest)
     lines = ["execute ", ""]
 
     # {{module_name}}.json tag
@@ -32,7 +32,7 @@ def modules(ctx: Context, opts: VersioningConfig):
     ctx.data.function_tags[f"load:{ctx.project_id}"] = load_tag
 
     # load.mcfunction
-    base_ver = manifest.base["version"]
+    base_ver = manifest.model.base["version"]
     dependencies = {"gm4":base_ver}|dependencies # manually insert base version as dependency, assumed to be current base version
 
     for dep_id, ver_str in dependencies.items():
@@ -44,7 +44,7 @@ def modules(ctx: Context, opts: VersioningConfig):
         dep_name = manifest_entry.name if manifest_entry else name_default_dict["name"]
         
         if dep_id not in manifest.modules and dep_id != "gm4":
-            dep_id = manifest.libraries.get(dep_id, NoneAttribute()).id
+            dep_id = (manifest.library(dep_id) or NoneAttribute()).id
         
         # append to startup check
         lines[0] += f"if score {dep_id} load.status matches {dep_ver.major} if score {dep_id}_minor load.status matches {dep_ver.minor}.. "
@@ -96,7 +96,7 @@ def libraries(ctx: Context, opts: VersioningConfig):
         - load:{lib_name}/resolve_load.json
         - load:{lib_name}/dependencies.json"""
     dependencies = opts.required
-    manifest = gm4.plugins.manifest.ManifestCacheModel.parse_obj(ctx.cache["gm4_manifest"].json)
+    manifest = ctx.inject(gm4.plugins.manifest.BuildManifest)
     lib_ver = Version(ctx.project_version)
 
     # enumerate.mcfunction
@@ -111,7 +111,7 @@ def libraries(ctx: Context, opts: VersioningConfig):
         warn_on_future_version(ctx, dep_id, dep_ver)
 
         if dep_id not in manifest.modules:
-            dep_id = manifest.libraries.get(dep_id, NoneAttribute()).id
+            dep_id = (manifest.library(dep_id) or NoneAttribute()).id
         
         dep_check_line += f"if score {dep_id} load.status matches {dep_ver.major} if score {dep_id}_minor load.status matches {dep_ver.minor}.. "
 
@@ -234,10 +234,10 @@ def dependency_load_tags(ctx: Context, dependencies: dict[str, str]) -> Function
     """Assembles dependency information into tag format. Ensures a pack's dependencies
     get processed by lantern load before the primary startup checks for the module itself"""
     dep_tag = FunctionTag()
-    manifest = gm4.plugins.manifest.ManifestCacheModel.parse_obj(ctx.cache["gm4_manifest"].json)
+    manifest = ctx.inject(gm4.plugins.manifest.BuildManifest)
     for dep_id in dependencies.keys():
         if dep_id not in manifest.modules: # retrieve "gm4_" prefixed id for libraries, which are named "lib_"
-            lib = manifest.libraries.get(dep_id)
+            lib = manifest.library(dep_id)
             if lib is None:
                 raise ValueError(f"{dep_id} is not a valid library id")
             dep_id = lib.id
@@ -283,11 +283,9 @@ def warn_on_future_version(ctx: Context, dep_id: str, ver: Version):
     """Issues a console warning if the dependancy version a module requires is greater than the current version of that dependancy"""
     if dep_id == "gm4":
         return # the base version is not in the manifest, tis a special case
-    if "lib" in dep_id:
-        cache_compound = ctx.cache["gm4_manifest"].json["libraries"]
-    else:
-        cache_compound = ctx.cache["gm4_manifest"].json["modules"]
-    latest_dep_ver = Version(cache_compound.get(dep_id, {}).get("version", '0.0.0'))
+    manifest = ctx.inject(gm4.plugins.manifest.BuildManifest)
+    entry = manifest.library(dep_id) if "lib" in dep_id else manifest.modules.get(dep_id)
+    latest_dep_ver = Version(entry.version if entry else '0.0.0')
     
     if (latest_dep_ver.major == ver.major and latest_dep_ver.minor < ver.minor) or (latest_dep_ver.major < ver.major): # type: ignore
         message = f"{ctx.project_id} depends on a future version {dep_id} v{ver}, but the latest available is {latest_dep_ver}"
@@ -1,29 +1,51 @@
+import logging
+import pickle
 from beet import Connection, Context, Pipeline, ResourcePack, DataPack
 from typing import Any
 
+parent_logger = logging.getLogger("gm4.worker")
+
 RETRIEVE_ALL_PROJECTS = 0
 RETRIEVE_LAST_PROJECT = 1
 ProjectPacket = tuple[ResourcePack, DataPack, dict[str, Any]]
+PROJECT_PARAMS = ("project_id",
+                  "project_name",
+                  "project_description",
+                  "project_author",
+                  "project_version",
+                  "project_root",
+                  "minecraft_version",
+                  "directory",
+                  "output_directory",
+                  "meta",
+                  "cache",
+                  "worker",
+                  "template")
+UNPICKLABLE_CONTEXT_PARAMS = ("cache", "worker", "template")
 
 def store_project(ctx: Context):
     """Stores the current project object in a beet worker"""
     with ctx.worker(bridge) as channel:
         rp, dp = ctx.packs
-        ctx_params = {k:getattr(ctx, k) for k in ("project_id",
-                                                  "project_name",
-                                                  "project_description",
-                                                  "project_author",
-                                                  "project_version",
-                                                  "project_root",
-                                                  "minecraft_version",
-                                                  "directory",
-                                                  "output_directory",
-                                                  "meta",
-                                                  "cache",
-                                                  "worker",
-                                                  "template")}
+        channel.send((rp, dp, project_params(ctx)))
+
+def project_params(ctx: Context) -> dict[str, Any]:
+    """Collects the params needed to reconstruct a Context() around stored packs"""
+    return {k:getattr(ctx, k) for k in PROJECT_PARAMS}
 
-        channel.send((rp, dp, ctx_params))
+def picklable_params(params: dict[str, Any]) -> dict[str, Any]:
+    """Strips context params that can not leave the current process"""
+    ret = {k: v for k, v in params.items() if k not in UNPICKLABLE_CONTEXT_PARAMS}
+    meta: dict[str, Any] = {}
+    for key, value in ret["meta"].items():
+        try:
+            pickle.dumps(value)
+        except Exception:
+            parent_logger.debug(f"Dropping unpicklable meta entry '{key}' from {params['project_id']}")
+            continue
+        meta[key] = value
+    ret["meta"] = meta
+    return ret
 
 def freeze_last_stored(ctx: Context):
     """'Freezes' the state of the last stored project by making it a shallow copy, allowing the original to be cleared"""
@@ -59,23 +81,25 @@ def retrieve_and_run(ctx: Context):
 
 def retrieve_and_merge(ctx: Context):
     """Retrieves stored contexts and merges their packs into the current/parent context"""
+    from gm4.plugins.resource_pack import collect_item_definitions # imported here, as resource_pack depends on this module
     with ctx.worker(bridge) as channel:
         channel.send(RETRIEVE_ALL_PROJECTS)
-    for stored_project in channel:
-        for rp, dp, _ in stored_project:
+    with collect_item_definitions(ctx.assets): # range_dispatch item models are merged once, after every module's pack
+        for stored_project in channel:
+            for rp, dp, _ in stored_project:
             
-            #NOTE build hangs when fonts are merged from one ResourcePack to another... why is unknown
-            # this is a manual work around to merge the font files without causing the strange hang
-            for f, font in rp.fonts.items():
-                ctx.generate(f, merge=font)
-            rp.fonts.clear()
+                #NOTE build hangs when fonts are merged from one ResourcePack to another... why is unknown
+                # this is a manual work around to merge the font files without causing the strange hang
+                for f, font in rp.fonts.items():
+                    ctx.generate(f, merge=font)
+                rp.fonts.clear()
 
-            # clear mcmeta entries to the current context can properly make its own
-            del dp.mcmeta
-            del rp.mcmeta
+                # clear mcmeta entries to the current context can properly make its own
+                del dp.mcmeta
+                del rp.mcmeta
 
-            ctx.data.merge(dp)
-            ctx.assets.merge(rp)
+                ctx.data.merge(dp)
+                ctx.assets.merge(rp)
 
 def bridge(connection: Connection[ProjectPacket|int, list[ProjectPacket]]):
     # incoming types `ProjectPacket|int` and outgoing types `list[ProjectPacket]`
@@ -1,13 +1,12 @@
 from beet import Context
-from gm4.utils import run, NoneAttribute
-from gm4.plugins.manifest import ManifestCacheModel
+from gm4.utils import git_head, NoneAttribute
+from gm4.plugins.manifest import BuildManifest
 
 def beet_default(ctx: Context):
 	"""Writes the pack.mcmeta based on the module name and version."""
 	yield # wait for exit phase
 
-	manifest = ManifestCacheModel.parse_obj(ctx.cache["gm4_manifest"].json)
-	manifest_entry = {v.id:v for v in (manifest.modules|manifest.libraries).values()}.get(ctx.project_id, NoneAttribute())
+	manifest_entry = ctx.inject(BuildManifest).get(ctx.project_id) or NoneAttribute()
 
 	ctx.data.pack_format = 71
 	ctx.data.supported_formats = {"min_inclusive": 71, "max_inclusive": 81}
@@ -25,5 +24,5 @@ def beet_default(ctx: Context):
 		]
 		pack.mcmeta.data.update({
 			"version":manifest_entry.version,
-			"commit_hash": run(["git", "log", "-1", "--format=%h"])
+			"commit_hash": git_head().short_hash
 		})
@@ -0,0 +1,105 @@
+import argparse
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any
+from urllib.parse import urlsplit
+
+# Local stand-in for the Modrinth and Smithed apis, for testing the publish stage without publishing real versions.
+# Used by `beet publish --dry-run`, or run with `python -m gm4.publish_stub` and build with MODRINTH_API=http://localhost:8766/modrinth SMITHED_API=http://localhost:8766/smithed
+
+class PublishStub(ThreadingHTTPServer):
+    """Answers the Modrinth and Smithed requests made by `gm4.plugins.output.publish`, as if every project exists without any published versions"""
+    daemon_threads = True
+
+    def __init__(self, address: tuple[str, int], delay: float = 0.05, interval: float = 0.0):
+        super().__init__(address, PublishStubHandler)
+        self.delay = delay
+        self.interval = interval
+        self.next_request = 0.0
+        self.requests: list[tuple[str, str]] = [] # method and path of each answered request, in order
+        self.rejected = 0
+        self.lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+
+class PublishStubHandler(BaseHTTPRequestHandler):
+    server: PublishStub
+
+    def do_GET(self):
+        self.handle_api("GET")
+
+    def do_PATCH(self):
+        self.handle_api("PATCH")
+
+    def do_POST(self):
+        self.handle_api("POST")
+
+    def handle_api(self, method: str):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        path = urlsplit(self.path).path
+        server = self.server
+        with server.lock:
+            now = time.time()
+            if now < server.next_request:
+                server.rejected += 1
+                return self.respond(429, {"error": "Too many requests"}, {"Retry-After": "1"})
+            server.next_request = now + server.interval
+            server.requests.append((method, self.path))
+        time.sleep(server.delay) # network and processing time
+
+        match method, path.split("/")[1:]:
+            case "GET", ["modrinth", "project", _]:
+                self.respond(200, {"body": ""})
+            case "GET", ["modrinth", "project", _, "version"]:
+                self.respond(200, [])
+            case "POST", ["modrinth", "version"]:
+                name = re.search(rb'"name": "([^"]*)"', body)
+                self.respond(200, {"name": name[1].decode() if name else ""})
+            case "PATCH", ["modrinth", "project" | "version", _]:
+                self.respond(204)
+            case "GET", ["smithed", "packs", _]:
+                self.respond(200, {
+                    "display": {"icon": "", "webPage": ""},
+                    "versions": [{"name": "0.0.0", "supports": [], "downloads": {"datapack": ""}}],
+                })
+            case "POST", ["smithed", "packs", _, "versions"]:
+                self.respond(200, {"message": "Added version"})
+            case "PATCH", ["smithed", "packs", _, *_]:
+                self.respond(200, {"message": "Updated pack"})
+            case _:
+                self.respond(404, {"error": "not found"})
+
+    def respond(self, status: int, body: Any = None, headers: dict[str, str] = {}):
+        raw = json.dumps(body).encode() if body is not None else b""
+        self.send_response(status)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(raw)))
+        self.end_headers()
+        self.wfile.write(raw)
+
+    def log_message(self, format: str, *args: Any):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for the Modrinth and Smithed apis")
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--delay", type=float, default=0.05, help="seconds taken to answer each request")
+    parser.add_argument("--interval", type=float, default=0.0, help="seconds between accepted requests, before answering 429")
+    args = parser.parse_args()
+
+    server = PublishStub(("localhost", args.port), args.delay, args.interval)
+    print(f"Publish stub listening on {server.url}")
+    server.serve_forever()
+
+if __name__ == "__main__":
+    main()
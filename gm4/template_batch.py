@@ -0,0 +1,79 @@
+from pathlib import Path
+from typing import Any, Iterable, Optional
+
+from beet import Context, NamespaceFile, TextFileBase
+from jinja2 import Template
+
+# Renders the template files of combinatorial generators straight into the data pack.
+# Each template is read and compiled once, then rendered for every row of parameters, instead of running a subproject per row
+
+class TemplateBatch:
+    """Service loading and rendering template files as a subproject with `data_pack.load` and `data_pack.render` would, merging the results into the data pack"""
+    def __init__(self, ctx: Context):
+        self.ctx = ctx
+        self.sources: dict[str, list[tuple[str, Path]]] = {} # source -> files with their path relative to it
+        self.templates: dict[Path, Template] = {}
+        self.destinations: dict[str, tuple[type[NamespaceFile], str]] = {} # file path -> file type and resource location
+        self.scope_maps: dict[tuple[type[NamespaceFile], ...], dict[tuple[tuple[str, ...], str], type[NamespaceFile]]] = {}
+
+    def render(self, load: dict[str, str], meta: dict[str, Any], extend_namespace: Iterable[type[NamespaceFile]] = ()):
+        """Renders the sources of the `load` mapping, a file or a directory relative to the project, to their destination paths in the data pack.
+            Template variables are looked up in `meta`, then in the project's meta"""
+        extend_namespace = tuple(extend_namespace)
+        for destination, source in load.items():
+            for relative, path in self.list_source(source):
+                file_type, location = self.resolve(f"{destination}/{relative}" if relative else destination, extend_namespace)
+                if issubclass(file_type, TextFileBase):
+                    with self.ctx.template.error_handler(f"Couldn't render template {source!r}."):
+                        file = file_type(self.template(file_type, path).render(meta))
+                else:
+                    file = file_type(source_path=path)
+                self.ctx.data[file_type].merge({location: file}) # type: ignore ; same as merging the pack of a subproject
+
+    def list_source(self, source: str) -> list[tuple[str, Path]]:
+        if (files := self.sources.get(source)) is None:
+            path = self.ctx.directory / source
+            if path.is_dir():
+                files = [(p.relative_to(path).as_posix(), p) for p in sorted(path.rglob("*")) if p.is_file()]
+            elif path.is_file():
+                files = [("", path)]
+            else:
+                raise ValueError(f"Couldn't find template '{source}'")
+            self.sources[source] = files
+        return files
+
+    def template(self, file_type: type[NamespaceFile], path: Path) -> Template:
+        if (template := self.templates.get(path)) is None:
+            text: str = file_type(source_path=path).text # type: ignore ; only called for text files
+            template = self.templates[path] = self.ctx.template.compile(text, filename=path)
+        return template
+
+    def resolve(self, file_path: str, extend_namespace: tuple[type[NamespaceFile], ...]) -> tuple[type[NamespaceFile], str]:
+        """File type and resource location of a path in the data pack, eg. `data/demo/function/foo.mcfunction`"""
+        if (resolved := self.destinations.get(file_path)) is not None:
+            return resolved
+        match file_path.split("/"):
+            case ["data", namespace, *parts] if len(parts) > 1:
+                pass
+            case _:
+                raise ValueError(f"Template destination '{file_path}' is not a namespaced data pack file")
+
+        if (scope_map := self.scope_maps.get(extend_namespace)) is None:
+            scope_map = self.scope_maps[extend_namespace] = self.ctx.data.resolve_scope_map()
+            for file_type in extend_namespace:
+                scope_map[file_type.scope, file_type.extension] = file_type # type: ignore ; extended file types have a single scope
+        resolved = self.match_scope(scope_map, namespace, parts)
+        if resolved is None:
+            raise ValueError(f"No file type is registered for template destination '{file_path}'")
+        self.destinations[file_path] = resolved
+        return resolved
+
+    @staticmethod
+    def match_scope(scope_map: dict[tuple[tuple[str, ...], str], type[NamespaceFile]], namespace: str, parts: list[str]) -> Optional[tuple[type[NamespaceFile], str]]:
+        filename = parts[-1]
+        for i in range(len(parts)-1, 0, -1): # longest scope first
+            scope = tuple(parts[:i])
+            for (file_scope, extension), file_type in scope_map.items():
+                if file_scope == scope and filename.endswith(extension) and len(filename) > len(extension):
+                    return file_type, f"{namespace}:{'/'.join([*parts[i:-1], filename.removesuffix(extension)])}"
+        return None
@@ -3,7 +3,7 @@ import warnings
 from contextlib import contextmanager
 from dataclasses import asdict, dataclass, replace
 from functools import total_ordering
-from typing import Any, Generic, Iterator, List, TypeVar
+from typing import Any, Generic, Iterator, List, Optional, TypeVar
 
 from beet import Advancement, Context, ItemModifier, ListOption, LootTable, Predicate
 from mecha import (
@@ -30,6 +30,65 @@ def run(cmd: list[str]|str) -> str:
 	"""Run a shell command and return the stdout."""
 	return subprocess.run(cmd, capture_output=True, encoding="utf8", shell=isinstance(cmd, str)).stdout.strip()
 
+@dataclass(frozen=True)
+class GitCommit:
+	hash: str
+	short_hash: str
+	subject: str
+
+_git_commits: dict[tuple[Path, str], GitCommit] = {} # commit metadata never changes, so is kept for the lifetime of the process
+
+def git_head(directory: Path|str = ".") -> GitCommit:
+	"""Metadata of the HEAD commit of the repository containing `directory`, as `git log -1` would report.
+		The HEAD hash is read from the .git folder, so the git cli only runs once for each commit"""
+	try:
+		git_dir = find_git_dir(Path(directory))
+		commit_hash = resolve_ref(git_dir, "HEAD")
+	except (OSError, ValueError):
+		return git_cli_head(directory)
+	if (commit := _git_commits.get((git_dir, commit_hash))) is None:
+		commit = _git_commits[(git_dir, commit_hash)] = git_cli_head(directory, commit_hash)
+	return commit
+
+def git_cli_head(directory: Path|str, revision: str = "HEAD") -> GitCommit:
+	full_hash, short_hash, subject = (run(f'cd "{directory}" && git log -1 --format=%H%n%h%n%s {revision}').split("\n", 2) + ["", "", ""])[:3]
+	return GitCommit(full_hash, short_hash, subject)
+
+def find_git_dir(directory: Path) -> Path:
+	"""The .git folder of the repository containing `directory`, following `gitdir:` links of worktrees and submodules"""
+	if not directory.is_dir():
+		raise ValueError(f"{directory} is not a directory")
+	for parent in [directory.resolve(), *directory.resolve().parents]:
+		dot_git = parent / ".git"
+		if dot_git.is_dir():
+			return dot_git
+		if dot_git.is_file():
+			return (parent / dot_git.read_text().removeprefix("gitdir:").strip()).resolve()
+	raise ValueError(f"{directory} is not in a git repository")
+
+def git_common_dir(git_dir: Path) -> Path:
+	"""Folder holding the refs and objects shared by all worktrees"""
+	common_dir = git_dir / "commondir"
+	return (git_dir / common_dir.read_text().strip()).resolve() if common_dir.exists() else git_dir
+
+def resolve_ref(git_dir: Path, ref: str) -> str:
+	"""Follows symbolic refs through loose and packed refs, to a commit hash"""
+	for _ in range(10):
+		for base in (git_dir, git_common_dir(git_dir)):
+			if (ref_file := base / ref).is_file():
+				value = ref_file.read_text().strip()
+				break
+		else:
+			packed_refs = git_common_dir(git_dir) / "packed-refs"
+			packed = [l.split(" ", 1) for l in packed_refs.read_text().splitlines() if l and l[0] not in "#^"] if packed_refs.exists() else []
+			value = next((h for h, name in packed if name == ref), None)
+			if value is None:
+				raise ValueError(f"Unknown git ref {ref}")
+		if not value.startswith("ref:"):
+			return value
+		ref = value.removeprefix("ref:").strip()
+	raise ValueError(f"Too many levels of symbolic git refs from {ref}")
+
 def X_int(val: str) -> int | None:
 	"""Int casting that accepts character 'X' and returns None"""
 	return None if val.lower() == 'x' else int(val)
@@ -145,6 +204,7 @@ class MapOption(GenericModel, Generic[T]):
 # TODO 1.20.5: might not need this anymore
 class InvokeOnJsonNbt:
 	"""Extendable mixin to run MutatingReducer's rules on nbt within advancements, loot_tables ect..."""
+	nbt_transform_deferred: bool = False # set by rules whose result will still change this build, so it is not reused
 	def __init__(self, ctx: Context):
 		self.ctx = ctx
 		raise RuntimeError("InvokeOnJsonNbt should not be directly instantiated. It is a mixin for MutatingReducers and should be interited instead")
@@ -166,32 +226,58 @@ class InvokeOnJsonNbt:
 		if isinstance(mc.database.current, (Advancement, LootTable, ItemModifier, Predicate)):
 			if isinstance(node.value, AstJsonValue) and isinstance(node.value.value, str) \
 				and node.value.value.startswith("{") and node.value.value.endswith("}"): # excludes location check block/fluid tags - easier than making rule that checks for 'set_nbt' functions on the same json level
-				try:
-					nbt = mc.parse(node.value.value.replace("\n", "\\\\n"), type=AstNbtCompound)
-				except DiagnosticError as exc:
+				# identical nbt strings repeat heavily, eg in generated loot tables, so each is only transformed once by this reducer
+				transforms = self.ctx.inject(NbtTransformMemo).transforms(self)
+				if (transform := transforms.get(node.value.value)) is None:
+					transform = self.transform_nbt(node.value.value)
+					if transform.cacheable:
+						transforms[node.value.value] = transform
+
+				if transform.value is None:
 					# if parsing failed, give pretty traceback
-					for d in exc.diagnostics.exceptions:
+					for d in transform.diagnostics:
 						yield set_location(replace(d, file=mc.database.current), node.value)
 					return replace(node, value="{}")
 
-				## TEMP - trial on yielding children rather than using invoke				
-				# with self.use_diagnostics(captured_diagnostics:=DiagnosticCollection()):
-				# 	nbt = yield nbt # run all rules on child-node
-				# print(captured_diagnostics.exceptions)
-				# print(nbt)
-				# new_node = replace(node, value=AstJsonValue(value=mc.serialize(nbt, type=AstNbtCompound)))
-
-				with self.use_diagnostics(captured_diagnostics:=DiagnosticCollection()):
-					processed_nbt = mc.serialize(self.invoke(nbt, type=AstNbtCompound))
-				for exc in captured_diagnostics.exceptions:
-					yield propagate_location(exc, node.value)  # set error location to nbt key-value that caused the problem and pass diagnostic back to mecha
+				for exc in transform.diagnostics:
+					yield propagate_location(replace(exc), node.value)  # set error location to nbt key-value that caused the problem and pass diagnostic back to mecha
 
-				new_node = replace(node, value=AstJsonValue(value=processed_nbt))
+				new_node = replace(node, value=AstJsonValue(value=transform.value))
 				if new_node != node:
 					return new_node
 				
 		return node
 
+	def transform_nbt(self, value: str) -> 'NbtTransform':
+		"""Runs all rules of the reducer on the nbt string. Rules whose result is not final yet should set `nbt_transform_deferred`"""
+		mc = self.ctx.inject(Mecha)
+		try:
+			nbt = mc.parse(value.replace("\n", "\\\\n"), type=AstNbtCompound)
+		except DiagnosticError as exc:
+			return NbtTransform(None, tuple(exc.diagnostics.exceptions))
+
+		self.nbt_transform_deferred = False
+		with self.use_diagnostics(captured_diagnostics:=DiagnosticCollection()):
+			processed_nbt = mc.serialize(self.invoke(nbt, type=AstNbtCompound))
+		return NbtTransform(processed_nbt, tuple(captured_diagnostics.exceptions), cacheable=not self.nbt_transform_deferred)
+
+@dataclass(frozen=True)
+class NbtTransform:
+	"""Result of running a reducer's rules on an nbt string in json. Diagnostics are kept relative to the nbt string, and copied for each file they are reported in"""
+	value: Optional[str] # None if the nbt could not be parsed
+	diagnostics: tuple[Any, ...]
+	cacheable: bool = True
+
+class NbtTransformMemo:
+	"""Service holding the nbt strings each reducer already transformed during the build, shared by all reducers mixing in InvokeOnJsonNbt"""
+	def __init__(self, ctx: Context):
+		self.ctx = ctx
+		self.memo: dict[tuple[str, type[InvokeOnJsonNbt]], dict[str, NbtTransform]] = {} # (project id, rule set) -> nbt string -> result
+
+	def transforms(self, reducer: InvokeOnJsonNbt) -> dict[str, NbtTransform]:
+		"""Results of the rules of `reducer`, keyed by the nbt string they were run on"""
+		return self.memo.setdefault((self.ctx.project_id, type(reducer)), {})
+
 def propagate_location(obj: T, parent_location_obj: Any) -> T:
 	"""a set_location like function propagating diagnostic information for manually invoked rules"""
 	return set_location(obj, 
@@ -1,5 +1,5 @@
 from beet import Context, LootTable
-from beet.contrib.vanilla import Vanilla
+from gm4.plugins.vanilla_index import VanillaIndex
 import itertools
 from typing import Any
 
@@ -50,12 +50,10 @@ ITEMS = {
 
 def beet_default(ctx: Context):
   """Creates a loot table for dropping the 9 result items when disassembling an item."""
-  vanilla = ctx.inject(Vanilla)
-  vanilla.minecraft_version = '1.21.5'
-  recipes = vanilla.data.recipes
+  recipes = ctx.inject(VanillaIndex).get().recipes
 
   for item, durability in ITEMS.items():
-    recipe = recipes[f"minecraft:{item}"].data
+    recipe = recipes[f"minecraft:{item}"]
     ingredients: list[tuple[str, int]] = []
     if recipe["type"] == "minecraft:crafting_shaped":
       pattern = "".join([
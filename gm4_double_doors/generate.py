@@ -4,10 +4,11 @@ import csv
 from dataclasses import dataclass
 import logging
 
-from beet import Context, Structure, TextFile, subproject
-from beet.contrib.vanilla import Vanilla
+from beet import Context, Structure, TextFile
 from nbtlib import parse_nbt
 from gm4.plugins.manifest import repro_structure_to_bytes
+from gm4.plugins.vanilla_index import VanillaIndex
+from gm4.template_batch import TemplateBatch
 
 logger = logging.getLogger(__name__)
 
@@ -20,11 +21,6 @@ class StringStructure(TextFile):
         return Structure(parse_nbt(self.text), serializer=repro_structure_to_bytes)
 
 
-def register_snbt_files(ctx: Context):
-    # register the custom file-type with beet so those files are mounted
-    ctx.data.extend_namespace.append(StringStructure)
-
-
 def read_sound_id_from_csv():
     with open(Path('gm4_double_doors', 'raw', 'sound_names.csv'), mode='r') as file:
         csv_file = csv.reader(file)
@@ -33,24 +29,14 @@ def read_sound_id_from_csv():
     
 def resolve_blocktag(ctx: Context, minecraft_version: str, tag_name: str) -> List[str]:
     """
-    Traverses the given block tag depth-first, replacing all mentions of vanilla block tags with their contents.
-    Returns a flat list of all block ids contained in the block tag and any sub-tags.
+    Returns a flat list of all block ids contained in the block tag and any sub-tags, from the vanilla tag closure index.
     Raises a `ValueError` if a block tag can not be resolved.
     """
-    vanilla = ctx.inject(Vanilla)
-    vanilla.minecraft_version = minecraft_version
+    block_tags = ctx.inject(VanillaIndex).get(minecraft_version).block_tag_closure
     tag_name = tag_name.removeprefix("#")  # hash-symbol is not needed for lookup
-    if tag_name not in vanilla.data.block_tags:  # ensure block tag exists
+    if tag_name not in block_tags.members:  # ensure block tag exists
         raise ValueError(f"Unknown block tag '{tag_name}' for Minecraft version '{minecraft_version}'!")
-    
-    entries: List[str] = vanilla.data.block_tags[tag_name].data["values"]
-    out: List[str] = []
-    for entry in entries:
-        if entry.startswith("#minecraft:"):  # found another block tag, resolve it first
-            out += resolve_blocktag(ctx, minecraft_version, entry)
-        else:
-            out.append(entry)  # block id, append to out
-    return out
+    return list(block_tags.members[tag_name])
 
 @dataclass
 class DoorSound():
@@ -78,30 +64,17 @@ def beet_default(ctx: Context):
 
     # for each wood type in the vanilla doors tag, render a copy of the "templates" directory with the appropiate wood-type
     for wood in door_materials:
-        subproject_config = {
-            "require": [
-                "gm4_double_doors.generate.register_snbt_files"
-            ],
-            "data_pack": {
-                "load": [
-                    {
-                        f"data/gm4_double_doors/advancement/{wood}": "data/gm4_double_doors/templates/advancement",
-                        f"data/gm4_double_doors/function/{wood}": "data/gm4_double_doors/templates/function",
-                        f"data/gm4_double_doors/structure/{wood}": "data/gm4_double_doors/templates/structure",
-                    }
-                ],
-                "render": {
-                    "advancement": "*",
-                    "function": "*",
-                    "string_structure": "*"  # renders all mounted files of the StringStructure container
-                }
+        ctx.inject(TemplateBatch).render(
+            load={
+                f"data/gm4_double_doors/advancement/{wood}": "data/gm4_double_doors/templates/advancement",
+                f"data/gm4_double_doors/function/{wood}": "data/gm4_double_doors/templates/function",
+                f"data/gm4_double_doors/structure/{wood}": "data/gm4_double_doors/templates/structure",
             },
-            "meta": {
+            meta={
                 "material_name": wood
-            }
-        }
-
-        ctx.require(subproject(subproject_config))
+            },
+            extend_namespace=[StringStructure] # structures are rendered as snbt, then converted below
+        )
 
     # transform the "string-structure" files into actual binary files
     for name, struct in ctx.data[StringStructure].items():
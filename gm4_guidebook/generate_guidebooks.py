@@ -1,8 +1,10 @@
 import colorsys
+import hashlib
 import json
 import logging
 import os
 import sys
+from functools import cache
 from typing import Any, ClassVar, Literal, Optional, cast
 from pathlib import Path
 
@@ -17,17 +19,16 @@ from beet import (
     JsonFileBase,
     LootTable,
     Model,
-    NamespaceContainer,
     NamespaceFileScope,
     PngFile,
     Texture,
 )
-from beet.contrib.vanilla import Vanilla
 from beet.core.utils import TextComponent
 from PIL import Image, ImageDraw
 from pydantic.v1 import BaseModel
 
 from gm4.plugins.player_heads import Skin
+from gm4.plugins.vanilla_index import VanillaData, VanillaIndex
 
 logger = logging.getLogger(__name__)
 
@@ -849,9 +850,8 @@ def loottable_to_display(loottable: str, data: dict[Any,Any], ctx: Context) -> t
   #   color = get_texture_color(skin)
 
   # else:
-  vanilla = ctx.inject(Vanilla)
-  vanilla.minecraft_version = '1.21.5'
-  color = get_texture_color(intuit_item_texture(item_id, vanilla))
+  vanilla = ctx.inject(VanillaIndex).get()
+  color = ctx.inject(TextureColors).get(intuit_item_texture(item_id, vanilla))
 
   # create slot
   slot: dict[Any, Any] = {
@@ -926,8 +926,7 @@ def loottable_to_display(loottable: str, data: dict[Any,Any], ctx: Context) -> t
 Reads a vanilla item and creates a JSON text component to display the item in the guidebook
 """
 def item_to_display(ingredient: dict[Any, Any], ctx: Context) -> tuple[TextComponent, TextComponent]:
-  vanilla = ctx.inject(Vanilla)
-  vanilla.minecraft_version = '1.21.5'
+  vanilla = ctx.inject(VanillaIndex).get()
   if ingredient.get("id") == "empty":
     # show empty slot ()
     slot = {
@@ -970,7 +969,7 @@ def item_to_display(ingredient: dict[Any, Any], ctx: Context) -> tuple[TextCompo
         item = ingredient["display"]["name"]
       else:
         item = ingredient["id"]
-      color = get_texture_color(intuit_item_texture(item, vanilla))
+      color = ctx.inject(TextureColors).get(intuit_item_texture(item, vanilla))
       display_color = ingredient["guidebook"]["display_color"] if (item in IS_DYED and "guidebook" in ingredient and "display_color" in ingredient["guidebook"]) else ingredient["components"]["minecraft:dyed_color"] if (item in IS_DYED and "components" in ingredient and "minecraft:dyed_color" in ingredient["components"]) else DEFAULT_COLORS[item] if item in DEFAULT_COLORS else 16777215 # white
       overlay_color = ingredient["guidebook"]["overlay_color"] if (item in OVERLAY_DYED and "guidebook" in ingredient and "overlay_color" in ingredient["guidebook"]) else ingredient["components"]["minecraft:dyed_color"] if (item in OVERLAY_DYED and"components" in ingredient and "minecraft:dyed_color" in ingredient["components"]) else DEFAULT_OVERLAY_COLORS[item] if item in DEFAULT_OVERLAY_COLORS else 16777215 # white
       if "image" in ingredient:
@@ -1033,9 +1032,9 @@ def item_to_display(ingredient: dict[Any, Any], ctx: Context) -> tuple[TextCompo
 
 
 """
-Recursively reads vanilla item tags to find a single item to use
+Finds a single item to use for a vanilla item tag, the first item of the flattened tag
 """
-def get_item_from_tag(item_tag: str, vanilla: Vanilla) -> str:
+def get_item_from_tag(item_tag: str, vanilla: VanillaData) -> str:
   # prepare item tag for searching
   if "minecraft" in item_tag:
     if "#" in item_tag:
@@ -1045,14 +1044,7 @@ def get_item_from_tag(item_tag: str, vanilla: Vanilla) -> str:
   elif item_tag.split(":")[0] != "minecraft":
     raise ValueError("Only vanilla item tags are supported")
 
-  # open item tag
-  item_tags = vanilla.mount("data/minecraft/tags").data["minecraft"].item_tags
-  items = item_tags[item_tag].data["values"]
-
-  # if first value is another tag, recursively search until an item is found
-  if "#" not in items[0]:
-    return items[0]
-  return get_item_from_tag(items[0], vanilla)
+  return vanilla.item_tag_closure.resolve(f"minecraft:{item_tag}")[0]
 
 
 
@@ -1096,9 +1088,7 @@ def generate_recipe_display(recipe: str, ctx: Context) -> list[TextComponent]:
             item["display"] = ingr["guidebook"]
           else:
             if "tag" in ingr:
-              vanilla = ctx.inject(Vanilla)
-              vanilla.minecraft_version = '1.21.5'
-              item["id"] = get_item_from_tag(ingr["tag"], vanilla)
+              item["id"] = get_item_from_tag(ingr["tag"], ctx.inject(VanillaIndex).get())
             else:
               item["id"] = ingr["item"]
             if "components" in ingr:
@@ -1286,62 +1276,83 @@ def generate_recipe_display(recipe: str, ctx: Context) -> list[TextComponent]:
 
 
 
+"""
+Character advances of the default minecraft font, loaded once from advances.json into codepoint-indexed tables
+"""
+class GlyphMetrics:
+  MISSING_ADVANCE = 6 # advance of characters not in advances.json
+  SPACE_ADVANCE = 4
+
+  def __init__(self, advances: dict[str, int|dict[str, int]]):
+    size = max(map(ord, advances)) + 1
+    self.default_widths = bytearray(size) # 0 where the character is not in the default font
+    self.unicode_widths = bytearray(size) # 0 where the character is not a unicode font fallback
+    for char, advance in advances.items():
+      if isinstance(advance, dict):
+        self.unicode_widths[ord(char)] = advance["unicode"]
+      else:
+        self.default_widths[ord(char)] = advance
+
+    # resolved advance of every codepoint, so measuring never needs a bounds check
+    self.advances = bytearray([self.MISSING_ADVANCE]) * (sys.maxunicode + 1)
+    for cp, (default, unicode) in enumerate(zip(self.default_widths, self.unicode_widths)):
+      if default or unicode:
+        self.advances[cp] = default or unicode
+
+  def measure(self, text: str) -> int:
+    return sum(map(self.advances.__getitem__, map(ord, text)))
+
+  def wrap(self, text: str, width: int = 114) -> list[str]:
+    """Splits a string into how a minecraft book would display it in multiple lines. 114 is the max number of advances in each line"""
+    lines: list[str] = []
+    current_line = ""
+    current_len = 0
+    # generate each line based on advances of each word
+    for word in text.split(" "):
+      wlen = self.measure(word)
+      if current_len + wlen > width:
+        if not current_line == "":
+          lines.append(current_line)
+        current_line = ""
+        current_len = 0
+        # if a single word is greater than the max, it gets split every `width` advances
+        if wlen > width:
+          for char in word:
+            advance = self.advances[ord(char)]
+            if current_len + advance > width:
+              lines.append(current_line)
+              current_line = ""
+              current_len = 0
+            current_line += char
+            current_len += advance
+          continue
+      current_line += word + " "
+      current_len += wlen + self.SPACE_ADVANCE
+
+    # add each line to a list, without trailing spaces
+    lines.append(current_line)
+    return [line.removesuffix(" ") for line in lines]
+
+  @classmethod
+  @cache
+  def default(cls) -> 'GlyphMetrics':
+    return cls(JsonFile(source_path="gm4_guidebook/advances.json").data)
+
+
+
 """
 Calculate how many advances each character takes up when written in the default minecraft font
 """
 def char_advance(char: str) -> int:
-  advances = JsonFile(source_path="gm4_guidebook/advances.json").data
-  # find char in database
-  if char in advances:
-    if type(advances[char]) == dict:
-      return advances[char]["unicode"]
-    return advances[char]
-  return 6
+  return GlyphMetrics.default().measure(char)
 
 
 
 """
 Splits a string into how a minecraft book would display it in multiple lines
 """
-def split_into_lines(str: str) -> list[int]:
-  lines:list[Any] = []
-  words:list[Any] = []
-  # split string into words
-  for word in str.split(" "):
-    # count how many advances are in each word
-    wlen = 0
-    for char in word:
-      wlen += char_advance(char)
-    words.append((word, wlen))
-
-  current_line = ""
-  current_len = 0
-  # generate each line based on advances of each word
-  for word, wlen in words:
-    if current_len + wlen > 114: # 114 is max number of advances in each line
-      if not current_line == "":
-        lines.append(current_line)
-      current_line = ""
-      current_len = 0
-      # if a single word is greater than the max, it gets split every 114 advances
-      if wlen > 114:
-        for char in word:
-          if current_len + char_advance(char) > 114:
-            lines.append(current_line)
-            current_line = ""
-            current_len = 0
-          current_line += char
-          current_len += char_advance(char)
-        continue
-    current_line += word + " "
-    current_len += wlen + 4
-
-  # add each line to a list, without trailing spaces
-  lines.append(current_line)
-  for i in range(len(lines)):
-    lines[i] = lines[i].removesuffix(" ")
-
-  return lines
+def split_into_lines(str: str) -> list[str]:
+  return GlyphMetrics.default().wrap(str)
 
 
 
@@ -1384,25 +1395,37 @@ def populate_insert(element: dict[Any, Any], book: Book, ctx: Context, lectern:
 
 
 """
-Converts the JSON text component into a string to be placed inside the page NBT
+Converts the JSON text components of a book's pages into the lists placed inside the page NBT.
+Headers are built once per variant and inserts once per (insert, recipe), then shared by every page using them
 """
-def stringify_page(page: TextComponent, book: Book, ctx: Context, lectern: bool = False) -> list[dict[Any,Any]|str]:
-  page_with_header: list[dict[Any,Any]|str] = generate_lectern_header(book) if lectern else generate_book_header(book)
-  # populate insertions for a single value
-  if isinstance(page, dict):
-    if "insert" in page.keys():
-      page = populate_insert(page, book, ctx, lectern)
-  # populate insertions for a list
-  elif isinstance(page, list):
-    for i, element in enumerate(page):
-      if isinstance(element, dict) and "insert" in element.keys():
-        page[i] = populate_insert(element, book, ctx, lectern) #type: ignore
-  # stringify the page
-  if isinstance(page, list):
-    page_with_header.extend(page)
-  else:
-    page_with_header.append(page)
-  return page_with_header
+class PageRenderer:
+  def __init__(self, book: Book, ctx: Context):
+    self.book = book
+    self.ctx = ctx
+    self.headers: dict[bool, list[dict[Any,Any]|str]] = {
+      False: generate_book_header(book),
+      True: generate_lectern_header(book),
+    }
+    self.inserts: dict[tuple[str, Optional[str]], TextComponent] = {}
+
+  def insert(self, element: dict[Any, Any], lectern: bool) -> TextComponent:
+    key = (element["insert"], element.get("recipe")) # inserts render the same in the hand and lectern books
+    if (rendered := self.inserts.get(key)) is None:
+      rendered = self.inserts[key] = populate_insert(element, self.book, self.ctx, lectern)
+    return rendered
+
+  def stringify_page(self, page: TextComponent, lectern: bool = False) -> list[dict[Any,Any]|str]:
+    # populate insertions for a single value
+    if isinstance(page, dict):
+      if "insert" in page.keys():
+        page = self.insert(page, lectern)
+    # populate insertions for a list
+    elif isinstance(page, list):
+      page = [self.insert(e, lectern) if isinstance(e, dict) and "insert" in e.keys() else e for e in page]
+    # the page only holds references to the shared components, the storage is serialized without being modified
+    if isinstance(page, list):
+      return [*self.headers[lectern], *page]
+    return [*self.headers[lectern], page]
 
 
 
@@ -1719,14 +1742,15 @@ def generate_page_storage(book: Book, ctx: Context) -> any: # type: ignore
   hand_unlockable:dict[str,Any] = {}
   lectern_initial:list[Any] = [["\n\n",{"translate":"gui.gm4.guidebook.page","fallback":"","color":"white","font":"gm4:guidebook"}],["",{"translate":"gui.gm4.guidebook.page.toc","fallback":"","color":"white","font":"gm4:guidebook"}],["\n\n",{"translate":"gui.gm4.guidebook.page","fallback":"","color":"white","font":"gm4:guidebook"}],["\n\n",{"translate":"gui.gm4.guidebook.page","fallback":"","color":"white","font":"gm4:guidebook"}],["\n\n",{"translate":"gui.gm4.guidebook.page","fallback":"","color":"white","font":"gm4:guidebook"}]]
   lectern_unlockable:dict[str,Any] = {}
+  renderer = PageRenderer(book, ctx)
 
   for section_index, section in enumerate(book.sections):
     # check if the page is unlockable or initial
     if len(section.enable) == 0 and len(section.requirements) == 0 and len(section.prerequisites) == 0:
       # add page to initial book
       for page in section.pages:
-        hand_initial.append(stringify_page(page, book, ctx, False))
-        lectern_initial.append(stringify_page(page, book, ctx, True))
+        hand_initial.append(renderer.stringify_page(page, False))
+        lectern_initial.append(renderer.stringify_page(page, True))
     elif len(section.enable) != 0 and len(section.requirements) == 0 and len(section.prerequisites) == 0:      
       raise ValueError(f'Section "{section.name}" in "{book.id}" has both module dependencies and requirements')
     else:
@@ -1743,13 +1767,13 @@ def generate_page_storage(book: Book, ctx: Context) -> any: # type: ignore
             locked_text: list[dict[Any, Any]|str] = [{'insert':'title'},{'insert':'locked_text_title'}]
           else:
             locked_text: list[dict[Any, Any]|str] = [{'insert':'locked_text'}]
-          hand_initial.append(stringify_page(locked_text, book, ctx, False))
-          lectern_initial.append(stringify_page(locked_text, book, ctx, True))
+          hand_initial.append(renderer.stringify_page(locked_text, False))
+          lectern_initial.append(renderer.stringify_page(locked_text, True))
 
         # add page to unlockable map
         page_name = f"{section.name}_{page_index}" if (len(section.pages) > 1) else section.name
-        hand_unlockable[page_name] = stringify_page(page, book, ctx, False)
-        lectern_unlockable[page_name] = stringify_page(page, book, ctx, True)
+        hand_unlockable[page_name] = renderer.stringify_page(page, False)
+        lectern_unlockable[page_name] = renderer.stringify_page(page, True)
 
   lectern_initial.append(["\n\n",{"translate":"gui.gm4.guidebook.page","fallback":"","color":"white","font":"gm4:guidebook"}])
 
@@ -1925,6 +1949,23 @@ def clamp(x: int|float):
 
 
 
+"""
+Dominant colors of textures, stored in the beet cache under the sha1 of the texture file so each texture is only quantized once
+"""
+class TextureColors:
+  def __init__(self, ctx: Context):
+    self.colors: dict[str, str] = ctx.cache["texture_colors"].json.setdefault("colors", {})
+
+  def get(self, texture: PngFile|None) -> str:
+    if texture is None:
+      return "#000000"
+    digest = hashlib.sha1(texture.ensure_serialized()).hexdigest()
+    if (color := self.colors.get(digest)) is None:
+      color = self.colors[digest] = get_texture_color(texture)
+    return color
+
+
+
 """
 Reads an texture and finds the average dominant color
 """
@@ -1964,21 +2005,7 @@ def get_texture_color(texture: PngFile|None) -> str:
 """
 Looks for a single texture to represent a vanilla item, even in cases where the item has a model with multiple textures
 """
-def intuit_item_texture(item_id: str, vanilla: Vanilla) -> PngFile|None:
-    item_textures = vanilla.mount("assets/minecraft/textures/item").assets["minecraft"].textures
-    block_textures = vanilla.mount("assets/minecraft/textures/block").assets["minecraft"].textures
-    item_id = item_id.removeprefix("minecraft:")
-
-    # try invective mapping
-    if (r:=item_textures.get(f"item/{item_id}")):
-      return r
-    elif (r:=block_textures.get(f"block/{item_id}")):
-      return r
-    else: # exhaustively look for a fuzzy-esque name match
-      combined_textures = NamespaceContainer[Texture]()
-      combined_textures.merge(item_textures)
-      combined_textures.merge(block_textures)
-      for id, texture in combined_textures.items():
-        if f"block/{item_id}" not in id and f"item/{item_id}" not in id:
-          continue
-        return texture
+def intuit_item_texture(item_id: str, vanilla: VanillaData) -> PngFile|None:
+  if (path := vanilla.item_texture(f"minecraft:{item_id.removeprefix('minecraft:')}")) is None:
+    return None
+  return vanilla.texture(path)
@@ -1,5 +1,4 @@
 from beet import Context, Model, NamespaceProxy, ListOption, ResourcePack
-from beet.contrib.vanilla import Vanilla, ClientJar
 from beet.contrib.optifine import OptifineProperties
 from typing import Any, ClassVar, Literal
 from itertools import product, chain, count
@@ -8,6 +7,7 @@ import logging
 from copy import deepcopy
 
 from gm4.plugins.resource_pack import ModelData, TemplateOptions, JsonType
+from gm4.plugins.vanilla_index import VanillaIndex
 from gm4.utils import add_namespace, MapOption
 
 parent_logger = logging.getLogger("gm4."+__name__)
@@ -69,7 +69,7 @@ class ShamirTemplate(TemplateOptions):
 
     bound_ctx: ClassVar[Context]
     metallurgy_assets: ClassVar[ResourcePack] = ResourcePack(path="gm4_metallurgy") # load metallurgy textures so expansion shamirs can fall back on their
-    vanilla_models_jar: ClassVar[ClientJar]
+    vanilla_item_models: ClassVar[dict[str, JsonType]]
 
     def create_models(self, config: ModelData, models_container: NamespaceProxy[Model]) -> list[Model]:
         logger = parent_logger.getChild(self.bound_ctx.project_id)
@@ -149,7 +149,7 @@ class ShamirTemplate(TemplateOptions):
                 return ret_variants, ret_pointers
 
             # create texture variants, using the vanilla item definition as a template
-            mutatable_itemdef_copy = deepcopy(self.vanilla_models_jar.assets.item_models[f"minecraft:{item}"].data["model"])
+            mutatable_itemdef_copy = deepcopy(self.vanilla_item_models[f"minecraft:{item}"]["model"])
             item_variants, itemdef_compounds = recursive_extract_variants(mutatable_itemdef_copy)
             for item_variant, itemdef_compound in zip(item_variants, itemdef_compounds):
                 texture_variant = ('/'.join(texture.split('/')[0:-1] + [item_variant])) # is there an explicit texture for this variant. ie broken_elytra.png?
@@ -220,9 +220,7 @@ def optifine_armor_properties_merging(pack: ResourcePack, path: str, current: Op
 def beet_default(ctx: Context):
     # bind context object to a ClassVar so it can be accessed later during template processing
     ShamirTemplate.bound_ctx = ctx
-    vanilla = ctx.inject(Vanilla)
-    vanilla.minecraft_version = '1.21.5'
-    ShamirTemplate.vanilla_models_jar = vanilla.mount("assets/minecraft/items")
+    ShamirTemplate.vanilla_item_models = ctx.inject(VanillaIndex).get().item_models
     merge_policy(ctx)
 
 def merge_policy(ctx: Context):
@@ -1,5 +1,6 @@
 from beet import Context, Recipe, Advancement, LootTable, Function
-from beet.contrib.vanilla import Vanilla
+from copy import deepcopy
+from gm4.plugins.vanilla_index import VanillaIndex
 from gm4_guidebook.generate_guidebooks import CustomCrafterRecipe
 import logging
 
@@ -9,23 +10,18 @@ def beet_default(ctx: Context):
     """generates recipes for stair and slab decrafting
         NOTE: Function definitions for custom crafters is explicitly set to a 2x2"""
     
-    vanilla = ctx.inject(Vanilla)
-    vanilla.minecraft_version = '1.21.5'
-    item_tags = vanilla.mount("data/minecraft/tags/item").data.item_tags
-    recipes = vanilla.mount("data/minecraft/recipe").data.recipes
+    vanilla = ctx.inject(VanillaIndex).get()
+    item_tags = vanilla.item_tag_closure
+    recipes = vanilla.recipes
 
-    def recursive_apply(items: list[str], dir: str, shape: list[str], output_count: int, function: Function):
+    def apply_recipes(items: tuple[str, ...], dir: str, shape: list[str], output_count: int, function: Function):
         for item in items:
-            if "#" in item:
-                recursive_apply(item_tags[item.lstrip("#")].data["values"], dir, shape, output_count, function)
-                continue
-
             # get full block id from the vanilla stair recipe
             recipe = recipes.get(item)
             if not recipe:
                 logger.debug(f"No vanilla recipe found for {item}, skipping")
                 continue
-            input: str | list[str] = recipe.data["key"]["#"]
+            input: str | list[str] = recipe["key"]["#"]
             if isinstance(input, list):
                 output = input[0]
             else:
@@ -36,12 +32,13 @@ def beet_default(ctx: Context):
             output_recipe = recipes.get(output)
             if output_recipe is None:
                 group: str = output.removeprefix('minecraft:')
-            elif "group" in output_recipe.data:
-                group: str = output_recipe.data["group"]
+            elif "group" in output_recipe:
+                group: str = output_recipe["group"]
             else:
                 group: str = output.removeprefix('minecraft:')
-                output_recipe.data["group"] = group
-                output_recipe.data["__smithed__"] = {
+                output_recipe = deepcopy(output_recipe) # vanilla recipes are shared with the rest of the build
+                output_recipe["group"] = group
+                output_recipe["__smithed__"] = {
                     "rules": [
                         {
                             "type": "replace",
@@ -53,7 +50,7 @@ def beet_default(ctx: Context):
                         }
                     ]
                 }
-                ctx.data[output] = Recipe(output_recipe.data)
+                ctx.data[output] = Recipe(output_recipe)
 
             ctx.data[recipe_path] = Recipe({
                 "type": "minecraft:crafting_shaped",
@@ -158,9 +155,9 @@ def beet_default(ctx: Context):
             function.append(command)
     
     stairs_recipes = ctx.data[f"gm4_standard_crafting:stairs_recipes"] = Function(["##stairs"])
-    stairs: list[str] = item_tags["minecraft:stairs"].data['values']
-    recursive_apply(stairs, "stairs_decraft", ["##", "##"], 3, stairs_recipes)
+    stairs = item_tags.resolve("minecraft:stairs")
+    apply_recipes(stairs, "stairs_decraft", ["##", "##"], 3, stairs_recipes)
 
     slabs_recipes = ctx.data[f"gm4_standard_crafting:slabs_recipes"] = Function(["##slabs"])
-    slabs: list[str] = item_tags["minecraft:slabs"].data['values']
-    recursive_apply(slabs, "slab_decraft", ["##","##"], 2, slabs_recipes)
+    slabs = item_tags.resolve("minecraft:slabs")
+    apply_recipes(slabs, "slab_decraft", ["##","##"], 2, slabs_recipes)
@@ -5,7 +5,8 @@ from gm4.utils import CSV, CSVCell
 import json
 import nbtlib # type: ignore
 
-from beet import Context, Model, subproject
+from beet import Context, Model
+from gm4.template_batch import TemplateBatch
 
 def read_json(path: Path) -> Any:
     """
@@ -75,21 +76,13 @@ def generate_armor_recipes(ctx: Context, armor_flavors: CSV, armor_pieces: CSV):
             armor_items.append(item:=f"golden_{piece_data['piece']}")
             armor_models.update({item: (tex_model:=f"item/zauber_armor/{flavor_data['flavor']}/{piece_data['piece']}")})
 
-            subproject_config = {
-                "data_pack": {
-                    "load": [
-                        {
-                            f"data/gm4_zauber_cauldrons/function/recipes/armor/{piece_data['piece']}/select_flavor.mcfunction": "data/gm4_zauber_cauldrons/templates/functions/armor/select_flavor.mcfunction",
-                            f"data/gm4_zauber_cauldrons/function/recipes/armor/{piece_data['piece']}/{flavor_data['flavor']}.mcfunction": "data/gm4_zauber_cauldrons/templates/functions/armor/craft_piece.mcfunction",
-                            f"data/gm4_zauber_cauldrons/loot_table/items/armor/{piece_data['piece']}/{flavor_data['flavor']}.json": "data/gm4_zauber_cauldrons/templates/loot_tables/zauber_armor.json"
-                        }
-                    ],
-                    "render": {
-                        "functions": "*",
-                        "loot_tables": "*"
-                    }
+            ctx.inject(TemplateBatch).render(
+                load={
+                    f"data/gm4_zauber_cauldrons/function/recipes/armor/{piece_data['piece']}/select_flavor.mcfunction": "data/gm4_zauber_cauldrons/templates/functions/armor/select_flavor.mcfunction",
+                    f"data/gm4_zauber_cauldrons/function/recipes/armor/{piece_data['piece']}/{flavor_data['flavor']}.mcfunction": "data/gm4_zauber_cauldrons/templates/functions/armor/craft_piece.mcfunction",
+                    f"data/gm4_zauber_cauldrons/loot_table/items/armor/{piece_data['piece']}/{flavor_data['flavor']}.json": "data/gm4_zauber_cauldrons/templates/loot_tables/zauber_armor.json"
                 },
-                "meta": {
+                meta={
                     "armor_value": piece_data['armor'],
                     "flavor": flavor_data['flavor'],
                     "flavor_amount": flavor_data['amount'],
@@ -99,9 +92,7 @@ def generate_armor_recipes(ctx: Context, armor_flavors: CSV, armor_pieces: CSV):
                     "slot": piece_data['slot'],
                     "translate_fallback": piece_data['translate_fallback']
                 }
-            }
-
-            ctx.require(subproject(subproject_config))
+            )
 
             ctx.generate(tex_model, Model({
                 "parent": "minecraft:item/generated",
@@ -124,28 +115,19 @@ def generate_crystal_recipes(ctx: Context, crystal_effects: CSV, crystal_lores:
     """
     for effect_data in crystal_effects:
 
-        subproject_config = {
-            "data_pack": {
-                "load": [
-                    {
-                        f"data/gm4_zauber_cauldrons/function/recipes/crystals/effects/{effect_data['effect']}.mcfunction": "data/gm4_zauber_cauldrons/templates/functions/crystals/craft_crystal.mcfunction",
-                        f"data/gm4_zauber_cauldrons/loot_table/items/crystals/{effect_data['effect']}.json": "data/gm4_zauber_cauldrons/templates/loot_tables/zauber_crystal.json",
-                        f"data/gm4_zauber_cauldrons/loot_table/technical/replace_offhand_crystal/{effect_data['effect']}.json": "data/gm4_zauber_cauldrons/templates/loot_tables/replace_offhand_crystal.json"
-                    }
-                ],
-                "render": {
-                    "functions": "*",
-                    "loot_tables": "*"
-                }
+        ctx.inject(TemplateBatch).render(
+            load={
+                f"data/gm4_zauber_cauldrons/function/recipes/crystals/effects/{effect_data['effect']}.mcfunction": "data/gm4_zauber_cauldrons/templates/functions/crystals/craft_crystal.mcfunction",
+                f"data/gm4_zauber_cauldrons/loot_table/items/crystals/{effect_data['effect']}.json": "data/gm4_zauber_cauldrons/templates/loot_tables/zauber_crystal.json",
+                f"data/gm4_zauber_cauldrons/loot_table/technical/replace_offhand_crystal/{effect_data['effect']}.json": "data/gm4_zauber_cauldrons/templates/loot_tables/replace_offhand_crystal.json"
             },
-            "meta": {
+            meta={
                 "effect": effect_data['effect'],
                 "custom_potion_color": potion_effects.find_row(value=effect_data['effect'], by_column='effect')['custom_potion_color'].to_color_code(CSVCell.DEC),
                 "translate_fallback": effect_data['translate_fallback'],
                 "lore": json.dumps(crystal_lores[effect_data['effect']])
             }
-        }
-        ctx.require(subproject(subproject_config))
+        )
 
 
 def generate_potion_recipes(ctx: Context, potion_effects: CSV, potion_bottles: CSV, potion_lores: Dict[str, Any]):
@@ -155,21 +137,13 @@ def generate_potion_recipes(ctx: Context, potion_effects: CSV, potion_bottles: C
     for effect_data in potion_effects:
         for bottle_data in potion_bottles:
 
-            subproject_config = {
-                "data_pack": {
-                    "load": [
-                        {
-                            f"data/gm4_zauber_cauldrons/function/recipes/potions/{bottle_data['bottle']}/select_effect.mcfunction": "data/gm4_zauber_cauldrons/templates/functions/potions/select_effect.mcfunction",
-                            f"data/gm4_zauber_cauldrons/function/recipes/potions/{bottle_data['bottle']}/{effect_data['effect']}.mcfunction": "data/gm4_zauber_cauldrons/templates/functions/potions/craft_potion.mcfunction",
-                            f"data/gm4_zauber_cauldrons/loot_table/items/potions/{bottle_data['bottle']}/{effect_data['effect']}.json": "data/gm4_zauber_cauldrons/templates/loot_tables/zauber_potion.json"
-                        }
-                    ],
-                    "render": {
-                        "functions": "*",
-                        "loot_tables": "*"
-                    }
+            ctx.inject(TemplateBatch).render(
+                load={
+                    f"data/gm4_zauber_cauldrons/function/recipes/potions/{bottle_data['bottle']}/select_effect.mcfunction": "data/gm4_zauber_cauldrons/templates/functions/potions/select_effect.mcfunction",
+                    f"data/gm4_zauber_cauldrons/function/recipes/potions/{bottle_data['bottle']}/{effect_data['effect']}.mcfunction": "data/gm4_zauber_cauldrons/templates/functions/potions/craft_potion.mcfunction",
+                    f"data/gm4_zauber_cauldrons/loot_table/items/potions/{bottle_data['bottle']}/{effect_data['effect']}.json": "data/gm4_zauber_cauldrons/templates/loot_tables/zauber_potion.json"
                 },
-                "meta": {
+                meta={
                     "effect": effect_data['effect'],
                     "effect_translate_name": effect_data['effect_translate_name'],
                     "custom_potion_color": effect_data['custom_potion_color'].to_color_code(CSVCell.DEC),
@@ -181,8 +155,7 @@ def generate_potion_recipes(ctx: Context, potion_effects: CSV, potion_bottles: C
                     "sips_translate_fallback": bottle_data['sips_translate_fallback'],
                     "lore": json.dumps(potion_lores[effect_data['effect']])
                 }
-            }
-            ctx.require(subproject(subproject_config))
+            )
 
         ctx.meta["gm4"]["model_data"].append({
             "item": ["potion", "splash_potion", "lingering_potion"],
@@ -197,23 +170,15 @@ def generate_magicol_recipes(ctx: Context, weather_modifiers: CSV, magicol_color
     """
     for bottle_data, color_data, modifier_data in product(potion_bottles, magicol_colors, weather_modifiers):
 
-        subproject_config = {
-            "data_pack": {
-                "load": [
-                    {
-                        f"data/gm4_zauber_cauldrons/function/recipes/magicol/{color_data['color']}.mcfunction": "data/gm4_zauber_cauldrons/templates/functions/magicol/craft_liquid_magicol.mcfunction",
-                        f"data/gm4_zauber_cauldrons/function/recipes/magicol/bottled/{bottle_data['bottle']}/select_color.mcfunction": "data/gm4_zauber_cauldrons/templates/functions/magicol/select_color.mcfunction",
-                        f"data/gm4_zauber_cauldrons/function/recipes/magicol/bottled/{bottle_data['bottle']}/{color_data['color']}/select_weather_modifier.mcfunction": "data/gm4_zauber_cauldrons/templates/functions/magicol/select_weather_modifier.mcfunction",
-                        f"data/gm4_zauber_cauldrons/function/recipes/magicol/bottled/{bottle_data['bottle']}/{color_data['color']}/{modifier_data['modifier']}.mcfunction": "data/gm4_zauber_cauldrons/templates/functions/magicol/craft_bottled_magicol.mcfunction",
-                        f"data/gm4_zauber_cauldrons/loot_table/items/bottled_magicol/{bottle_data['bottle']}/{color_data['color']}/{modifier_data['modifier']}.json": "data/gm4_zauber_cauldrons/templates/loot_tables/bottled_magicol.json"
-                    }
-                ],
-                "render": {
-                    "functions": "*",
-                    "loot_tables": "*"
-                }
+        ctx.inject(TemplateBatch).render(
+            load={
+                f"data/gm4_zauber_cauldrons/function/recipes/magicol/{color_data['color']}.mcfunction": "data/gm4_zauber_cauldrons/templates/functions/magicol/craft_liquid_magicol.mcfunction",
+                f"data/gm4_zauber_cauldrons/function/recipes/magicol/bottled/{bottle_data['bottle']}/select_color.mcfunction": "data/gm4_zauber_cauldrons/templates/functions/magicol/select_color.mcfunction",
+                f"data/gm4_zauber_cauldrons/function/recipes/magicol/bottled/{bottle_data['bottle']}/{color_data['color']}/select_weather_modifier.mcfunction": "data/gm4_zauber_cauldrons/templates/functions/magicol/select_weather_modifier.mcfunction",
+                f"data/gm4_zauber_cauldrons/function/recipes/magicol/bottled/{bottle_data['bottle']}/{color_data['color']}/{modifier_data['modifier']}.mcfunction": "data/gm4_zauber_cauldrons/templates/functions/magicol/craft_bottled_magicol.mcfunction",
+                f"data/gm4_zauber_cauldrons/loot_table/items/bottled_magicol/{bottle_data['bottle']}/{color_data['color']}/{modifier_data['modifier']}.json": "data/gm4_zauber_cauldrons/templates/loot_tables/bottled_magicol.json"
             },
-            "meta": {
+            meta={
                 "color": color_data['color'],
                 "potion_color": color_data['potion_color'].to_color_code(CSVCell.DEC),
                 "bottle": bottle_data['bottle'],
@@ -227,8 +192,7 @@ def generate_magicol_recipes(ctx: Context, weather_modifiers: CSV, magicol_color
                 "color_translate_fallback": color_data['color_translate_fallback'],
                 "soulution_translate_fallback": modifier_data['soulution_translate_fallback']
             }
-        }
-        ctx.require(subproject(subproject_config))
+        )
 
     for color_data in magicol_colors:
         ctx.meta["gm4"]["model_data"].append({
@@ -257,21 +221,13 @@ def generate_zauber_biomes(ctx: Context, weather_modifiers: CSV, magicol_colors:
             biome_particle = '"particle":{"options":{"type":"minecraft:dust","color":' + color_data.get(
                 f"particle_color_{modifier_data['modifier']}", 7979098).to_color_code(CSVCell.FLOAT) + ',"scale":2},"probability":0.002},'
 
-        subproject_config = {
-            "data_pack": {
-                "load": [
-                    {
-                        f"data/gm4_zauber_cauldrons/function/bottled_magicol/{color_data['color']}/select_weather_modifier.mcfunction": "data/gm4_zauber_cauldrons/templates/functions/bottled_magicol/select_weather_modifier.mcfunction",
-                        f"data/gm4_zauber_cauldrons/function/bottled_magicol/{color_data['color']}/{modifier_data['modifier']}.mcfunction": "data/gm4_zauber_cauldrons/templates/functions/bottled_magicol/color_biome.mcfunction",
-                        f"data/gm4_zauber_cauldrons/worldgen/biome/{adjective}{modifier_data['modifier']}_{color_data['color']}_verzauberte_plains.json": "data/gm4_zauber_cauldrons/templates/worldgen/biome/verzauberte_plains.json"
-                    }
-                ],
-                "render": {
-                    "functions": "*",
-                    "worldgen_biomes": "*"
-                }
+        ctx.inject(TemplateBatch).render(
+            load={
+                f"data/gm4_zauber_cauldrons/function/bottled_magicol/{color_data['color']}/select_weather_modifier.mcfunction": "data/gm4_zauber_cauldrons/templates/functions/bottled_magicol/select_weather_modifier.mcfunction",
+                f"data/gm4_zauber_cauldrons/function/bottled_magicol/{color_data['color']}/{modifier_data['modifier']}.mcfunction": "data/gm4_zauber_cauldrons/templates/functions/bottled_magicol/color_biome.mcfunction",
+                f"data/gm4_zauber_cauldrons/worldgen/biome/{adjective}{modifier_data['modifier']}_{color_data['color']}_verzauberte_plains.json": "data/gm4_zauber_cauldrons/templates/worldgen/biome/verzauberte_plains.json"
             },
-            "meta": {
+            meta={
                 "color": color_data['color'],
                 "potion_color": color_data['potion_color'].to_color_code(CSVCell.DEC),
                 "weather_modifier": modifier_data['modifier'],
@@ -286,8 +242,7 @@ def generate_zauber_biomes(ctx: Context, weather_modifiers: CSV, magicol_colors:
                 "biome_particle": biome_particle,
                 "flower": flower_types.find_row(color_data['flower'], 'flower').get('flower', 'short_grass') # only add flowers which are registered as zauber flowers
             }
-        }
-        ctx.require(subproject(subproject_config))
+        )
 
 
 def generate_flower_features(ctx: Context, flower_types: CSV):
@@ -296,21 +251,12 @@ def generate_flower_features(ctx: Context, flower_types: CSV):
     """
     for flower_data in flower_types:
 
-        subproject_config = {
-            "data_pack": {
-                "load": [
-                    {
-                        f"data/gm4_zauber_cauldrons/worldgen/configured_feature/{flower_data['flower']}_patch.json": "data/gm4_zauber_cauldrons/templates/worldgen/configured_feature/flower_patch.json",
-                        f"data/gm4_zauber_cauldrons/worldgen/placed_feature/{flower_data['flower']}_patch.json": "data/gm4_zauber_cauldrons/templates/worldgen/placed_feature/flower_patch.json"
-                    }
-                ],
-                "render": {
-                    "worldgen_configured_features": "*",
-                    "worldgen_placed_features": "*"
-                }
+        ctx.inject(TemplateBatch).render(
+            load={
+                f"data/gm4_zauber_cauldrons/worldgen/configured_feature/{flower_data['flower']}_patch.json": "data/gm4_zauber_cauldrons/templates/worldgen/configured_feature/flower_patch.json",
+                f"data/gm4_zauber_cauldrons/worldgen/placed_feature/{flower_data['flower']}_patch.json": "data/gm4_zauber_cauldrons/templates/worldgen/placed_feature/flower_patch.json"
             },
-            "meta": {
+            meta={
                 "flower": flower_data['flower']
             }
-        }
-        ctx.require(subproject(subproject_config))
+        )
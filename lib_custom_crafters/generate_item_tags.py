@@ -1,11 +1,9 @@
 from beet import Context, Function, Predicate
-from beet.contrib.vanilla import Vanilla
+from gm4.plugins.vanilla_index import VanillaIndex
 
 def beet_default(ctx: Context):
   """Creates a predicate for every vanilla item tag and a function checking all of these predicates."""
-  vanilla = ctx.inject(Vanilla)
-  vanilla.minecraft_version = '1.21.5'
-  item_tags = vanilla.data.item_tags
+  item_tags = ctx.inject(VanillaIndex).get().item_tags
   item_tags = [
     id.removeprefix("minecraft:")
     for id in item_tags
@@ -0,0 +1,88 @@
+from gm4.benchmark import compare, format_comparison
+from gm4.plugins.parallel import merge_registry
+from gm4.plugins.resource_pack import ModelDataRegistry, merge_range_dispatch_entries
+from gm4.plugins.vanilla_index import TagClosure
+from gm4_guidebook.generate_guidebooks import GlyphMetrics
+
+
+def test_merge_registry_applies_issued_and_removed():
+    initial = {"items": {"minecraft:stick": {"gm4_a:old": 1, "gm4_b:kept": 2}}}
+    registry = {"items": {"minecraft:stick": {"gm4_a:old": 1, "gm4_b:kept": 2}}}
+    worker = {"items": {"minecraft:stick": {"gm4_b:kept": 2, "gm4_a:new": 1}, "minecraft:apple": {"gm4_a:apple": 3}}}
+
+    assert merge_registry(registry, initial, worker) == []
+    assert registry["items"] == {"minecraft:stick": {"gm4_b:kept": 2, "gm4_a:new": 1}, "minecraft:apple": {"gm4_a:apple": 3}}
+
+
+def test_merge_registry_reports_conflicts_without_applying():
+    initial = {"items": {"minecraft:stick": {}}}
+    registry = {"items": {"minecraft:stick": {"gm4_a:first": 1}}} # merged from another worker
+    worker = {"items": {"minecraft:stick": {"gm4_b:second": 1}}}
+
+    assert merge_registry(registry, initial, worker) == ["1 on minecraft:stick"]
+    assert registry["items"] == {"minecraft:stick": {"gm4_a:first": 1}}
+
+    worker = {"items": {"minecraft:stick": {"gm4_a:first": 2}}}
+    assert merge_registry(registry, initial, worker) == ["'gm4_a:first' on minecraft:stick"]
+
+
+def test_lowest_free():
+    registry = ModelDataRegistry({"items": {"minecraft:stick": {"a": 1, "b": 2}, "minecraft:apple": {"c": 4}}})
+    assert registry.lowest_free(["minecraft:stick"], 1, 10) == 3
+    assert registry.lowest_free(["minecraft:stick", "minecraft:apple"], 3, 10) == 3
+    assert registry.lowest_free(["minecraft:stick", "minecraft:apple"], 4, 10) == 5
+    assert registry.lowest_free(["minecraft:stick"], 1, 2) is None
+
+    registry.remove("minecraft:stick", "a")
+    assert registry.lowest_free(["minecraft:stick"], 1, 10) == 1
+
+
+def test_merge_range_dispatch_entries():
+    entry = lambda threshold, model: {"threshold": threshold, "model": model} # type: ignore
+    runs = [
+        [entry(1, "a"), entry(5, "a")],
+        [entry(9, "b"), entry(3, "b"), entry(5, "b")], # unsorted
+        [],
+    ]
+    merged = merge_range_dispatch_entries(runs)
+    assert [(e["threshold"], e["model"]) for e in merged] == [(1, "a"), (3, "b"), (5, "a"), (9, "b")]
+
+
+def test_tag_closure():
+    closure = TagClosure.build({
+        "minecraft:logs": {"values": ["minecraft:oak_log", "#minecraft:birch_logs"]},
+        "minecraft:birch_logs": {"values": ["minecraft:birch_log", {"id": "minecraft:stripped_birch_log", "required": False}]},
+        "minecraft:cycle_a": {"values": ["minecraft:a", "#minecraft:cycle_b"]},
+        "minecraft:cycle_b": {"values": ["minecraft:b", "#minecraft:cycle_a", "#minecraft:missing"]},
+    })
+    assert closure.resolve("#minecraft:logs") == ("minecraft:oak_log", "minecraft:birch_log", "minecraft:stripped_birch_log")
+    assert set(closure.tags["minecraft:birch_log"]) == {"minecraft:logs", "minecraft:birch_logs"}
+
+    assert set(closure.resolve("minecraft:cycle_a")) == {"minecraft:a", "minecraft:b"}
+    assert "minecraft:b" in closure.resolve("minecraft:cycle_b")
+
+
+def test_glyph_metrics_wrap():
+    metrics = GlyphMetrics({"a": 5, "b": 10, "一": {"unicode": 9}})
+    assert metrics.measure("ab") == 15
+    assert metrics.measure("一") == 9
+    assert metrics.measure("?") == GlyphMetrics.MISSING_ADVANCE
+
+    assert metrics.wrap("aa aa aa", width=24) == ["aa aa", "aa"]
+    assert metrics.wrap("bbbbb", width=24) == ["bb", "bb", "b"] # words wider than a line are split
+    assert metrics.wrap("") == [""]
+
+
+def test_compare():
+    baseline = {"scenarios": {"full": {"median_ms": 100.0}, "removed": {"median_ms": 5.0}}, "environment": {"platform": "linux", "python": "3.11"}}
+    results = {"scenarios": {"full": {"median_ms": 120.0}, "new": {"median_ms": 1.0}}}
+
+    [comparison] = compare(results, baseline, tolerance=0.1)
+    assert comparison.scenario == "full"
+    assert comparison.regressed
+    assert abs(comparison.ratio - 1.2) < 1e-9
+    assert not compare(results, baseline, tolerance=0.25)[0].regressed
+
+    report = format_comparison([comparison], baseline)
+    assert "REGRESSION" in report
+    assert "linux" in report
@@ -0,0 +1,37 @@
+from beet import Advancement, DataPack, Function, ResourcePack, TextFile, Texture, run_beet
+
+from gm4.plugins.build_cache import BuildCache, CachedBuild
+from gm4.plugins.player_heads import Skin
+
+
+def test_restore_round_trip(tmp_path):
+    rp = ResourcePack("gm4_example")
+    rp["gm4_example:item/example"] = Texture(b"\x89PNG fake")
+    dp = DataPack("gm4_example", compression="deflate")
+    dp.extend_namespace.append(Skin)
+    dp["gm4_example:tick"] = Function(["say hi"])
+    dp["gm4_example:root"] = Advancement({"criteria": {}})
+    dp["gm4_example:example"] = Skin(b"skin")
+    dp.extra["README.md"] = TextFile("# Example")
+    dp.overlays["overlay_example"]["gm4_example:tick"] = Function(["say overlay"])
+    params = {"name": "Example", "version": "1.0"}
+
+    with run_beet({"directory": str(tmp_path)}) as ctx:
+        build_cache = ctx.inject(BuildCache)
+        build = CachedBuild(key="abc", packets=[(rp, dp, params)], gui_font_count=0, modeldata={}, pack_hash="123")
+        build_cache.store("gm4_example", build)
+
+        assert build_cache.lookup("gm4_example", "other", 0) is None
+        restored = build_cache.lookup("gm4_example", "abc", 0)
+
+    assert restored is not None
+    assert restored.pack_hash == "123"
+    [(restored_rp, restored_dp, restored_params)] = restored.packets
+    assert restored_params == params
+    assert restored_rp == rp
+    assert restored_dp == dp
+    assert restored_dp.name == "gm4_example"
+    assert not restored_dp.zipped
+    assert restored_dp.compression == "deflate"
+    assert isinstance(restored_dp[Skin]["gm4_example:example"], Skin)
+    assert restored_dp.overlays["overlay_example"].functions["gm4_example:tick"].lines == ["say overlay"]
@@ -0,0 +1,55 @@
+import subprocess
+
+from gm4.utils import git_head
+
+
+def git(directory, *args):
+    return subprocess.run(["git", *args], cwd=directory, capture_output=True, encoding="utf8", check=True).stdout.strip()
+
+
+def init_repo(path):
+    path.mkdir()
+    git(path, "init", "-q", "-b", "main")
+    git(path, "config", "user.name", "test")
+    git(path, "config", "user.email", "test@example.com")
+    (path / "file.txt").write_text("one")
+    git(path, "add", "file.txt")
+    git(path, "commit", "-q", "-m", "First commit", "-m", "body text")
+    return path
+
+
+def expected(directory):
+    full_hash, short_hash, subject = git(directory, "log", "-1", "--format=%H%n%h%n%s").split("\n")
+    return full_hash, short_hash, subject
+
+
+def test_loose_ref(tmp_path):
+    repo = init_repo(tmp_path / "repo")
+    commit = git_head(repo)
+    assert (commit.hash, commit.short_hash, commit.subject) == expected(repo)
+    assert commit.subject == "First commit"
+
+
+def test_packed_ref(tmp_path):
+    repo = init_repo(tmp_path / "repo")
+    git(repo, "pack-refs", "--all")
+    assert not (repo / ".git/refs/heads/main").exists()
+    assert git_head(repo).hash == expected(repo)[0]
+
+
+def test_new_commit_is_read(tmp_path):
+    repo = init_repo(tmp_path / "repo")
+    git_head(repo)
+    (repo / "file.txt").write_text("two")
+    git(repo, "commit", "-q", "-am", "Second commit")
+    assert git_head(repo).subject == "Second commit"
+
+
+def test_detached_worktree_from_subfolder(tmp_path):
+    repo = init_repo(tmp_path / "repo")
+    first = expected(repo)[0]
+    (repo / "file.txt").write_text("two")
+    git(repo, "commit", "-q", "-am", "Second commit")
+    git(repo, "worktree", "add", "-q", "--detach", str(tmp_path / "worktree"), first)
+    (tmp_path / "worktree" / "sub").mkdir()
+    assert git_head(tmp_path / "worktree" / "sub").hash == first
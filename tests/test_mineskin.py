@@ -0,0 +1,54 @@
+import logging
+import threading
+from io import BytesIO
+
+import pytest
+from PIL import Image
+
+from gm4.mineskin_stub import MineskinStub
+from gm4.plugins.player_heads import MINESKIN_ATTEMPTS, MineskinScheduler, Skin, SkinUpload
+
+
+@pytest.fixture
+def stub():
+    servers: list[MineskinStub] = []
+
+    def start(delay: float, concurrency: int) -> MineskinStub:
+        server = MineskinStub(("localhost", 0), delay, concurrency)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def skin_uploads(count: int) -> list[SkinUpload]:
+    uploads: list[SkinUpload] = []
+    for i in range(count):
+        buf = BytesIO()
+        Image.new("RGBA", (64, 64), (i, 0, 0, 255)).save(buf, format="PNG")
+        uploads.append(SkinUpload(f"gm4_example:skin_{i}", Skin(buf.getvalue()), str(i)))
+    return uploads
+
+
+def test_uploads_wait_for_next_request(stub):
+    server = stub(delay=0.05, concurrency=1)
+    uploads = skin_uploads(4)
+    MineskinScheduler("token", logging.getLogger("test"), concurrency=4, api=server.url).upload_all(uploads)
+
+    assert sorted(server.uploads) == sorted(u.filename for u in uploads)
+    assert all(u.done and u.result is not None for u in uploads)
+    value, uuid = uploads[0].result
+    assert len(uuid) == 4 and value
+
+
+def test_ratelimit_retries_are_bounded(stub):
+    server = stub(delay=0.01, concurrency=0) # answers every request with 429
+    [upload] = skin_uploads(1)
+    MineskinScheduler("token", logging.getLogger("test"), api=server.url).upload_all([upload])
+
+    assert upload.failed
+    assert server.rejected == MINESKIN_ATTEMPTS